@@ -4,6 +4,7 @@
 #@markdown Run this cell to visualize the final receptor-pocket-peptide candidates in 3D.
 
 import os
+import sys
 import glob
 import json
 import ipywidgets as widgets
@@ -42,21 +43,31 @@ def visualize_candidates():
         extracted_pocket_path = standard_pocket_path
     
     # 2. Find Candidates
-    run_base = os.path.join(initial_path, "FrankPEPstein_run")
-    # Recursive glob to match: FrankPEPstein_run/**/top_*_peps
-    candidate_folders = glob.glob(os.path.join(run_base, "**", "top_*_peps"), recursive=True)
-    
-    if not candidate_folders:
-        print("❌ No candidate results found. Run fragments generation first.")
-        return
+    # Final candidates from the run-level results store written by FrankVINA 2
+    repo_path = os.path.join(initial_path, "FrankPEPstein")
+    if repo_path not in sys.path:
+        sys.path.append(repo_path)
+    from scripts.results_db import final_candidates, results_path
+
+    pdb_files = [pose for score, ligand, pose in final_candidates(results_path(initial_path))]
+    if pdb_files:
+        print(f"Visualizing {len(pdb_files)} candidates from: {os.path.dirname(pdb_files[0])}")
+    else:
+        # Runs from before the results store: FrankPEPstein_run/**/top_*_peps
+        run_base = os.path.join(initial_path, "FrankPEPstein_run")
+        candidate_folders = glob.glob(os.path.join(run_base, "**", "top_*_peps"), recursive=True)
         
-    target_folder = sorted(candidate_folders, key=os.path.getmtime, reverse=True)[0]
-    print(f"Visualizing candidates from: {target_folder}")
-    
-    pdb_files = glob.glob(os.path.join(target_folder, "*.pdb"))
-    if not pdb_files:
-        print("❌ No PDB files found in target folder.")
-        return
+        if not candidate_folders:
+            print("❌ No candidate results found. Run fragments generation first.")
+            return
+            
+        target_folder = sorted(candidate_folders, key=os.path.getmtime, reverse=True)[0]
+        print(f"Visualizing candidates from: {target_folder}")
+        
+        pdb_files = glob.glob(os.path.join(target_folder, "*.pdb"))
+        if not pdb_files:
+            print("❌ No PDB files found in target folder.")
+            return
 
     # 3. Render
     try:
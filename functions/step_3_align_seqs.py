@@ -6,6 +6,7 @@
 #@markdown 3. Visualizes conserved motifs using a Sequence Logo.
 
 import os
+import sys
 import glob
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -17,24 +18,30 @@ import re
 initial_path = os.getcwd()
 run_base = os.path.join(initial_path, "FrankPEPstein_run")
 
-# Find the specific run folder with results (frankPEPstein_X/top_Y_peps)
-# We need to search recursively or assume standard structure.
-# Structure: FrankPEPstein_run/frankPEPstein_{pep_size}/top_{candidates}_peps/
+# Final candidates are read from the run-level results store written by FrankVINA 2
+# (FrankPEPstein_run/results.sqlite), best score first.
+repo_path = os.path.join(initial_path, "FrankPEPstein")
+if repo_path not in sys.path:
+    sys.path.append(repo_path)
+from scripts.results_db import final_candidates, results_path
 
-# Recursive glob to match: FrankPEPstein_run/**/top_*_peps
-candidate_folders = glob.glob(os.path.join(run_base, "**", "top_*_peps"), recursive=True)
+candidates = final_candidates(results_path(initial_path))
+pdb_files = [pose for score, ligand, pose in candidates]
+target_folder = os.path.dirname(pdb_files[0]) if pdb_files else None
 
-if not candidate_folders:
+if target_folder is None:
+    # Runs from before the results store: FrankPEPstein_run/**/top_*_peps
+    candidate_folders = glob.glob(os.path.join(run_base, "**", "top_*_peps"), recursive=True)
+    if candidate_folders:
+        # Use the most recent one if multiple, sorted by modification time
+        target_folder = sorted(candidate_folders, key=os.path.getmtime, reverse=True)[0]
+        pdb_files = glob.glob(os.path.join(target_folder, "*.pdb"))
+
+if target_folder is None:
     print("❌ No candidate results found from Step 2.")
 else:
-    # Use the most recent one if multiple (though pipeline likely cleans up)
-    # Sort by modification time
-    target_folder = sorted(candidate_folders, key=os.path.getmtime, reverse=True)[0]
     print(f"Analyzing results from: {target_folder}")
     
-    # 1. Extract Sequences
-    pdb_files = glob.glob(os.path.join(target_folder, "*.pdb")) # Actually frag*.pdb or similar? frankVINA_2 outputs top PDBs.
-    
     sequences = []
     
     # Check if files exist
@@ -5,7 +5,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
-from scipy.spatial import ConvexHull, Delaunay
+from scipy.spatial import ConvexHull, Delaunay, cKDTree
 from io import BytesIO
 
 # --- Constants ---
@@ -117,14 +117,11 @@ def render_static_view(receptor_path, pocket_path, box_center, box_size, fragmen
             colors = [ATOM_COLORS.get(a['element'], 'gray') for a in f_atoms]
             ax.scatter(f_coords[:,0], f_coords[:,1], f_coords[:,2], c=colors, s=30, alpha=1.0)
             
-            # Draw bonds (simple loop)
-            for i in range(len(f_atoms)):
-                for j in range(i+1, len(f_atoms)):
-                    p1 = f_coords[i]
-                    p2 = f_coords[j]
-                    dist = np.linalg.norm(p1-p2)
-                    if dist < 1.8: # Bond length
-                        ax.plot([p1[0], p2[0]], [p1[1], p2[1]], [p1[2], p2[2]], color='white', linewidth=1)
+            # Draw bonds (atom pairs closer than bond length)
+            for i, j in cKDTree(f_coords).query_pairs(1.8, output_type="ndarray"):
+                p1 = f_coords[i]
+                p2 = f_coords[j]
+                ax.plot([p1[0], p2[0]], [p1[1], p2[1]], [p1[2], p2[2]], color='white', linewidth=1)
 
     # 7. Gridbox (Red Corners/Edges)
     cx, cy, cz = box_center
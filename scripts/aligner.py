@@ -0,0 +1,364 @@
+import os
+import sys
+import json
+import random
+import argparse
+import subprocess
+from collections import namedtuple
+from itertools import combinations
+
+import numpy as np
+
+from scratch import link_into, scratch_dir
+
+# Result of aligning a mobile pocket (minipocket) onto a target pocket.
+# The transform follows the Bio.PDB convention (Atom.transform):
+#   moved = coords @ rotation + translation
+AlignmentResult = namedtuple(
+    "AlignmentResult", ["rmsd", "overlap", "matched", "rotation", "translation"])
+
+# Acceptance thresholds of superposer.py (tuned on CLICK output): full overlap,
+# RMSD within -rmsd and at least MIN_MATCHED matched atoms
+MIN_OVERLAP = 100
+MIN_MATCHED = 3
+
+# Representative atoms of a pocket: CA coordinates in file order.
+PocketCoords = namedtuple("PocketCoords", ["name", "ca", "path"])
+
+
+def load_pocket_coords(pdb_file, name=None):
+    """
+    Reads CA coordinates of a pocket PDB without building a Bio.PDB structure
+    """
+    ca = []
+    with open(pdb_file) as f:
+        for line in f:
+            if line.startswith(("ATOM", "HETATM")) and line[12:16].strip() == "CA":
+                ca.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    if name is None:
+        name = os.path.basename(pdb_file).replace(".pdb", "")
+    return PocketCoords(name, np.array(ca, dtype=np.float64).reshape(-1, 3), pdb_file)
+
+
+def kabsch(mobile, target):
+    """
+    Least-squares rotation/translation moving mobile onto target.
+    Accepts (n, 3) arrays or stacks of them with shape (p, n, 3).
+    """
+    mobile_center = mobile.mean(axis=-2, keepdims=True)
+    target_center = target.mean(axis=-2, keepdims=True)
+    h = np.swapaxes(mobile - mobile_center, -1, -2) @ (target - target_center)
+    u, _, vt = np.linalg.svd(h)
+    # Avoid reflections
+    d = np.sign(np.linalg.det(u @ vt))
+    vt = vt.copy()
+    vt[..., 2, :] *= d[..., None]
+    rotation = u @ vt
+    translation = (target_center - mobile_center @ rotation)[..., 0, :]
+    return rotation, translation
+
+
+def _rmsd(a, b):
+    return float(np.sqrt(((a - b) ** 2).sum(axis=-1).mean()))
+
+
+def accepts(alignment, rmsd_allowed, min_matched=MIN_MATCHED):
+    """
+    True when an alignment passes the superposer acceptance criteria
+    """
+    return (alignment is not None and alignment.overlap >= MIN_OVERLAP and alignment.rmsd <= rmsd_allowed
+            and alignment.matched >= min_matched)
+
+
+class Aligner:
+    """
+    Base class for pocket aligners. Subclasses return an AlignmentResult
+    (or None when no alignment could be produced) for a mobile/target pair.
+    """
+    name = None
+
+    def align(self, mobile, target):
+        raise NotImplementedError
+
+    def align_many(self, mobile, targets):
+        """
+        One alignment (or None) per target; backends may share mobile-side work
+        """
+        return [self.align(mobile, target) for target in targets]
+
+
+class NumpyAligner(Aligner):
+    """
+    In-process clique-style aligner on CA atoms.
+
+    Seeds are triangles of the mobile pocket matched to target triangles with
+    compatible side lengths; every seed is superposed at once (batched Kabsch),
+    the best-covering seeds are extended to a one-to-one residue matching and
+    refined until the matching is stable. Overlap is reported as CLICK does:
+    percentage of the smaller structure's atoms that were matched.
+    """
+    name = "numpy"
+
+    def __init__(self, distance_tolerance=1.0, match_cutoff=2.0, max_seeds=10,
+                 max_candidates=4000, refine_top=5, refine_iterations=5):
+        self.distance_tolerance = distance_tolerance
+        self.match_cutoff = match_cutoff
+        self.max_seeds = max_seeds
+        self.max_candidates = max_candidates
+        self.refine_top = refine_top
+        self.refine_iterations = refine_iterations
+
+    def _seed_triangles(self, dist_mobile):
+        # Prefer well-conditioned triangles (largest shortest side)
+        triangles = np.array(list(combinations(range(len(dist_mobile)), 3)))
+        i, j, k = triangles.T
+        shortest = np.minimum(np.minimum(dist_mobile[i, j], dist_mobile[i, k]), dist_mobile[j, k])
+        order = np.argsort(-shortest, kind="stable")
+        return triangles[order[:self.max_seeds]]
+
+    def _target_triangles(self, dist_mobile, dist_target, i, j, k):
+        tol = self.distance_tolerance
+        pairs = np.argwhere(np.abs(dist_target - dist_mobile[i, j]) < tol)
+        if len(pairs) == 0:
+            return pairs.reshape(0, 3)
+        a, b = pairs.T
+        third = ((np.abs(dist_target[a] - dist_mobile[i, k]) < tol)
+                 & (np.abs(dist_target[b] - dist_mobile[j, k]) < tol))
+        third[np.arange(len(a)), a] = False
+        third[np.arange(len(a)), b] = False
+        p, c = np.nonzero(third)
+        return np.column_stack([a[p], b[p], c])[:self.max_candidates]
+
+    def _match(self, moved, target):
+        """
+        Greedy one-to-one matching of moved mobile atoms to target atoms.
+        """
+        dist = np.sqrt(((moved[:, None, :] - target[None, :, :]) ** 2).sum(axis=-1))
+        mob_idx, tgt_idx = np.nonzero(dist < self.match_cutoff)
+        order = np.argsort(dist[mob_idx, tgt_idx], kind="stable")
+        used_mob, used_tgt, pairs = set(), set(), []
+        for idx in order:
+            m, t = mob_idx[idx], tgt_idx[idx]
+            if m not in used_mob and t not in used_tgt:
+                used_mob.add(m)
+                used_tgt.add(t)
+                pairs.append((m, t))
+        pairs.sort()
+        return np.array(pairs, dtype=int).reshape(-1, 2)
+
+    def _refine(self, mobile, target, rotation, translation):
+        pairs = self._match(mobile @ rotation + translation, target)
+        for _ in range(self.refine_iterations):
+            if len(pairs) < 3:
+                break
+            rotation, translation = kabsch(mobile[pairs[:, 0]], target[pairs[:, 1]])
+            new_pairs = self._match(mobile @ rotation + translation, target)
+            if np.array_equal(new_pairs, pairs):
+                break
+            pairs = new_pairs
+        return pairs, rotation, translation
+
+    def align(self, mobile, target):
+        return self.align_many(mobile, [target])[0]
+
+    def align_many(self, mobile, targets):
+        # Mobile distances and seed triangles are computed once for all targets
+        mob = np.asarray(mobile.ca, dtype=np.float64)
+        if len(mob) < 3:
+            return [None] * len(targets)
+        dist_mobile = np.sqrt(((mob[:, None] - mob[None]) ** 2).sum(axis=-1))
+        seed_triangles = self._seed_triangles(dist_mobile)
+        return [self._align_prepared(mob, dist_mobile, seed_triangles, target) for target in targets]
+
+    def _align_prepared(self, mob, dist_mobile, seed_triangles, target):
+        tgt = np.asarray(target.ca, dtype=np.float64)
+        if len(tgt) < 3:
+            return None
+        # Featurized targets (target_pocket.TargetPocket) carry their distance matrix
+        dist_target = getattr(target, "ca_distances", None)
+        if dist_target is None:
+            dist_target = np.sqrt(((tgt[:, None] - tgt[None]) ** 2).sum(axis=-1))
+
+        best = None
+        for i, j, k in seed_triangles:
+            seeds = self._target_triangles(dist_mobile, dist_target, i, j, k)
+            if len(seeds) == 0:
+                continue
+            rotations, translations = kabsch(
+                np.broadcast_to(mob[[i, j, k]], (len(seeds), 3, 3)), tgt[seeds])
+            moved = mob[None] @ rotations + translations[:, None, :]
+            nearest = np.sqrt(((moved[:, :, None, :] - tgt[None, None]) ** 2).sum(axis=-1)).min(axis=-1)
+            coverage = (nearest < self.match_cutoff).sum(axis=1)
+            spread = np.where(nearest < self.match_cutoff, nearest, 0.0).sum(axis=1)
+            top = np.lexsort((spread, -coverage))[:self.refine_top]
+            for s in top:
+                pairs, rotation, translation = self._refine(mob, tgt, rotations[s], translations[s])
+                if len(pairs) < 3:
+                    continue
+                moved_pairs = mob[pairs[:, 0]] @ rotation + translation
+                rmsd = _rmsd(moved_pairs, tgt[pairs[:, 1]])
+                if best is None or (len(pairs), -rmsd) > (best[0], -best[1]):
+                    best = (len(pairs), rmsd, rotation, translation)
+
+        if best is None:
+            return None
+        matched, rmsd, rotation, translation = best
+        overlap = 100.0 * matched / min(len(mob), len(tgt))
+        return AlignmentResult(rmsd, overlap, matched, rotation, translation)
+
+
+class ClickAligner(Aligner):
+    """
+    Reference backend running the CLICK binary once per pair, inside a
+    private scratch sandbox (inputs are symlinked, outputs parsed in place).
+    The transform is recovered by fitting the original mobile CA atoms onto
+    the superposed copy CLICK writes out.
+    """
+    name = "click"
+
+    def __init__(self, click_path, parameters_path, scratch_root=None):
+        self.click_path = click_path
+        self.parameters_path = parameters_path
+        self.scratch_root = scratch_root
+
+    def align(self, mobile, target):
+        with scratch_dir(prefix="click_", root=self.scratch_root) as sandbox:
+            link_into(self.parameters_path, sandbox)
+            link_into(mobile.path, sandbox, f"{mobile.name}.pdb")
+            link_into(target.path, sandbox, f"{target.name}.pdb")
+            subprocess.run([self.click_path, f"{mobile.name}.pdb", f"{target.name}.pdb"],
+                           cwd=sandbox, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+            log_file = os.path.join(sandbox, f"{mobile.name}-{target.name}.pdb.1.clique")
+            out_file = os.path.join(sandbox, f"{mobile.name}-{target.name}.1.pdb")
+            if not os.path.exists(log_file) or not os.path.exists(out_file):
+                return None
+            rmsd = overlap = matched = None
+            with open(log_file) as f:
+                for line in f:
+                    line = line.strip()
+                    try:
+                        value = float(line.split("=")[1].split(" ")[-1])
+                    except (IndexError, ValueError):
+                        continue
+                    if "Overlap" in line:
+                        overlap = value
+                    elif "RMSD" in line:
+                        rmsd = value
+                    elif "The number of matched atoms" in line:
+                        matched = value
+            if rmsd is None or overlap is None or matched is None:
+                return None
+
+            moved = load_pocket_coords(out_file).ca
+            if len(moved) != len(mobile.ca) or len(moved) < 3:
+                return None
+            rotation, translation = kabsch(mobile.ca, moved)
+            return AlignmentResult(rmsd, overlap, matched, rotation, translation)
+
+
+ALIGNERS = {
+    NumpyAligner.name: NumpyAligner,
+    ClickAligner.name: ClickAligner,
+}
+
+
+def get_aligner(name, **kwargs):
+    """
+    Instantiates an aligner by name, passing only the options it accepts
+    """
+    if name not in ALIGNERS:
+        raise ValueError(f"Unknown aligner '{name}'. Available: {', '.join(ALIGNERS)}")
+    aligner_class = ALIGNERS[name]
+    if aligner_class is ClickAligner:
+        return ClickAligner(kwargs["click_path"], kwargs["parameters_path"], kwargs.get("scratch_root"))
+    return aligner_class()
+
+
+def compare_alignments(mobile, reference, candidate, rmsd_allowed):
+    """
+    Differences between two backends' alignments of one minipocket: RMSD,
+    overlap and matched atoms, the RMSD between the mobile CA atoms moved by
+    each transform, and the acceptance decision of each
+    """
+    row = {"minipocket": mobile.name}
+    for label, alignment in (("reference", reference), ("candidate", candidate)):
+        row[label] = None if alignment is None else {"rmsd": float(alignment.rmsd), "overlap": float(alignment.overlap),
+                                                     "matched": int(alignment.matched)}
+        row[f"{label}_accepted"] = accepts(alignment, rmsd_allowed)
+    row["same_decision"] = row["reference_accepted"] == row["candidate_accepted"]
+    if reference is not None and candidate is not None:
+        row["rmsd_delta"] = float(candidate.rmsd - reference.rmsd)
+        row["overlap_delta"] = float(candidate.overlap - reference.overlap)
+        row["matched_delta"] = int(candidate.matched - reference.matched)
+        row["transform_rmsd"] = _rmsd(mobile.ca @ candidate.rotation + candidate.translation,
+                                      mobile.ca @ reference.rotation + reference.translation)
+    return row
+
+
+def parity_report(rows, max_transform_rmsd):
+    """
+    Summary of compare_alignments() rows. Parity holds when every acceptance
+    decision agrees and the transforms of pairs accepted by both backends move
+    the minipocket within max_transform_rmsd of each other.
+    """
+    both = [row for row in rows if row["reference_accepted"] and row["candidate_accepted"]]
+    transform = [row["transform_rmsd"] for row in both]
+    report = {"pairs": len(rows),
+              "reference_accepted": sum(row["reference_accepted"] for row in rows),
+              "candidate_accepted": sum(row["candidate_accepted"] for row in rows),
+              "decision_mismatches": [row["minipocket"] for row in rows if not row["same_decision"]],
+              "max_transform_rmsd": max(transform) if transform else None,
+              "mean_abs_rmsd_delta": float(np.mean([abs(row["rmsd_delta"]) for row in both])) if both else None,
+              "mean_abs_overlap_delta": float(np.mean([abs(row["overlap_delta"]) for row in both])) if both else None}
+    report["parity"] = not report["decision_mismatches"] and all(value <= max_transform_rmsd for value in transform)
+    return report
+
+
+def main():
+    program_description = "Compare two alignment backends on DB minipockets (result parity of the NumPy aligner with CLICK)"
+    parser = argparse.ArgumentParser(description=program_description)
+    parser.add_argument("-i", "--initial_path", type=str, required=True,
+                        help="Absolute path to the main directory (containing utilities/click)")
+    parser.add_argument("-T", "--target_receptor", type=str, required=True, help="target pocket PDB")
+    parser.add_argument("-fm", "--folder_minipockets", type=str, required=True, help="folder containing minipockets")
+    parser.add_argument("-n", "--n_minipockets", type=int, default=200, help="minipockets sampled from the folder")
+    parser.add_argument("-rmsd", "--rmsd_allowed", type=float, default=0.5, help="RMSD cutoff of superposer.py")
+    parser.add_argument("--reference", type=str, default="click", choices=sorted(ALIGNERS), help="reference backend")
+    parser.add_argument("--candidate", type=str, default="numpy", choices=sorted(ALIGNERS), help="backend checked against it")
+    parser.add_argument("--max_transform_rmsd", type=float, default=0.5,
+                        help="largest CA RMSD between the two transforms of a pair both accept (Angstrom)")
+    parser.add_argument("--seed", type=int, default=0, help="sampling seed")
+    parser.add_argument("-o", "--output", type=str, default="aligner_parity.json", help="report (JSON)")
+    args = parser.parse_args()
+
+    click_path = os.path.join(args.initial_path, "utilities/click/click")
+    if "click" in (args.reference, args.candidate) and not os.path.exists(click_path):
+        print(f"Error: {click_path} not found.")
+        sys.exit(1)
+    files = sorted(file for file in os.listdir(args.folder_minipockets)
+                   if file.startswith("minipocket_") and file.endswith(".pdb"))
+    files = random.Random(args.seed).sample(files, min(args.n_minipockets, len(files)))
+    options = {"click_path": click_path, "parameters_path": os.path.join(args.initial_path, "utilities/click/Parameters.inp")}
+    reference, candidate = get_aligner(args.reference, **options), get_aligner(args.candidate, **options)
+    target = load_pocket_coords(args.target_receptor)
+
+    rows = []
+    for file in files:
+        mobile = load_pocket_coords(os.path.join(args.folder_minipockets, file))
+        rows.append(compare_alignments(mobile, reference.align(mobile, target), candidate.align(mobile, target),
+                                       args.rmsd_allowed))
+    report = parity_report(rows, args.max_transform_rmsd)
+    report.update({"reference": args.reference, "candidate": args.candidate, "target": os.path.abspath(args.target_receptor),
+                   "rmsd_allowed": args.rmsd_allowed, "max_transform_rmsd_allowed": args.max_transform_rmsd})
+    with open(args.output, "w") as f:
+        json.dump({"summary": report, "pairs": rows}, f, indent=4)
+    print(f"{report['pairs']} minipockets: accepted {report['reference_accepted']} ({args.reference}) / "
+          f"{report['candidate_accepted']} ({args.candidate}), {len(report['decision_mismatches'])} decisions differ, "
+          f"max transform RMSD {report['max_transform_rmsd']}")
+    print(f"Parity: {'pass' if report['parity'] else 'FAIL'} (details in {args.output})")
+    sys.exit(0 if report["parity"] else 1)
+
+
+if __name__ == "__main__":
+    main()
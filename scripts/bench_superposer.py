@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import resource
+import subprocess
+import numpy as np
+
+from minipocket_db import build_store
+from complex_cache import build_index
+
+# Throughput benchmark of superposer.py on a synthetic DB. A fraction of the
+# complexes carry the target pocket itself (rigidly moved), so their minipockets
+# align and their patches go through the parse, clash and save phases; the rest
+# are random decoys rejected at alignment. The NumPy aligner stands in for CLICK.
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_FORMAT = "frankpepstein-superposer-bench"
+BENCH_VERSION = 1
+DB_META = "bench_db.json"
+RESIDUES = ["ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "ILE",
+            "LEU", "LYS", "MET", "PHE", "PRO", "SER", "THR", "TRP", "TYR", "VAL"]
+BACKBONE = {"N": [-1.2, 0.6, 0.0], "CA": [0.0, 0.0, 0.0], "C": [1.2, 0.6, 0.0],
+            "O": [1.5, 1.7, 0.0], "CB": [0.0, -0.8, 1.2]}
+PEPTIDE_OFFSET = np.array([0.0, 0.0, 8.0]) # peptide CA trace sits 8 A above a receptor segment
+MINIPOCKET_RADIUS = 10.0
+
+
+def random_chain(rng, n_residues, step=3.8):
+    """
+    CA trace of a random walk with 3.8 A steps and a persistent direction
+    """
+    ca = [np.zeros(3)]
+    direction = np.array([1.0, 0.0, 0.0])
+    for i in range(n_residues - 1):
+        direction = direction + rng.normal(0, 0.6, 3)
+        direction /= np.linalg.norm(direction)
+        ca.append(ca[-1] + step * direction)
+    return np.array(ca)
+
+
+def random_rotation(rng):
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q *= np.sign(np.diag(r))
+    if np.linalg.det(q) < 0:
+        q[:, 0] *= -1
+    return q
+
+
+def pdb_lines(chain, ca, res_names, first_resseq=1, rotation=None, translation=None, serial=1):
+    """
+    ATOM lines of a CA trace expanded to N, CA, C, O, CB, optionally moved (coords @ rotation + translation)
+    """
+    lines = []
+    for i, (residue_ca, res_name) in enumerate(zip(ca, res_names)):
+        for atom_name, offset in BACKBONE.items():
+            xyz = residue_ca + np.array(offset)
+            if rotation is not None:
+                xyz = xyz @ rotation + translation
+            lines.append(f"ATOM  {serial:5d} {atom_name:<4s} {res_name:3s} {chain}{first_resseq + i:4d}    "
+                         f"{xyz[0]:8.3f}{xyz[1]:8.3f}{xyz[2]:8.3f}  1.00  0.00           {atom_name[0]}\n")
+            serial += 1
+    return lines + ["TER\n"]
+
+
+def generate_db(db_dir, n_complexes, minipockets_per_complex=4, hit_fraction=0.1,
+                pocket_residues=40, peptide_length=8, seed=0):
+    """
+    Writes pocket.pdb, peptides/{complex}/peptide_complex.pdb and minipockets/
+    under db_dir and returns the gridbox (center, size) around the pocket
+    """
+    rng = np.random.default_rng(seed)
+    pepbdb_folder = os.path.join(db_dir, "peptides")
+    folder_minipockets = os.path.join(db_dir, "minipockets")
+    os.makedirs(pepbdb_folder)
+    os.makedirs(folder_minipockets)
+
+    target_ca = random_chain(rng, pocket_residues)
+    target_names = rng.choice(RESIDUES, pocket_residues)
+    with open(os.path.join(db_dir, "pocket.pdb"), "w") as f:
+        f.writelines(pdb_lines("p", target_ca, target_names) + ["END\n"])
+
+    minipockets_per_complex = min(minipockets_per_complex, peptide_length - 2)
+    n_hits = int(round(n_complexes * hit_fraction))
+    n_minipockets = 0
+    for c in range(n_complexes):
+        if c < n_hits:
+            receptor_ca, receptor_names = target_ca, target_names
+        else:
+            receptor_ca, receptor_names = random_chain(rng, pocket_residues), rng.choice(RESIDUES, pocket_residues)
+        segment = rng.integers(0, pocket_residues - peptide_length + 1)
+        peptide_ca = receptor_ca[segment:segment + peptide_length] + PEPTIDE_OFFSET
+        peptide_names = rng.choice(RESIDUES, peptide_length)
+        rotation, translation = random_rotation(rng), rng.uniform(-50, 50, 3)
+
+        complex_name = f"s{c:06d}_A_B"
+        os.makedirs(os.path.join(pepbdb_folder, complex_name))
+        with open(os.path.join(pepbdb_folder, complex_name, "peptide_complex.pdb"), "w") as f:
+            f.writelines(pdb_lines("A", receptor_ca, receptor_names, 1, rotation, translation)
+                         + pdb_lines("B", peptide_ca, peptide_names, 1, rotation, translation,
+                                     serial=5 * pocket_residues + 1) + ["END\n"])
+
+        # One minipocket per 3-residue patch: receptor residues around the patch
+        for start in rng.choice(peptide_length - 2, minipockets_per_complex, replace=False):
+            patch_ca = peptide_ca[start:start + 3]
+            distances = np.linalg.norm(receptor_ca[:, None] - patch_ca[None], axis=-1).min(axis=1)
+            close = np.nonzero(distances <= MINIPOCKET_RADIUS)[0]
+            if len(close) < 3:
+                continue
+            patch = "-".join(f"{peptide_names[i]}{i + 1}" for i in range(start, start + 3))
+            lines = []
+            for i in close:
+                lines += pdb_lines("A", receptor_ca[i:i + 1], receptor_names[i:i + 1], i + 1,
+                                   rotation, translation)[:-1]
+            with open(os.path.join(folder_minipockets, f"minipocket_{complex_name}_{patch}.pdb"), "w") as f:
+                f.writelines(lines + ["END\n"])
+            n_minipockets += 1
+
+    center = (target_ca.min(axis=0) + target_ca.max(axis=0)) / 2
+    size = target_ca.max(axis=0) - target_ca.min(axis=0) + 2 * (np.linalg.norm(PEPTIDE_OFFSET) + 4)
+    return n_minipockets, center, size
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPTS_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, previous_file):
+    """
+    Prints the ratios of the headline numbers against an earlier result file
+    """
+    with open(previous_file) as f:
+        previous = json.load(f)
+    print(f"Compared with {previous_file} ({previous.get('git_revision')}, {previous.get('date')}):")
+    rows = [("minipockets/s", "minipockets_per_s"), ("wall s", "wall_seconds"), ("worker s", "worker_seconds")]
+    for label, key in rows:
+        old, new = previous["scan"].get(key), current["scan"].get(key)
+        if old:
+            print(f"  {label:<16} {old:>10} -> {new:>10}  (x{new / old:.2f})")
+    for phase, new in current["scan"]["phase_seconds"].items():
+        old = previous["scan"]["phase_seconds"].get(phase)
+        if old:
+            print(f"  {phase + ' s':<16} {old:>10} -> {new:>10}  (x{new / old:.2f})")
+    old, new = previous["scan"]["peak_rss_kb"]["worker_max"], current["scan"]["peak_rss_kb"]["worker_max"]
+    if old:
+        print(f"  {'worker RSS kB':<16} {old:>10} -> {new:>10}  (x{new / old:.2f})")
+
+
+def main():
+    program_description = "Benchmark superposer.py throughput on a synthetic minipocket DB (no CLICK binary needed)"
+    parser = argparse.ArgumentParser(description=program_description)
+    parser.add_argument("-n", "--n_complexes", type=int, default=500, help="synthetic DB complexes")
+    parser.add_argument("--minipockets_per_complex", type=int, default=4, help="minipockets per complex")
+    parser.add_argument("--hit_fraction", type=float, default=0.1,
+                        help="fraction of complexes whose receptor is the target pocket (alignment hits)")
+    parser.add_argument("--pocket_residues", type=int, default=40, help="residues of the target and DB receptors")
+    parser.add_argument("--peptide_length", type=int, default=8, help="residues of the DB peptides")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the synthetic DB")
+    parser.add_argument("-t", "--threads", type=int, default=os.cpu_count(), help="superposer threads")
+    parser.add_argument("-a", "--aligner", type=str, default="numpy", help="alignment backend passed to superposer.py")
+    parser.add_argument("--store", action="store_true",
+                        help="also pack the minipocket store and peptide index, as setup_local.py does")
+    parser.add_argument("--lazy", action="store_true", help="benchmark superposer.py --lazy")
+    parser.add_argument("--repeat", type=int, default=1, help="scans to run; the fastest one is reported")
+    parser.add_argument("--db_dir", type=str, default=None,
+                        help="keep the synthetic DB here and reuse it when its parameters match (default: temporary)")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="result JSON (default: bench_superposer_<date>.json)")
+    parser.add_argument("--compare", type=str, default=None, help="earlier result JSON to compare with")
+    args = parser.parse_args()
+
+    db_params = {"n_complexes": args.n_complexes, "minipockets_per_complex": args.minipockets_per_complex,
+                 "hit_fraction": args.hit_fraction, "pocket_residues": args.pocket_residues,
+                 "peptide_length": args.peptide_length, "seed": args.seed, "store": args.store}
+    keep_db = args.db_dir is not None
+    db_dir = os.path.abspath(args.db_dir or f"bench_superposer_db_{os.getpid()}")
+    db_meta = None
+    if os.path.exists(os.path.join(db_dir, DB_META)):
+        with open(os.path.join(db_dir, DB_META)) as f:
+            db_meta = json.load(f)
+    if db_meta is None or db_meta["params"] != db_params:
+        if os.path.exists(db_dir):
+            shutil.rmtree(db_dir)
+        os.makedirs(db_dir)
+        start = time.perf_counter()
+        n_minipockets, center, size = generate_db(
+            db_dir, args.n_complexes, args.minipockets_per_complex, args.hit_fraction,
+            args.pocket_residues, args.peptide_length, args.seed)
+        if args.store:
+            build_store(os.path.join(db_dir, "minipockets"))
+            build_index(os.path.join(db_dir, "peptides"))
+        db_meta = {"params": db_params, "n_minipockets": n_minipockets,
+                   "center": center.tolist(), "size": size.tolist()}
+        with open(os.path.join(db_dir, DB_META), "w") as f:
+            json.dump(db_meta, f, indent=4)
+        print(f"DEBUG: Generated {n_minipockets} minipockets from {args.n_complexes} complexes "
+              f"in {time.perf_counter() - start:.1f}s")
+    else:
+        print(f"DEBUG: Reusing synthetic DB {db_dir}")
+
+    center, size = db_meta["center"], db_meta["size"]
+    runs = []
+    try:
+        for run in range(args.repeat):
+            run_dir = os.path.join(db_dir, f"run_{run}")
+            if os.path.exists(run_dir):
+                shutil.rmtree(run_dir)
+            os.makedirs(run_dir)
+            cmd = [sys.executable, os.path.join(SCRIPTS_DIR, "superposer.py"),
+                   "-i", db_dir, "-T", os.path.join(db_dir, "pocket.pdb"),
+                   "-d", os.path.join(db_dir, "peptides"), "-fm", os.path.join(db_dir, "minipockets"),
+                   "-t", str(args.threads), "-a", args.aligner,
+                   "-x_center", str(center[0]), "-y_center", str(center[1]), "-z_center", str(center[2]),
+                   "-x_size", str(size[0]), "-y_size", str(size[1]), "-z_size", str(size[2]),
+                   "--timings_out", "timings.json"]
+            if args.lazy:
+                cmd.append("--lazy")
+            start = time.perf_counter()
+            result = subprocess.run(cmd, cwd=run_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            process_seconds = time.perf_counter() - start
+            if result.returncode != 0:
+                print(result.stdout[-3000:])
+                print(f"Error: superposer.py exited with {result.returncode}")
+                sys.exit(1)
+            with open(os.path.join(run_dir, "timings.json")) as f:
+                timings = json.load(f)
+            timings["process_seconds"] = round(process_seconds, 4)
+            runs.append(timings)
+            print(f"Run {run + 1}/{args.repeat}: {timings['minipockets_per_s']} minipockets/s, "
+                  f"{timings['wall_seconds']}s scan, {process_seconds:.1f}s total")
+    finally:
+        if not keep_db:
+            shutil.rmtree(db_dir, ignore_errors=True)
+
+    best = max(runs, key=lambda timings: timings["minipockets_per_s"])
+    bench = {"format": BENCH_FORMAT, "version": BENCH_VERSION,
+             "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "git_revision": git_revision(),
+             "host": socket.gethostname(), "platform": platform.platform(), "python": platform.python_version(),
+             "cpu_count": os.cpu_count(), "threads": args.threads, "aligner": args.aligner, "lazy": args.lazy,
+             "db": {**db_params, "n_minipockets": db_meta["n_minipockets"]},
+             "scan": best, "runs": runs,
+             "peak_rss_children_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+    output = args.output or f"bench_superposer_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(bench, f, indent=4)
+
+    phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in best["phase_seconds"].items())
+    print(f"{best['n_minipockets']} minipockets: {best['minipockets_per_s']} minipockets/s on {args.threads} threads; "
+          f"{phases}; peak worker RSS {best['peak_rss_kb']['worker_max'] / 1024:.0f} MB")
+    print(f"Results written to {output}")
+    if args.compare:
+        compare(bench, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+from collections import OrderedDict
+import numpy as np
+from tqdm import tqdm
+
+from pdb_arrays import ATOM_FIELDS, read_pdb_atoms, residue_keys, take_atoms
+from minipocket_db import folder_fingerprint, stale_reason
+
+# Peptide chains of {pepbdb_folder}/{pdb}_{receptor chain}_{peptide chain}/peptide_complex.pdb.
+# Each complex is parsed at most once per process (LRU), or once ever when the
+# pre-extracted index (<pepbdb_folder>.peptides) has been built.
+INDEX_FORMAT = "frankpepstein-peptides"
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".peptides"
+META_FILE = "meta.json"
+COMPLEX_FILE = "peptide_complex.pdb"
+
+# One cache per worker process, see get_complex_cache()
+_caches = {}
+
+
+def default_index_path(pepbdb_folder):
+    return pepbdb_folder.rstrip("/") + INDEX_SUFFIX
+
+
+def build_index(pepbdb_folder, index_path=None):
+    """
+    Extracts the peptide chain of every DB entry into a memory-mappable index
+    """
+    index_path = index_path or default_index_path(pepbdb_folder)
+    fingerprint = folder_fingerprint(pepbdb_folder, "*", COMPLEX_FILE)
+    folders = sorted(folder for folder in os.listdir(pepbdb_folder)
+                     if os.path.exists(os.path.join(pepbdb_folder, folder, COMPLEX_FILE)))
+
+    columns = {field: [] for field in list(ATOM_FIELDS) + ["coords"]}
+    offsets = [0]
+    for folder in tqdm(folders, total=len(folders), desc="extracting peptide chains"):
+        atoms = read_pdb_atoms(os.path.join(pepbdb_folder, folder, COMPLEX_FILE),
+                               chains={folder.split("_")[-1]})
+        for field in columns:
+            columns[field].append(atoms[field])
+        offsets.append(offsets[-1] + len(atoms["coords"]))
+
+    tmp_path = index_path + ".tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    for field, chunks in columns.items():
+        dtype = np.float32 if field == "coords" else ATOM_FIELDS[field]
+        empty = np.zeros((0, 3) if field == "coords" else 0, dtype=dtype)
+        np.save(os.path.join(tmp_path, f"{field}.npy"),
+                np.concatenate(chunks) if chunks else empty)
+    np.save(os.path.join(tmp_path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(tmp_path, "folders.npy"), np.array(folders, dtype=bytes))
+    with open(os.path.join(tmp_path, META_FILE), "w") as f:
+        json.dump({"format": INDEX_FORMAT, "version": INDEX_VERSION,
+                   "source": os.path.abspath(pepbdb_folder), "fingerprint": fingerprint,
+                   "n_complexes": len(folders), "n_atoms": offsets[-1]}, f, indent=4)
+    if os.path.exists(index_path):
+        shutil.rmtree(index_path)
+    os.rename(tmp_path, index_path)
+    return index_path
+
+
+class PeptideComplexCache:
+    """
+    LRU cache of DB peptide chains as atom arrays (see pdb_arrays.read_pdb_atoms)
+    """
+
+    def __init__(self, pepbdb_folder, index_path=None, maxsize=4096):
+        self.pepbdb_folder = pepbdb_folder
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._index = None
+        index_path = index_path or default_index_path(pepbdb_folder)
+        if os.path.exists(os.path.join(index_path, META_FILE)):
+            self._open_index(index_path)
+
+    def _open_index(self, index_path):
+        with open(os.path.join(index_path, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get("format") != INDEX_FORMAT or meta.get("version") != INDEX_VERSION:
+            print(f"DEBUG: Ignoring incompatible peptide index {index_path}")
+            return
+        reason = stale_reason(meta, self.pepbdb_folder, "*", COMPLEX_FILE)
+        if reason is not None:
+            print(f"DEBUG: Ignoring peptide index {index_path} ({reason}), parsing the DB entries. "
+                  f"Rebuild it with complex_cache.py")
+            return
+        load = lambda field: np.load(os.path.join(index_path, f"{field}.npy"), mmap_mode="r")
+        self._index = {
+            "columns": {field: load(field) for field in list(ATOM_FIELDS) + ["coords"]},
+            "offsets": load("offsets"),
+            "folders": {folder: i for i, folder in enumerate(load("folders").astype(str))},
+        }
+
+    def complex_file(self, folder):
+        return f"{self.pepbdb_folder}/{folder}/{COMPLEX_FILE}"
+
+    def _load(self, folder, chain):
+        if self._index is not None and chain == folder.split("_")[-1]:
+            i = self._index["folders"].get(folder)
+            if i is not None:
+                offsets = self._index["offsets"]
+                return take_atoms(self._index["columns"], slice(offsets[i], offsets[i + 1]))
+        complex_file = self.complex_file(folder)
+        if not os.path.exists(complex_file):
+            return None
+        return read_pdb_atoms(complex_file, chains={chain})
+
+    def peptide(self, folder, chain):
+        """
+        Atom arrays of one peptide chain, or None if the DB entry is missing
+        """
+        key = (folder, chain)
+        if key in self._lru:
+            self.hits += 1
+            self._lru.move_to_end(key)
+            return self._lru[key]
+        self.misses += 1
+        atoms = self._load(folder, chain)
+        self._lru[key] = atoms
+        if len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+        return atoms
+
+    def fragment(self, folder, chain, patch):
+        """
+        Atoms of the patch residues (e.g. ['ALA12', 'GLY13']) of a peptide chain.
+        Coordinates are a private copy, safe to transform in place.
+        """
+        atoms = self.peptide(folder, chain)
+        if atoms is None:
+            return None
+        fragment = take_atoms(atoms, np.isin(residue_keys(atoms), patch))
+        fragment["coords"] = np.array(fragment["coords"], dtype=np.float32)
+        return fragment
+
+
+def get_complex_cache(pepbdb_folder, index_path=None):
+    """
+    Per-process cache: joblib workers keep it across tasks
+    """
+    key = (pepbdb_folder, index_path)
+    if key not in _caches:
+        _caches[key] = PeptideComplexCache(pepbdb_folder, index_path)
+    return _caches[key]
+
+
+def main():
+    program_description = "Pre-extract DB peptide chains into an index read by superposer.py"
+    parser = argparse.ArgumentParser(description=program_description)
+    parser.add_argument("-d", "--pepbdb_folder", type=str, required=True,
+                        help="DB folder with {pdb}_{chain}_{peptide chain}/peptide_complex.pdb entries")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help=f"index directory (default: <pepbdb_folder>{INDEX_SUFFIX})")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.pepbdb_folder):
+        print(f"Error: {args.pepbdb_folder} not found.")
+        sys.exit(1)
+    index_path = build_index(args.pepbdb_folder, args.output)
+    print(f"Peptide index written to {index_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+import os
+import sys
+import glob
+import time
+import hashlib
+import ipaddress
+import argparse
+import threading
+import traceback
+import subprocess
+from collections import deque
+from multiprocessing.connection import Client, Listener
+import numpy as np
+
+from minipocket_db import default_store_path, fresh_store, open_store
+from scan_manifest import MANIFEST_FILE, ScanManifest, read_manifest
+from scan_scheduler import scan_entries
+from hit_table import HIT_TABLE_DIR, HitTableWriter, read_hit_table
+from patches import FRAGMENTS_FILE, append_fragment_records, read_fragment_records
+from scratch import scratch_dir
+
+# Coordinator/worker mode of superposer.py. The coordinator shards the minipocket
+# DB and serves shards over an authenticated multiprocessing.connection (TCP);
+# each worker runs superposer.py --entries_file on its shard in a scratch folder
+# and sends back patches, lazy records, hits and manifest entries, which the
+# coordinator merges into its own output folder. Messages:
+#   worker -> coordinator: ("ready", worker name) | ("result", shard id, payload) | ("failed", shard id, error)
+#   coordinator -> worker: ("shard", shard id, files, job) | ("done",)
+# Connections carry pickles: only use it on trusted networks. The coordinator
+# listens on loopback by default; another address needs an explicit shared
+# secret. Local workers get the secret through the environment, not argv.
+SUPERPOSER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "superposer.py")
+AUTHKEY_ENV = "FRANKPEPSTEIN_AUTHKEY"
+DEFAULT_PORT = 50007
+CUTOFF = 3
+
+
+def authkey(args):
+    """
+    Shared secret from --authkey or $FRANKPEPSTEIN_AUTHKEY, None when neither is set
+    """
+    key = args.authkey or os.environ.get(AUTHKEY_ENV)
+    return key.encode() if key else None
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class ShardQueue:
+    """
+    Pending shards, with retries of failed ones. next() blocks until a shard is
+    available or every shard has either completed or run out of attempts.
+    """
+
+    def __init__(self, shards, retries):
+        self.pending = deque(shards)
+        self.attempts = {shard_id: 0 for shard_id, files in shards}
+        self.files = dict(shards)
+        self.retries = retries
+        self.in_flight = set()
+        self.completed = set()
+        self.failed = {}
+        self.workers = 0
+        self.condition = threading.Condition()
+
+    def finished(self):
+        return not self.pending and not self.in_flight
+
+    def next(self):
+        with self.condition:
+            while not self.pending and self.in_flight:
+                self.condition.wait()
+            if not self.pending:
+                return None
+            shard_id, files = self.pending.popleft()
+            self.attempts[shard_id] += 1
+            self.in_flight.add(shard_id)
+            return shard_id, files
+
+    def complete(self, shard_id):
+        with self.condition:
+            self.in_flight.discard(shard_id)
+            self.completed.add(shard_id)
+            self.condition.notify_all()
+
+    def fail(self, shard_id, error):
+        with self.condition:
+            self.in_flight.discard(shard_id)
+            if self.attempts[shard_id] <= self.retries:
+                print(f"DEBUG: Shard {shard_id} failed ({error}), retrying")
+                self.pending.append((shard_id, self.files[shard_id]))
+            else:
+                print(f"DEBUG: Shard {shard_id} failed {self.attempts[shard_id]} times, giving up: {error}")
+                self.failed[shard_id] = error
+            self.condition.notify_all()
+
+    def connected(self, delta):
+        with self.condition:
+            self.workers += delta
+
+    def abandon(self, error):
+        """
+        Fails every pending shard (no worker left to take them)
+        """
+        with self.condition:
+            while self.pending:
+                shard_id, files = self.pending.popleft()
+                print(f"DEBUG: Shard {shard_id} abandoned: {error}")
+                self.failed[shard_id] = error
+            self.condition.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        True once every shard is done, False when timeout runs out first
+        """
+        with self.condition:
+            return self.condition.wait_for(self.finished, timeout)
+
+
+class ShardMerger:
+    """
+    Writes shard results into the coordinator output folder (same layout as superposer.py)
+    """
+
+    def __init__(self, output_folder, manifest, hit_table):
+        self.output_folder = output_folder
+        self.manifest = manifest
+        self.hit_table = hit_table
+        self.lock = threading.Lock()
+        self.n_accepted = 0
+
+    def merge(self, payload):
+        with self.lock:
+            # Outputs and hits before the manifest, as in superposer.py
+            for name, text in payload["patches"].items():
+                patch_file = os.path.join(self.output_folder, name)
+                with open(patch_file + ".tmp", "w") as f:
+                    f.write(text)
+                os.replace(patch_file + ".tmp", patch_file)
+            append_fragment_records(os.path.join(self.output_folder, FRAGMENTS_FILE), payload["records"])
+            self.hit_table.add_columns(payload["hits"])
+            entries = []
+            for file, (status, output) in payload["entries"].items():
+                if output is not None:
+                    output = os.path.join(self.output_folder, os.path.basename(output))
+                entries.append((file, status, output))
+            self.manifest.record(entries)
+            self.n_accepted += len([entry for entry in entries if entry[1] == "accepted"])
+
+
+def serve_worker(conn, shards, merger, job, shard_timeout):
+    """
+    Feeds shards to one connected worker until the queue is exhausted
+    """
+    try:
+        worker_name = conn.recv()[1]
+    except (EOFError, OSError):
+        return
+    print(f"DEBUG: Worker {worker_name} connected")
+    shards.connected(1)
+    try:
+        feed_worker(conn, worker_name, shards, merger, job, shard_timeout)
+    finally:
+        shards.connected(-1)
+        conn.close()
+
+
+def feed_worker(conn, worker_name, shards, merger, job, shard_timeout):
+    while True:
+        shard = shards.next()
+        if shard is None:
+            try:
+                conn.send(("done",))
+            except (EOFError, OSError):
+                pass
+            break
+        shard_id, files = shard
+        try:
+            conn.send(("shard", shard_id, files, job))
+            if not conn.poll(shard_timeout):
+                raise TimeoutError(f"no answer after {shard_timeout}s")
+            reply = conn.recv()
+        except (EOFError, OSError, TimeoutError) as e:
+            shards.fail(shard_id, f"worker {worker_name} lost: {e}")
+            break
+        if reply[0] == "result":
+            try:
+                merger.merge(reply[2])
+                shards.complete(shard_id)
+                print(f"DEBUG: Shard {shard_id} done by {worker_name} ({len(files)} minipockets)")
+            except Exception as e:
+                shards.fail(shard_id, f"merge error: {e}")
+        else:
+            shards.fail(shard_id, reply[2])
+
+
+def run_coordinator(args):
+    key = authkey(args)
+    if key is None:
+        if not is_loopback(args.host):
+            print(f"Error: listening on {args.host} needs --authkey or ${AUTHKEY_ENV}")
+            sys.exit(1)
+        key = os.urandom(32).hex().encode() # Only the local workers get it
+    folder_output = f"superpockets_residuesAligned{CUTOFF}_RMSD{args.rmsd_allowed}"
+    output_folder = os.path.join(os.getcwd(), folder_output)
+    os.makedirs(output_folder, exist_ok=True)
+
+    if args.entries_file is not None:
+        with open(args.entries_file) as f:
+            minipocket_files = scan_entries([line.strip() for line in f if line.strip()])
+    else:
+        store_path = fresh_store(args.minipocket_store or default_store_path(args.folder_minipockets),
+                                 args.folder_minipockets)
+        if store_path is not None:
+            minipocket_files = open_store(store_path).files
+        else:
+            minipocket_files = scan_entries(os.listdir(args.folder_minipockets))
+
+    with open(args.target_receptor) as f:
+        pocket_text = f.read()
+    gridbox = [args.x_center, args.y_center, args.z_center, args.x_size, args.y_size, args.z_size]
+    scan_params = {"target_sha1": hashlib.sha1(pocket_text.encode()).hexdigest(),
+                   "pepbdb_folder": os.path.abspath(args.pepbdb_folder),
+                   "folder_minipockets": os.path.abspath(args.folder_minipockets), "rmsd_allowed": args.rmsd_allowed,
+                   "aligner": args.aligner, "gridbox": gridbox,
+                   "prescreen": args.prescreen, "prescreen_report": False}
+    manifest = ScanManifest(os.path.join(output_folder, MANIFEST_FILE), scan_params, resume=args.resume)
+    hit_table = HitTableWriter(os.path.join(output_folder, HIT_TABLE_DIR), {
+        "target": os.path.abspath(args.target_receptor), "gridbox": gridbox, "rmsd_allowed": args.rmsd_allowed,
+        "pepbdb_folder": scan_params["pepbdb_folder"], "aligner": args.aligner}, resume=manifest.resumed)
+    if manifest.resumed:
+        manifest.reconcile(output_folder, read_fragment_records(os.path.join(output_folder, FRAGMENTS_FILE)))
+        minipocket_files = [file for file in minipocket_files if file not in manifest.completed]
+    elif os.path.exists(os.path.join(output_folder, FRAGMENTS_FILE)):
+        os.remove(os.path.join(output_folder, FRAGMENTS_FILE))
+
+    shard_list = [(i, minipocket_files[start:start + args.shard_size])
+                  for i, start in enumerate(range(0, len(minipocket_files), args.shard_size))]
+    print(f"DEBUG: {len(minipocket_files)} minipockets in {len(shard_list)} shards")
+    job = {"pocket_text": pocket_text, "pepbdb_folder": scan_params["pepbdb_folder"],
+           "folder_minipockets": scan_params["folder_minipockets"], "initial_path": os.path.abspath(args.initial_path),
+           "gridbox": gridbox, "rmsd_allowed": args.rmsd_allowed,
+           "aligner": args.aligner, "prescreen": args.prescreen, "lazy": args.lazy,
+           "exclude_from": os.getcwd()}
+    shards = ShardQueue(shard_list, args.retries)
+    merger = ShardMerger(output_folder, manifest, hit_table)
+
+    listener = Listener((args.host, args.port), authkey=key)
+    print(f"DEBUG: Coordinator listening on {args.host}:{listener.address[1]}")
+
+    def accept_loop():
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError):
+                break
+            threading.Thread(target=serve_worker, args=(conn, shards, merger, job, args.shard_timeout),
+                             daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+
+    # Localhost mode: workers are started here, on the coordinator host
+    local_workers = []
+    for i in range(args.local_workers):
+        local_workers.append(subprocess.Popen([
+            sys.executable, os.path.abspath(__file__), "worker", "--host", "localhost",
+            "--port", str(listener.address[1]), "-t", str(args.worker_threads), "--name", f"local{i}"],
+            env=dict(os.environ, **{AUTHKEY_ENV: key.decode()})))
+
+    start = time.perf_counter()
+    while not shards.wait(timeout=5):
+        # A lost worker requeues its shard; with every local worker gone nobody takes it again
+        if local_workers and shards.workers == 0 and all(worker.poll() is not None for worker in local_workers):
+            shards.abandon("no local worker left")
+            break
+    listener.close()
+    for worker in local_workers:
+        worker.wait()
+    manifest.close()
+    hit_table.close()
+
+    print(f"Distributed scan: {len(shards.completed)}/{len(shard_list)} shards in "
+          f"{time.perf_counter() - start:.1f}s, {merger.n_accepted} patches in {output_folder}")
+    if shards.failed:
+        print(f"Error: shards {sorted(shards.failed)} failed, rerun with --resume to retry them")
+        sys.exit(1)
+
+
+def run_shard(shard_id, files, job, args):
+    """
+    Runs superposer.py on one shard inside a scratch folder and collects its outputs
+    """
+    with scratch_dir(prefix=f"shard{shard_id}_", root=args.scratch_dir) as sandbox:
+        with open(os.path.join(sandbox, "pocket.pdb"), "w") as f:
+            f.write(job["pocket_text"])
+        with open(os.path.join(sandbox, "entries.txt"), "w") as f:
+            f.write("\n".join(files) + "\n")
+        x_center, y_center, z_center, x_size, y_size, z_size = job["gridbox"]
+        cmd = [sys.executable, SUPERPOSER,
+               "-i", os.path.abspath(args.initial_path) if args.initial_path else job["initial_path"],
+               "-T", "pocket.pdb",
+               "-d", os.path.abspath(args.pepbdb_folder) if args.pepbdb_folder else job["pepbdb_folder"],
+               "-t", str(args.threads),
+               "-fm", os.path.abspath(args.folder_minipockets) if args.folder_minipockets else job["folder_minipockets"],
+               "-x_center", str(x_center), "-y_center", str(y_center), "-z_center", str(z_center),
+               "-x_size", str(x_size), "-y_size", str(y_size), "-z_size", str(z_size),
+               "-rmsd", str(job["rmsd_allowed"]), "-a", job["aligner"], "-ps", str(job["prescreen"]),
+               "--entries_file", "entries.txt", "--exclude_from", job["exclude_from"]]
+        if job["lazy"]:
+            cmd.append("--lazy")
+        result = subprocess.run(cmd, cwd=sandbox, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"superposer.py exited with {result.returncode}: {result.stdout[-2000:]}")
+
+        output_folder = os.path.join(sandbox, f"superpockets_residuesAligned{CUTOFF}_RMSD{job['rmsd_allowed']}")
+        patches = {}
+        for patch_file in glob.glob(os.path.join(output_folder, "patch_file_*.pdb")):
+            with open(patch_file) as f:
+                patches[os.path.basename(patch_file)] = f.read()
+        params, entries = read_manifest(os.path.join(output_folder, MANIFEST_FILE))
+        meta, hits = read_hit_table(os.path.join(output_folder, HIT_TABLE_DIR))
+        return {"patches": patches,
+                "records": list(read_fragment_records(os.path.join(output_folder, FRAGMENTS_FILE)).values()),
+                "entries": entries,
+                "hits": {column: np.array(values) for column, values in hits.items()}}
+
+
+def run_worker(args):
+    address = (args.host, args.port)
+    key = authkey(args)
+    if key is None:
+        print(f"Error: set --authkey or ${AUTHKEY_ENV} to the coordinator's secret")
+        sys.exit(1)
+    for attempt in range(args.connect_retries + 1):
+        try:
+            conn = Client(address, authkey=key)
+            break
+        except ConnectionRefusedError:
+            if attempt == args.connect_retries:
+                print(f"Error: no coordinator at {args.host}:{args.port}")
+                sys.exit(1)
+            time.sleep(1)
+    name = args.name or f"{os.uname().nodename}:{os.getpid()}"
+    conn.send(("ready", name))
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message[0] == "done":
+            break
+        shard_id, files, job = message[1:]
+        try:
+            conn.send(("result", shard_id, run_shard(shard_id, files, job, args)))
+        except Exception:
+            conn.send(("failed", shard_id, traceback.format_exc(limit=3)))
+    conn.close()
+
+
+def main():
+    program_description = "Run superposer.py over several hosts: a coordinator shards the minipocket DB, workers scan the shards"
+    parser = argparse.ArgumentParser(description=program_description)
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    coordinator = subparsers.add_parser("coordinator", help="shard the DB, serve shards and merge the results")
+    coordinator.add_argument("-i", "--initial_path", type=str, required=True,
+                             help="Absolute path to the main directory (containing DB, utilities, etc.)")
+    coordinator.add_argument("-T", "--target_receptor", type=str, required=True, help="target pocket PDB")
+    coordinator.add_argument("-d", "--pepbdb_folder", type=str, required=True, help="absolute path to database folder")
+    coordinator.add_argument("-fm", "--folder_minipockets", type=str, required=True, help="folder containing minipockets")
+    coordinator.add_argument("-ms", "--minipocket_store", type=str, default=None,
+                             help="packed minipocket store (default: <folder_minipockets>.store if present)")
+    for axis in "xyz":
+        coordinator.add_argument(f"-{axis}_center", f"--{axis}_center", type=float, required=True,
+                                 help=f"{axis} coordinate of center for gridbox")
+    for axis in "xyz":
+        coordinator.add_argument(f"-{axis}_size", f"--{axis}_size", type=float, required=True,
+                                 help=f"{axis} size for gridbox")
+    coordinator.add_argument("-rmsd", "--rmsd_allowed", type=float, default=0.5, help="RMSD cutoff for superposition")
+    coordinator.add_argument("-a", "--aligner", type=str, default="click", choices=["numpy", "click"],
+                             help="alignment backend used by the workers")
+    coordinator.add_argument("-ps", "--prescreen", type=float, default=1.0,
+                             help="fraction of the DB aligned after prescreening (workers need the index)")
+    coordinator.add_argument("--entries_file", type=str, default=None, help="scan only the minipockets listed in this file")
+    coordinator.add_argument("--lazy", action="store_true", help="keep accepted patches as lazy records")
+    coordinator.add_argument("--resume", action="store_true", help="skip minipockets already in the coordinator manifest")
+    coordinator.add_argument("--host", type=str, default="127.0.0.1",
+                             help=f"address to listen on (other than loopback: needs --authkey or ${AUTHKEY_ENV})")
+    coordinator.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on (0: any free port)")
+    coordinator.add_argument("--shard_size", type=int, default=2000, help="minipockets per shard")
+    coordinator.add_argument("--retries", type=int, default=2, help="retries of a failed shard")
+    coordinator.add_argument("--shard_timeout", type=float, default=6 * 3600,
+                             help="seconds before a silent worker's shard is given to another worker")
+    coordinator.add_argument("--local_workers", type=int, default=0,
+                             help="start this many workers on this host (localhost mode)")
+    coordinator.add_argument("--worker_threads", type=int, default=1, help="threads of each local worker")
+    coordinator.add_argument("--authkey", type=str, default=None,
+                             help=f"shared secret (default: ${AUTHKEY_ENV}, preferred as it stays out of ps; "
+                                  "on loopback without one, a random secret for the local workers)")
+
+    worker = subparsers.add_parser("worker", help="scan shards served by a coordinator")
+    worker.add_argument("--host", type=str, required=True, help="coordinator address")
+    worker.add_argument("--port", type=int, default=DEFAULT_PORT, help="coordinator port")
+    worker.add_argument("-t", "--threads", type=int, required=True, help="Number of threads")
+    worker.add_argument("-i", "--initial_path", type=str, default=None, help="main directory on this host (default: coordinator's)")
+    worker.add_argument("-d", "--pepbdb_folder", type=str, default=None, help="DB folder on this host (default: coordinator's)")
+    worker.add_argument("-fm", "--folder_minipockets", type=str, default=None,
+                        help="minipocket folder on this host (default: coordinator's)")
+    worker.add_argument("--scratch_dir", type=str, default=None, help="root for shard scratch folders")
+    worker.add_argument("--name", type=str, default=None, help="worker name shown in the coordinator log")
+    worker.add_argument("--connect_retries", type=int, default=30, help="seconds to wait for the coordinator")
+    worker.add_argument("--authkey", type=str, default=None, help=f"shared secret (default: ${AUTHKEY_ENV})")
+
+    args = parser.parse_args()
+    if args.mode == "coordinator":
+        run_coordinator(args)
+    else:
+        run_worker(args)
+
+
+if __name__ == "__main__":
+    main()
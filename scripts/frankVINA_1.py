@@ -11,11 +11,58 @@ from modeller import log
 from joblib import Parallel, delayed
 import math
 import multiprocessing
+import argparse
+import queue
+import threading
+import json
+import time
+import heapq
+import shutil
+from patches import FRAGMENTS_FILE, load_patches, materialize, read_fragment_records, write_fragment_pdb
+from pdb_arrays import read_pdb_atoms
+from patch_dedup import DEFAULT_RMSD, PatchDeduper, cluster_patches
+from triage_scorer import TriageScorer, correlation_report, select_top, triage_patches
+from vina_service import BACKENDS, batches, default_batch_size, get_scorer
+from receptor_cache import prepare_receptor
+from pdbqt_convert import pdbqt_to_pdb
+from ligand_prep import METHODS, default_method, prepare_ligand
+from results_db import finish_run, propagate_score, record_score, results_path, run_scores, set_pose, start_run
 # Configuration Variables
 
-initial_path = sys.argv[1]
+program_description = "Score superposer patches with Vina and keep the best ones"
+parser = argparse.ArgumentParser(description=program_description)
+parser.add_argument("initial_path", type=str,
+                    help="Absolute path to the main directory (containing DB, utilities, etc.)")
+parser.add_argument("threads", type=int, help="Number of threads")
+parser.add_argument("--stream", action="store_true",
+                    help="score patches announced on stdin ('PATCH<tab><path>' or 'FRAGMENT<tab><json>' lines, see superposer.py --stream) while they are being produced")
+parser.add_argument("--queue_size", type=int, default=64,
+                    help="maximum number of announced patches waiting for a Vina worker in --stream mode")
+parser.add_argument("--center", type=float, nargs=3, default=None, metavar=("X", "Y", "Z"),
+                    help="superposer gridbox center: receptor maps are computed once for it (default: --autobox per patch)")
+parser.add_argument("--size", type=float, nargs=3, default=None, metavar=("X", "Y", "Z"),
+                    help="superposer gridbox size")
+parser.add_argument("--ligand_prep", type=str, default=default_method(), choices=METHODS,
+                    help="patch protonation and PDBQT typing: in-process residue templates (native) or reduce + prepare_ligand (adfr)")
+parser.add_argument("--dedup_rmsd", type=float, default=DEFAULT_RMSD,
+                    help="patches with the same sequence and a backbone RMSD below this (Angstrom) are Vina-scored once "
+                         "and share the score of their cluster representative (0 scores every patch)")
+parser.add_argument("--top_k", type=int, default=10,
+                    help="number of best patches kept in top_{K}_patches, updated while patches are scored")
+parser.add_argument("--triage", type=float, default=1.0,
+                    help="fraction of the patches sent to Vina after ranking them with the NumPy triage score (1.0 = every patch)")
+parser.add_argument("--triage_report", action="store_true",
+                    help="score every patch with Vina anyway and report the triage/Vina rank correlation and top 10 recall")
+parser.add_argument("--vina_backend", type=str, default="auto", choices=BACKENDS,
+                    help="Vina Python bindings (receptor and maps loaded once per worker) or the Vina binary per patch; "
+                         "auto uses the bindings when installed and a gridbox is given")
+parser.add_argument("--vina_batch", type=int, default=default_batch_size(),
+                    help="patches per Vina invocation (binary --batch; a failed batch is scored patch by patch, 1 = one call per patch)")
+args = parser.parse_args()
+
+initial_path = args.initial_path
 receptor_file = "receptor.pdb"
-threads = sys.argv[2]
+threads = args.threads
 # [ADDED] ADFR Configuration
 ADFR_DIR = os.path.join(initial_path, "utilities/ADFRsuite_x86_64Linux_1.0")
 ADFR_BIN = os.path.join(ADFR_DIR, "bin")
@@ -34,7 +81,7 @@ REDUCE_DB_PATH = f"{initial_path}/DB/reduce_wwPDB_het_dict.txt"
 PREPARE_RECEPTOR_PATH = os.path.join(ADFR_BIN, "prepare_receptor")
 PREPARE_LIGAND_PATH = os.path.join(ADFR_BIN, "prepare_ligand")
 VINA_PATH = f"{initial_path}/utilities/vina_1.2.4_linux_x86_64"
-OBABEL_PATH = os.path.join(ADFR_BIN, "obabel")
+RESULTS_DB = results_path(initial_path)
 
 
 
@@ -42,65 +89,238 @@ tqdm._instances.clear()
 
 
 
-def scoring_filter():
-    # file_list = []
-    energy_patch_list = []
-    for file in os.listdir("."):
-        if fnmatch.fnmatch(file, '*.log'):
-            with open(file) as f:
-                for line in f.readlines():
-                    line = line.strip()
-                    if "Estimated" in line:
-                        energy_value = line.split(":")[1].split(" ")[1]
-                        energy_patch = float(energy_value), file
-                        energy_patch_list.append(energy_patch)
-
-    sorted_list = sorted(energy_patch_list,key=itemgetter(0))
-    if len(sorted_list) >= 1:
-        folder_output3 = f"../top_10_patches"
-        if not os.path.exists(folder_output3):
-            os.makedirs(folder_output3)
-        with open(f"{folder_output3}/top10_patches.tsv", "w") as outfile:
+class TopPatches:
+    """
+    Running top K of the scored patches in a bounded heap (worst leader on top).
+    A patch entering the top K is promoted at once, its pose written as PDB in
+    folder and top{K}_patches.tsv rewritten; a patch pushed out is removed, so
+    the folder always holds the current leaders and is final when scoring ends.
+    """
+
+    def __init__(self, k, folder, run_id):
+        self.k = k
+        self.folder = folder
+        self.run_id = run_id
+        self.heap = [] # (-energy, ligand)
+        self.models = {}
+        self.lock = threading.Lock()
+        if os.path.exists(folder): # Leaders of an earlier run
+            shutil.rmtree(folder)
+        os.makedirs(folder)
+
+    def offer(self, ligand, energy, pose):
+        if energy is None:
+            return
+        with self.lock:
+            if len(self.heap) < self.k:
+                heapq.heappush(self.heap, (-energy, ligand))
+            elif energy < -self.heap[0][0]:
+                _, evicted = heapq.heapreplace(self.heap, (-energy, ligand))
+                self.demote(evicted)
+            else:
+                return
+            self.promote(ligand, pose)
+            self.write_tsv()
+
+    def promote(self, ligand, pose):
+        # Best Vina model, heavy atoms; all models of the leaders stay in memory
+        self.models[ligand] = pdbqt_to_pdb(pose, f"{self.folder}/{ligand}.pdb")
+        set_pose(RESULTS_DB, self.run_id, ligand, f"{self.folder}/{ligand}.pdb")
+
+    def demote(self, ligand):
+        os.system(f"rm {self.folder}/{ligand}.pdb 2> /dev/null")
+        self.models.pop(ligand, None)
+        set_pose(RESULTS_DB, self.run_id, ligand, None)
+
+    def write_tsv(self):
+        tsv_file = f"{self.folder}/top{self.k}_patches.tsv"
+        with open(f"{tsv_file}.tmp", "w") as outfile:
             outfile.write("AffinityBindingPred\tPEP\n")
-            for selected in sorted_list[:10]:
-                energy_value = selected[0]
-                outfile.write(f"{energy_value}\t{selected[1].replace('.log', '')}\n")
-                patch_file = selected[1].replace(".log", ".pdb")
-                cmd_cp3 = ("cp {}_out.pdbqt {} 2> /dev/null").format(patch_file.replace(".pdb", ""), folder_output3)
-                os.system(cmd_cp3)
+            for energy_value, ligand in sorted((-energy, ligand) for energy, ligand in self.heap):
+                outfile.write(f"{energy_value}\t{ligand}\n")
+        os.replace(f"{tsv_file}.tmp", tsv_file) # Read live by the notebook
+
+
+def score_batch(scorer, batch):
+    """
+    Scores a batch of (patch file, lazy record or None) with one Vina invocation.
+    Lazy patches (superposer.py --lazy) are written only for the external tools
+    and removed afterwards.
+    """
+    batch = [(file, record) for file, record in batch if fnmatch.fnmatch(file, 'patch_file*.pdb')]
+    written = [file for file, record in batch if record is not None and write_fragment_pdb(record, ".") is not None]
+    try:
+        return scorer([(file, record) for file, record in batch if record is None or file in written])
+    finally:
+        for file in written:
+            os.remove(file)
+
+
+def stream_patches(scorer, n_workers, queue_size, batch_size, top, deduper=None):
+    """
+    Scores patches as superposer.py announces them on stdin. The queue is bounded,
+    so a saturated scoring pool stops reading the pipe and the producer waits.
+    Any other stdin line (superposer logs) is echoed to stdout. With a deduper,
+    patches joining an earlier representative are not queued. A worker takes
+    whatever is waiting, up to batch_size patches, for one Vina invocation.
+    """
+    patch_queue = queue.Queue(maxsize=queue_size)
+    progress = tqdm(desc="filtering peps by energy (streaming)")
+
+    def worker():
+        done = False
+        while not done:
+            batch = []
+            item = patch_queue.get()
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    break
+                try:
+                    item = patch_queue.get_nowait()
+                except queue.Empty:
+                    break
+            else:
+                done = True
+            if not batch:
+                continue
+            try:
+                for scored in score_batch(scorer, batch) or []:
+                    top.offer(*scored)
+            except Exception as e:
+                print(f"DEBUG: Error scoring {', '.join(file for file, record in batch)}: {e}")
+            progress.update(len(batch))
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, n_workers))]
+    for thread in workers:
+        thread.start()
+    announced = set()
+    for line in sys.stdin:
+        if line.startswith(("PATCH\t", "FRAGMENT\t")):
+            kind, value = line.rstrip("\n").split("\t", 1)
+            if kind == "PATCH":
+                file, record = os.path.relpath(value), None
+            else:
+                record = json.loads(value)
+                file = record["patch"]
+            if file not in announced: # Same patch accepted from several minipockets
+                announced.add(file)
+                if deduper is not None:
+                    atoms = read_pdb_atoms(file) if record is None else materialize(record)
+                    if atoms is not None and deduper.add(file, atoms) is not None:
+                        continue
+                patch_queue.put((file, record))
+        else:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+    for _ in workers:
+        patch_queue.put(None)
+    for thread in workers:
+        thread.join()
+    progress.close()
 
 
 def main():
-    os.system(f"{REDUCE_PATH} -Quiet -DB {REDUCE_DB_PATH} {receptor_file} 1> H_{receptor_file} 2> /dev/null")
-    os.system(f"sed -i '/END/d' H_{receptor_file}")
-    os.system(f'{PREPARE_RECEPTOR_PATH} -r H_{receptor_file} -o {receptor_file}qt')
+    if (args.center is None) != (args.size is None):
+        parser.error("--center and --size go together")
+    triage = args.triage < 1.0 or args.triage_report
+    if triage and args.stream:
+        parser.error("--triage ranks the complete patch list, it does not work with --stream")
+    # reduce + prepare_receptor, reused across runs and stages for the same receptor and tools
+    prepare_receptor(receptor_file, f"H_{receptor_file}", f"{receptor_file}qt", initial_path,
+                     REDUCE_PATH, REDUCE_DB_PATH, PREPARE_RECEPTOR_PATH)
     if not os.path.exists("temp_folder"):
         os.makedirs("temp_folder")
-    def vina_scorer(file):
-        if fnmatch.fnmatch(file, 'patch_file*.pdb'):
-            os.system(f"{REDUCE_PATH} -Quiet -DB {REDUCE_DB_PATH} {file} 1> H_{file} 2> /dev/null")
-            # os.system(f'{PREPARE_LIGAND_PATH} -A bonds,bonds_hydrogens,hydrogens -g -l H_{file} -o {file.replace(".pdb", ".pdbqt")} 1> /dev/null 2> /dev/null')
-            os.system(f'{PREPARE_LIGAND_PATH} -l H_{file} -o {file.replace(".pdb", ".pdbqt")} 1> /dev/null 2> /dev/null')
-            os.system(f'{VINA_PATH} --verbosity 0 --autobox --local_only --receptor {receptor_file}qt --ligand {file}qt > {file.replace(".pdb", "")}.log')
-            os.system(f'mv {file.replace(".pdb", "_out.pdbqt")} {file.replace(".pdb", "")}.log temp_folder')
-            os.system(f'rm H_{file} {file}qt 2> /dev/null')
-
-
-    Parallel(n_jobs=int(threads))(delayed(vina_scorer)(file) for file in tqdm(os.listdir("."), total=len(os.listdir(".")), 
-                                                                                        desc=f"filtering peps by energy"))
-    os.chdir("temp_folder")
-    scoring_filter()
-    os.chdir("../")
-    os.system("rm -r temp_folder")
-    if os.path.exists("top_10_patches"):
-        os.chdir("top_10_patches")
-        for pep_pdbqt in os.listdir("."):
-            if fnmatch.fnmatch(pep_pdbqt, '*.pdbqt'):
-                base = pep_pdbqt.replace("_out.pdbqt", "")
-                os.system(f"{OBABEL_PATH} -ipdbqt {pep_pdbqt} -o pdb -O {base}.pdb")
-                os.system(f'rm {pep_pdbqt} 1> /dev/null 2> /dev/null')
+    # Every score goes to the run-level results store as soon as Vina returns
+    run_id = start_run(RESULTS_DB, "vina1", ".", center=args.center, size=args.size,
+                       ligand_prep=args.ligand_prep, vina_backend=args.vina_backend)
+    top = TopPatches(args.top_k, f"top_{args.top_k}_patches", run_id)
+    def vina_scorer(batch):
+        """
+        Prepares and scores a batch of patches, returns their (ligand, energy, pose)
+        """
+        ligands = []
+        prep_seconds = []
+        for file, record in batch:
+            start = time.perf_counter()
+            prepare_ligand(file, file.replace(".pdb", ".pdbqt"), REDUCE_PATH, REDUCE_DB_PATH, PREPARE_LIGAND_PATH,
+                           args.ligand_prep)
+            prep_seconds.append(time.perf_counter() - start)
+            ligand = file.replace(".pdb", "")
+            ligands.append((f"{file}qt", f"{ligand}_out.pdbqt", f"{ligand}.log"))
+        if not ligands:
+            return []
+        start = time.perf_counter()
+        scorer = get_scorer(VINA_PATH, f"{receptor_file}qt", args.center, args.size, args.vina_backend)
+        energies = scorer.score_batch(ligands)
+        score_seconds = (time.perf_counter() - start) / len(ligands) # Vina time shared by the batch
+        scored = []
+        for (file, record), energy, prepared in zip(batch, energies, prep_seconds):
+            ligand = file.replace(".pdb", "")
+            os.system(f'mv {ligand}_out.pdbqt {ligand}.log temp_folder')
+            os.system(f'rm {file}qt 2> /dev/null')
+            source = {"patch": os.path.abspath(file), "ligand_prep": args.ligand_prep, "vina": scorer.name,
+                      "batch": len(ligands)}
+            if record is not None: # Lazy patch: its fragment record is the provenance
+                source["record"] = record
+            record_score(RESULTS_DB, run_id, "vina1", ligand, energy, pose=f"temp_folder/{ligand}_out.pdbqt",
+                         prep_seconds=prepared, score_seconds=score_seconds, source=source)
+            scored.append((ligand, energy, os.path.abspath(f"temp_folder/{ligand}_out.pdbqt")))
+        return scored
+
+
+    if args.stream:
+        deduper = PatchDeduper(args.dedup_rmsd) if args.dedup_rmsd > 0 else None
+        stream_patches(vina_scorer, int(threads), args.queue_size, args.vina_batch, top, deduper)
+        clusters = {} if deduper is None else deduper.members
     else:
-        print("Warning: 'top_10_patches' folder not found. No patches passed energy filter.")
+        # Patch files plus lazy records that were never written as PDB
+        lazy_records = read_fragment_records(FRAGMENTS_FILE)
+        clusters = {}
+        if args.dedup_rmsd > 0 or triage:
+            patches = load_patches(".")
+            patch_files = [file for file, atoms in patches]
+            if args.dedup_rmsd > 0:
+                # Only cluster representatives go to Vina
+                clusters = cluster_patches(patches, args.dedup_rmsd)
+                patch_files = list(clusters)
+                print(f"DEBUG: {len(patches)} patches -> {len(clusters)} representatives (RMSD <= {args.dedup_rmsd})")
+            if triage:
+                # Cheap Vina-like ranking, only the best fraction goes to Vina
+                representatives = set(patch_files)
+                triage_scores = triage_patches([(file, atoms) for file, atoms in patches if file in representatives],
+                                               TriageScorer(read_pdb_atoms(receptor_file), args.center, args.size))
+                triage_selected = select_top(triage_scores, args.triage, minimum=args.top_k)
+                print(f"DEBUG: Triage kept {len(triage_selected)}/{len(triage_scores)} patches for Vina")
+                if not args.triage_report:
+                    patch_files = triage_selected
+            patch_list = [(file, None if os.path.exists(file) else lazy_records[file]) for file in patch_files]
+        else:
+            patch_list = [(file, None) for file in os.listdir(".") if fnmatch.fnmatch(file, 'patch_file*.pdb')]
+            patch_list += [(file, record) for file, record in lazy_records.items() if not os.path.exists(file)]
+        # Per-worker batches, one Vina invocation each; leaders are promoted as batches come back
+        patch_batches = batches(patch_list, int(threads), args.vina_batch)
+        for batch_scores in tqdm(Parallel(n_jobs=int(threads), return_as="generator")(
+                                     delayed(score_batch)(vina_scorer, batch) for batch in patch_batches),
+                                 total=len(patch_batches), desc=f"filtering peps by energy ({len(patch_list)} patches)"):
+            for scored in batch_scores or []:
+                top.offer(*scored)
+    for representative, members in clusters.items():
+        if members:
+            propagate_score(RESULTS_DB, run_id, "vina1", representative.replace(".pdb", ""),
+                            [(member.replace(".pdb", ""), rmsd) for member, rmsd in members])
+    if triage:
+        report = correlation_report({file.replace(".pdb", ""): value for file, value in triage_scores.items()},
+                                    run_scores(RESULTS_DB, run_id), args.triage,
+                                    [file.replace(".pdb", "") for file in triage_selected], top=args.top_k)
+        with open("triage_report.json", "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"Triage/Vina Spearman correlation over {report['vina_scored']} patches: {report['spearman']}")
+    os.system("rm -r temp_folder")
+    if not top.heap:
+        os.rmdir(top.folder)
+        print(f"Warning: '{top.folder}' folder not created. No patches passed energy filter.")
+    finish_run(RESULTS_DB, run_id)
 
 if __name__ == '__main__':
     main()
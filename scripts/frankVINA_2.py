@@ -14,6 +14,12 @@ import multiprocessing
 import shutil
 import subprocess
 import random  # Para hacer la muestra aleatoria
+import time
+from receptor_cache import prepare_receptor
+from ligand_prep import prepare_ligand
+from vina_service import batches, default_batch_size, get_scorer
+from pdbqt_convert import convert_all
+from results_db import finish_run, record_score, results_path, set_pose, start_run, top_scores
 
 initial_path = sys.argv[1]
 # Modified to use pocket.pdb for speed
@@ -39,7 +45,7 @@ REDUCE_DB_PATH = f"{initial_path}/DB/reduce_wwPDB_het_dict.txt"
 PREPARE_RECEPTOR_PATH = os.path.join(ADFR_BIN, "prepare_receptor")
 PREPARE_LIGAND_PATH = os.path.join(ADFR_BIN, "prepare_ligand")
 VINA_PATH = f"{initial_path}/utilities/vina_1.2.4_linux_x86_64"
-OBABEL_PATH = os.path.join(ADFR_BIN, "obabel")
+RESULTS_DB = results_path(initial_path)
 
 frank_folder_init = os.getcwd()
 tqdm._instances.clear()
@@ -109,71 +115,81 @@ def minimization(pdb_file_no_extension, mode):
             mdl1.write(file='min_'+code+'.pdb')
             run_cmd(f"rm {code}.pdb 2> /dev/null")
 
-def scoring_filter():
-    energy_patch_list = []
-    for file in os.listdir("."):
-        if fnmatch.fnmatch(file, '*.log'):
-            with open(file) as f:
-                for line in f:
-                    line = line.strip()
-                    if "Estimated" in line:
-                        energy_value = line.split(":")[1].split(" ")[1]
-                        if float(energy_value) < 0:
-                            energy_patch_list.append((float(energy_value), file))
-
-    sorted_list = sorted(energy_patch_list, key=itemgetter(0))
-    if len(sorted_list) >= 1:
+def scoring_filter(run_id):
+    # Negative energies only, ranked by the results store
+    selected_list = top_scores(RESULTS_DB, run_id, selected_peps, max_score=0)
+    if len(selected_list) >= 1:
         folder_output3 = f"../top_{selected_peps}_peps"
         if not os.path.exists(folder_output3):
             os.makedirs(folder_output3)
         with open(f"{folder_output3}/top{selected_peps}_peps.tsv", "w") as outfile:
             outfile.write("AffinityBindingPred\tPEP\n")
-            for selected in sorted_list[:selected_peps]:
-                energy_value = selected[0]
-                outfile.write(f"{energy_value}\t{selected[1].replace('.log', '')}\n")
-                patch_file = selected[1].replace(".log", ".pdb")
-                run_cmd(f"mv MinPEP_{patch_file.replace('.pdb', '')}_out.pdbqt {folder_output3} 2> /dev/null")
+            for energy_value, ligand, pose in selected_list:
+                outfile.write(f"{energy_value}\t{ligand}\n")
+                run_cmd(f"mv {pose} {folder_output3} 2> /dev/null")
 
 def main():
     # 1) Crear temp_folder
     if not os.path.exists("temp_folder"):
         os.makedirs("temp_folder")
 
-    # reduce receptor
-    run_cmd(f"{REDUCE_PATH} -Quiet -DB {REDUCE_DB_PATH} {receptor_file} 1> temp_folder/H_{receptor_file} 2> /dev/null")
-
-    os.chdir("temp_folder")
-    run_cmd(f"sed -i '/END/d' H_{receptor_file} ; {PREPARE_RECEPTOR_PATH} -r H_{receptor_file} -o MinREC_{receptor_file}qt 1> /dev/null 2> /dev/null")
-    os.chdir(frank_folder_init)
+    # reduce + prepare_receptor, reused across runs and stages for the same pocket and tools
+    prepare_receptor(receptor_file, f"temp_folder/H_{receptor_file}", f"temp_folder/MinREC_{receptor_file}qt",
+                     initial_path, REDUCE_PATH, REDUCE_DB_PATH, PREPARE_RECEPTOR_PATH)
 
     if not os.path.exists("results_folder"):
         os.makedirs("results_folder")
 
-    def vina_scorer(file):
+    # Every score goes to the run-level results store as soon as Vina returns
+    run_id = start_run(RESULTS_DB, "vina2", frank_folder_init, selected_peps=selected_peps, max_peptides=MAX_PEPTIDES)
+
+    def minimize_fragment(file):
+        """
+        Peptide, then complex minimization of one fragment inside temp_folder; returns its ligand PDBQT
+        """
+        run_cmd(f"mv ../{file} . 2> /dev/null")
+        minimization(file.replace(".pdb", ""), "pep")
+        min_file = f"min_{file.replace('.pdb','')}.pdb"
+        run_cmd(f"cat H_{receptor_file} {min_file} > complex_{min_file} 2> /dev/null")
+        complex_file = f"complex_{min_file.replace('.pdb','')}"
+        minimization(complex_file, "prot")
+        complex_min_file = f'{complex_file}_min.pdb'
+        run_cmd(f'cat {complex_min_file} | grep " x " | grep -v "TER" 1> MinPEP_{min_file} 2> /dev/null')
+        # reduce + prepare_ligand ($FRANKPEPSTEIN_LIGAND_PREP=native: templates in-process)
+        prepare_ligand(f"MinPEP_{min_file}", f"MinPEP_{min_file.replace('.pdb', '.pdbqt')}",
+                       REDUCE_PATH, REDUCE_DB_PATH, PREPARE_LIGAND_PATH, strip_end=True)
+        return f"MinPEP_{min_file.replace('.pdb', '.pdbqt')}"
+
+    def vina_scorer(batch):
         os.chdir(frank_folder_init)
-        if "noEND" not in file:
-            run_cmd(f"mv {file} temp_folder 2> /dev/null")
-            os.chdir("temp_folder")
-            minimization(file.replace(".pdb", ""), "pep")
+        os.chdir("temp_folder")
+        ligands = []
+        prep_seconds = []
+        for file in batch:
+            if "noEND" in file:
+                continue
+            start = time.perf_counter()
+            ligand_pdbqt = minimize_fragment(file)
+            prep_seconds.append(time.perf_counter() - start)
             min_file = f"min_{file.replace('.pdb','')}.pdb"
-            run_cmd(f"cat H_{receptor_file} {min_file} > complex_{min_file} 2> /dev/null")
+            ligands.append((file, min_file, (ligand_pdbqt, f"MinPEP_{min_file.replace('.pdb','')}_out.pdbqt",
+                                             f"{min_file.replace('.pdb','')}.log")))
+        if not ligands:
+            return
+        # One Vina invocation (--batch) for the whole batch, one per ligand if it fails
+        start = time.perf_counter()
+        energies = get_scorer(VINA_PATH, f"MinREC_{receptor_file}qt", backend="cli").score_batch(
+            [ligand for file, min_file, ligand in ligands])
+        score_seconds = (time.perf_counter() - start) / len(ligands)
+        for (file, min_file, (ligand_pdbqt, out_pdbqt, log_file)), energy, prepared in zip(ligands, energies, prep_seconds):
+            run_cmd(f"mv {out_pdbqt} {log_file} ../results_folder")
+            record_score(RESULTS_DB, run_id, "vina2", min_file.replace('.pdb', ''), energy,
+                         pose=os.path.join(frank_folder_init, "results_folder", out_pdbqt),
+                         prep_seconds=prepared, score_seconds=score_seconds,
+                         source={"fragment": os.path.join(frank_folder_init, file), "sampled": MAX_PEPTIDES,
+                                 "batch": len(ligands)})
             complex_file = f"complex_{min_file.replace('.pdb','')}"
-            minimization(complex_file, "prot")
             complex_min_file = f'{complex_file}_min.pdb'
-            run_cmd(
-                f'cat {complex_min_file} | grep " x " | grep -v "TER" 1> MinPEP_{min_file} 2> /dev/null ; '
-                f'{REDUCE_PATH} -Quiet -DB {REDUCE_DB_PATH} MinPEP_{min_file} 1> H_MinPEP_{min_file} 2> /dev/null ; '
-                f"sed -i '/END/d' H_MinPEP_{min_file} ; "
-                f"{PREPARE_LIGAND_PATH} -l H_MinPEP_{min_file} -o MinPEP_{min_file.replace('.pdb', '.pdbqt')} 1> /dev/null 2> /dev/null"
-            )
-            log_file = f"{min_file.replace('.pdb','')}.log"
-            cmd_vina = (
-                f"{VINA_PATH} --verbosity 0 --autobox --local_only "
-                f"--receptor MinREC_{receptor_file}qt --ligand MinPEP_{min_file.replace('.pdb', '.pdbqt')} > {log_file}"
-            )
-            run_cmd(cmd_vina)
-            out_pdbqt = f"MinPEP_{min_file.replace('.pdb','')}_out.pdbqt"
-            run_cmd(f"mv {out_pdbqt} {log_file} ../results_folder")
             run_cmd(
                 f"rm {complex_min_file} MinREC_{receptor_file} complex_{min_file} MinPEP_{min_file}qt "
                 f"H_MinPEP_{min_file} MinREC_{min_file}qt {complex_file}_min.pdb MinPEP_{min_file} "
@@ -194,15 +210,16 @@ def main():
     
     # Resto de archivos se ignoran, solo procesamos la muestra
 
-    # Paralelizar con joblib usando la lista reducida
+    # Paralelizar con joblib usando la lista reducida, en lotes por worker
+    frag_batches = batches(frag_files, int(threads), default_batch_size())
     Parallel(n_jobs=int(threads))(
-        delayed(vina_scorer)(file)
-        for file in tqdm(frag_files, total=len(frag_files), desc="Minimizing complexes")
+        delayed(vina_scorer)(batch)
+        for batch in tqdm(frag_batches, total=len(frag_batches), desc=f"Minimizing complexes ({len(frag_files)} peptides)")
     )
 
     print("Minimization complete. Ranking results...")
     os.chdir("results_folder")
-    scoring_filter()
+    scoring_filter(run_id)
     os.chdir(frank_folder_init)
     
     print("Cleaning up temporary files...")
@@ -215,14 +232,15 @@ def main():
     top_dir = f"top_{selected_peps}_peps"
     full_path_top = os.path.join(current_dir, top_dir)
     if os.path.exists(full_path_top):
-        os.chdir(top_dir)
-        for pep_pdbqt in os.listdir("."):
-            if fnmatch.fnmatch(pep_pdbqt, '*.pdbqt'):
-                base = pep_pdbqt.replace(".pdbqt", "")
-                run_cmd(f"{OBABEL_PATH} -ipdbqt {pep_pdbqt} -o pdb -O {base}.pdb ; rm {pep_pdbqt}")
+        # Best model, heavy atoms, all poses converted in this process
+        pep_pdbqts = [os.path.join(full_path_top, f) for f in os.listdir(full_path_top) if fnmatch.fnmatch(f, '*.pdbqt')]
+        for pep_pdbqt, (pdb_file, models) in convert_all(pep_pdbqts, remove=True).items():
+            base = os.path.basename(pdb_file).replace(".pdb", "")
+            set_pose(RESULTS_DB, run_id, base[len("MinPEP_"):-len("_out")], pdb_file)
         print(f"Done! Results in {top_dir}")
     else:
         print(f"No final candidates found in {current_dir}.")
+    finish_run(RESULTS_DB, run_id)
 def main_wrapper():
     main()
 
@@ -0,0 +1,80 @@
+import numpy as np
+
+# KD-tree queries when scipy is available, chunked brute force otherwise
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+CLASH_DISTANCE = 1.8
+CHUNK_SIZE = 4096
+
+
+def pocket_tree(pocket_coords):
+    """
+    Spatial index over pocket atoms, reusable across clash queries
+    """
+    pocket_coords = np.asarray(pocket_coords, dtype=np.float64)
+    if cKDTree is not None:
+        return cKDTree(pocket_coords)
+    return pocket_coords
+
+
+def nearest_distances(coords, tree):
+    """
+    Distance from each coordinate to the closest pocket atom
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if len(coords) == 0:
+        return np.zeros(0)
+    if cKDTree is not None and isinstance(tree, cKDTree):
+        return tree.query(coords, k=1)[0]
+    nearest = np.empty(len(coords))
+    for start in range(0, len(coords), CHUNK_SIZE):
+        block = coords[start:start + CHUNK_SIZE]
+        nearest[start:start + CHUNK_SIZE] = np.sqrt(
+            ((block[:, None, :] - tree[None, :, :]) ** 2).sum(axis=-1)).min(axis=1)
+    return nearest
+
+
+def clash_free_residues(coords, residue_index, tree, min_distance=CLASH_DISTANCE):
+    """
+    True for each residue whose atoms all stay at >= min_distance from the pocket.
+    residue_index maps every atom to its residue (0..n_residues-1).
+    """
+    residue_index = np.asarray(residue_index)
+    n_residues = int(residue_index.max()) + 1 if len(residue_index) else 0
+    clashing = nearest_distances(coords, tree) < min_distance
+    return np.bincount(residue_index, weights=clashing, minlength=n_residues) == 0
+
+
+def in_box(coords, center, size):
+    """
+    Mask of coordinates strictly inside an axis-aligned gridbox
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    center = np.asarray(center, dtype=np.float64)
+    half = np.asarray(size, dtype=np.float64) / 2
+    return np.all((coords > center - half) & (coords < center + half), axis=-1)
+
+
+def pairwise_distances(coords_a, coords_b=None):
+    """
+    Dense Euclidean distance matrix (coords_b defaults to coords_a)
+    """
+    coords_a = np.asarray(coords_a, dtype=np.float64)
+    coords_b = coords_a if coords_b is None else np.asarray(coords_b, dtype=np.float64)
+    return np.sqrt(((coords_a[:, None, :] - coords_b[None, :, :]) ** 2).sum(axis=-1))
+
+
+def close_pairs(coords, max_distance):
+    """
+    Index pairs (i < j) of coordinates closer than max_distance, e.g. bonds
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if len(coords) < 2:
+        return np.zeros((0, 2), dtype=int)
+    if cKDTree is not None:
+        return cKDTree(coords).query_pairs(max_distance, output_type="ndarray")
+    i, j = np.nonzero(np.triu(pairwise_distances(coords) < max_distance, k=1))
+    return np.column_stack([i, j])
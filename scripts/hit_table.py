@@ -0,0 +1,141 @@
+import os
+import json
+import glob
+import shutil
+import numpy as np
+
+# Every alignment produced during a scan (accepted or not), one row per
+# minipocket and target pocket, stored as memory-mappable columns:
+#   minipockets (file names), rmsd, overlap, matched, rotation (n, 3, 3), translation (n, 3)
+# The scan parent appends one part_*.npz per finished chunk, merged into the
+# columns when the scan ends. A crashed scan leaves parts that are still read.
+HIT_TABLE_FORMAT = "frankpepstein-hit-table"
+HIT_TABLE_VERSION = 1
+HIT_TABLE_DIR = "alignment_hits"
+META_FILE = "meta.json"
+HIT_COLUMNS = {
+    "minipockets": "S",
+    "rmsd": np.float32,
+    "overlap": np.float32,
+    "matched": np.int32,
+    "rotation": np.float32,
+    "translation": np.float32,
+}
+COLUMN_SHAPES = {"rotation": (3, 3), "translation": (3,)}
+
+
+def _empty_columns():
+    return {column: np.zeros((0,) + COLUMN_SHAPES.get(column, ()),
+                             dtype="S1" if dtype == "S" else dtype)
+            for column, dtype in HIT_COLUMNS.items()}
+
+
+def hit_rows(results):
+    """
+    Columns for the (minipocket, status, output, alignment) results that carry an alignment
+    """
+    rows = [(file, alignment) for file, status, output, alignment in results if alignment is not None]
+    if not rows:
+        return None
+    files, alignments = zip(*rows)
+    return {
+        "minipockets": np.array(files, dtype=bytes),
+        "rmsd": np.array([a.rmsd for a in alignments], dtype=np.float32),
+        "overlap": np.array([a.overlap for a in alignments], dtype=np.float32),
+        "matched": np.array([a.matched for a in alignments], dtype=np.int32),
+        "rotation": np.array([a.rotation for a in alignments], dtype=np.float32).reshape(-1, 3, 3),
+        "translation": np.array([a.translation for a in alignments], dtype=np.float32).reshape(-1, 3),
+    }
+
+
+def _concat(parts):
+    parts = [part for part in parts if part is not None and len(part["minipockets"])]
+    if not parts:
+        return _empty_columns()
+    columns = {column: np.concatenate([part[column] for part in parts]) for column in HIT_COLUMNS}
+    # A minipocket scanned twice (resumed scan) keeps its last alignment
+    files = columns["minipockets"][::-1]
+    _, last = np.unique(files, return_index=True)
+    keep = np.sort(len(files) - 1 - last)
+    return {column: values[keep] for column, values in columns.items()}
+
+
+def _load_columns(table_path, mmap_mode=None):
+    if not os.path.exists(os.path.join(table_path, "rmsd.npy")):
+        return None
+    return {column: np.load(os.path.join(table_path, f"{column}.npy"), mmap_mode=mmap_mode)
+            for column in HIT_COLUMNS}
+
+
+def _load_parts(table_path):
+    parts = []
+    for part_file in sorted(glob.glob(os.path.join(table_path, "part_*.npz"))):
+        with np.load(part_file) as part:
+            parts.append({column: part[column] for column in HIT_COLUMNS})
+    return parts
+
+
+class HitTableWriter:
+    """
+    Parent-side writer of a hit table. With resume=True the rows of the
+    interrupted scan are kept and new parts are numbered after them.
+    """
+
+    def __init__(self, table_path, meta, resume=False):
+        self.table_path = table_path
+        if not resume and os.path.exists(table_path):
+            shutil.rmtree(table_path)
+        os.makedirs(table_path, exist_ok=True)
+        with open(os.path.join(table_path, META_FILE), "w") as f:
+            json.dump({"format": HIT_TABLE_FORMAT, "version": HIT_TABLE_VERSION, **meta}, f, indent=4)
+        self.n_parts = len(glob.glob(os.path.join(table_path, "part_*.npz")))
+
+    def add(self, results):
+        """
+        Stores the alignments of one finished chunk as a new part
+        """
+        self.add_columns(hit_rows(results))
+
+    def add_columns(self, rows):
+        """
+        Stores hit columns (e.g. read from another table) as a new part
+        """
+        if rows is None or len(rows["minipockets"]) == 0:
+            return
+        self.n_parts += 1
+        part_file = os.path.join(self.table_path, f"part_{self.n_parts:06d}.npz")
+        np.savez(part_file + ".tmp.npz", **rows)
+        os.replace(part_file + ".tmp.npz", part_file)
+
+    def close(self):
+        """
+        Merges parts (and a previous merge) into the final columns
+        """
+        parts = _load_parts(self.table_path)
+        if not parts:
+            if _load_columns(self.table_path) is None:
+                for column, values in _empty_columns().items():
+                    np.save(os.path.join(self.table_path, f"{column}.npy"), values)
+            return
+        columns = _concat([_load_columns(self.table_path)] + parts)
+        for column, values in columns.items():
+            np.save(os.path.join(self.table_path, f"{column}.npy.tmp.npy"), values)
+            os.replace(os.path.join(self.table_path, f"{column}.npy.tmp.npy"),
+                       os.path.join(self.table_path, f"{column}.npy"))
+        for part_file in glob.glob(os.path.join(self.table_path, "part_*.npz")):
+            os.remove(part_file)
+
+
+def read_hit_table(table_path):
+    """
+    (meta, columns) of a hit table, including parts left by an interrupted scan
+    """
+    with open(os.path.join(table_path, META_FILE)) as f:
+        meta = json.load(f)
+    if meta.get("format") != HIT_TABLE_FORMAT or meta.get("version") != HIT_TABLE_VERSION:
+        raise ValueError(f"{table_path} is not a v{HIT_TABLE_VERSION} hit table")
+    parts = _load_parts(table_path)
+    columns = _load_columns(table_path, mmap_mode="r")
+    if parts:
+        columns = _concat([columns] + parts)
+    return meta, columns if columns is not None else _empty_columns()
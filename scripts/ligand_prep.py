@@ -0,0 +1,567 @@
+import os
+import sys
+import argparse
+import subprocess
+import tempfile
+from collections import deque
+import numpy as np
+
+from pdb_arrays import format_atom_line, read_pdb_atoms
+
+# AutoDock-typed PDBQT of peptide ligands built in-process from residue
+# templates, replacing reduce + prepare_ligand (ADFR) for the 20 standard
+# residues. It follows what that pair produces with its defaults:
+#   - polar hydrogens only (reduce -OH default: OH/SH hydrogens, no His ring NH;
+#     an N-terminal NH3+ only for residue 1, as reduce -Nterm1; nonpolar
+#     hydrogens merged into their carbon, as prepare_ligand -U nphs_lps)
+#   - types C/A/N/NA/OA/SA/HD/H, Gasteiger-Marsili charges (neutral start)
+#   - torsion tree with amide and guanidinium bonds kept rigid; TORSDOF does
+#     not count torsions that only move hydrogens
+# Unsupported input raises ValueError; prepare_ligand() then runs the ADFR tools.
+LIGAND_PREP_ENV = "FRANKPEPSTEIN_LIGAND_PREP"
+METHODS = ["native", "adfr"]
+
+# Heavy atoms: name -> (element, hybridization, nonpolar H count)
+BACKBONE = {"N": ("N", 2, 0), "CA": ("C", 3, 1), "C": ("C", 2, 0), "O": ("O", 2, 0), "OXT": ("O", 2, 0)}
+BACKBONE_BONDS = [("N", "CA"), ("CA", "C"), ("C", "O"), ("C", "OXT")]
+SIDE_CHAINS = {
+    "ALA": {"CB": ("C", 3, 3)},
+    "ARG": {"CB": ("C", 3, 2), "CG": ("C", 3, 2), "CD": ("C", 3, 2), "NE": ("N", 2, 0), "CZ": ("C", 2, 0),
+            "NH1": ("N", 2, 0), "NH2": ("N", 2, 0)},
+    "ASN": {"CB": ("C", 3, 2), "CG": ("C", 2, 0), "OD1": ("O", 2, 0), "ND2": ("N", 2, 0)},
+    "ASP": {"CB": ("C", 3, 2), "CG": ("C", 2, 0), "OD1": ("O", 2, 0), "OD2": ("O", 2, 0)},
+    "CYS": {"CB": ("C", 3, 2), "SG": ("S", 3, 0)},
+    "GLN": {"CB": ("C", 3, 2), "CG": ("C", 3, 2), "CD": ("C", 2, 0), "OE1": ("O", 2, 0), "NE2": ("N", 2, 0)},
+    "GLU": {"CB": ("C", 3, 2), "CG": ("C", 3, 2), "CD": ("C", 2, 0), "OE1": ("O", 2, 0), "OE2": ("O", 2, 0)},
+    "GLY": {},
+    "HIS": {"CB": ("C", 3, 2), "CG": ("C", 2, 0), "ND1": ("N", 2, 0), "CD2": ("C", 2, 1), "CE1": ("C", 2, 1),
+            "NE2": ("N", 2, 0)},
+    "ILE": {"CB": ("C", 3, 1), "CG1": ("C", 3, 2), "CG2": ("C", 3, 3), "CD1": ("C", 3, 3)},
+    "LEU": {"CB": ("C", 3, 2), "CG": ("C", 3, 1), "CD1": ("C", 3, 3), "CD2": ("C", 3, 3)},
+    "LYS": {"CB": ("C", 3, 2), "CG": ("C", 3, 2), "CD": ("C", 3, 2), "CE": ("C", 3, 2), "NZ": ("N", 3, 0)},
+    "MET": {"CB": ("C", 3, 2), "CG": ("C", 3, 2), "SD": ("S", 3, 0), "CE": ("C", 3, 3)},
+    "PHE": {"CB": ("C", 3, 2), "CG": ("C", 2, 0), "CD1": ("C", 2, 1), "CD2": ("C", 2, 1), "CE1": ("C", 2, 1),
+            "CE2": ("C", 2, 1), "CZ": ("C", 2, 1)},
+    "PRO": {"CB": ("C", 3, 2), "CG": ("C", 3, 2), "CD": ("C", 3, 2)},
+    "SER": {"CB": ("C", 3, 2), "OG": ("O", 3, 0)},
+    "THR": {"CB": ("C", 3, 1), "OG1": ("O", 3, 0), "CG2": ("C", 3, 3)},
+    "TRP": {"CB": ("C", 3, 2), "CG": ("C", 2, 0), "CD1": ("C", 2, 1), "CD2": ("C", 2, 0), "NE1": ("N", 2, 0),
+            "CE2": ("C", 2, 0), "CE3": ("C", 2, 1), "CZ2": ("C", 2, 1), "CZ3": ("C", 2, 1), "CH2": ("C", 2, 1)},
+    "TYR": {"CB": ("C", 3, 2), "CG": ("C", 2, 0), "CD1": ("C", 2, 1), "CD2": ("C", 2, 1), "CE1": ("C", 2, 1),
+            "CE2": ("C", 2, 1), "CZ": ("C", 2, 0), "OH": ("O", 3, 0)},
+    "VAL": {"CB": ("C", 3, 1), "CG1": ("C", 3, 3), "CG2": ("C", 3, 3)},
+}
+SIDE_CHAIN_BONDS = {
+    "ALA": [("CA", "CB")],
+    "ARG": [("CA", "CB"), ("CB", "CG"), ("CG", "CD"), ("CD", "NE"), ("NE", "CZ"), ("CZ", "NH1"), ("CZ", "NH2")],
+    "ASN": [("CA", "CB"), ("CB", "CG"), ("CG", "OD1"), ("CG", "ND2")],
+    "ASP": [("CA", "CB"), ("CB", "CG"), ("CG", "OD1"), ("CG", "OD2")],
+    "CYS": [("CA", "CB"), ("CB", "SG")],
+    "GLN": [("CA", "CB"), ("CB", "CG"), ("CG", "CD"), ("CD", "OE1"), ("CD", "NE2")],
+    "GLU": [("CA", "CB"), ("CB", "CG"), ("CG", "CD"), ("CD", "OE1"), ("CD", "OE2")],
+    "GLY": [],
+    "HIS": [("CA", "CB"), ("CB", "CG"), ("CG", "ND1"), ("ND1", "CE1"), ("CE1", "NE2"), ("NE2", "CD2"), ("CD2", "CG")],
+    "ILE": [("CA", "CB"), ("CB", "CG1"), ("CB", "CG2"), ("CG1", "CD1")],
+    "LEU": [("CA", "CB"), ("CB", "CG"), ("CG", "CD1"), ("CG", "CD2")],
+    "LYS": [("CA", "CB"), ("CB", "CG"), ("CG", "CD"), ("CD", "CE"), ("CE", "NZ")],
+    "MET": [("CA", "CB"), ("CB", "CG"), ("CG", "SD"), ("SD", "CE")],
+    "PHE": [("CA", "CB"), ("CB", "CG"), ("CG", "CD1"), ("CG", "CD2"), ("CD1", "CE1"), ("CD2", "CE2"),
+            ("CE1", "CZ"), ("CE2", "CZ")],
+    "PRO": [("CA", "CB"), ("CB", "CG"), ("CG", "CD"), ("CD", "N")],
+    "SER": [("CA", "CB"), ("CB", "OG")],
+    "THR": [("CA", "CB"), ("CB", "OG1"), ("CB", "CG2")],
+    "TRP": [("CA", "CB"), ("CB", "CG"), ("CG", "CD1"), ("CD1", "NE1"), ("NE1", "CE2"), ("CE2", "CD2"),
+            ("CD2", "CG"), ("CD2", "CE3"), ("CE3", "CZ3"), ("CZ3", "CH2"), ("CH2", "CZ2"), ("CZ2", "CE2")],
+    "TYR": [("CA", "CB"), ("CB", "CG"), ("CG", "CD1"), ("CG", "CD2"), ("CD1", "CE1"), ("CD2", "CE2"),
+            ("CE1", "CZ"), ("CE2", "CZ"), ("CZ", "OH")],
+    "VAL": [("CA", "CB"), ("CB", "CG1"), ("CB", "CG2")],
+}
+# Polar hydrogens: (name, parent, rule). Rules: ("bisect", n1, n2) in the plane
+# of the parent's two neighbours; ("dihedral", b, a, angle, torsions) placed
+# with bond angle b-parent-H and dihedral a-b-parent-H (degrees).
+SIDE_CHAIN_HYDROGENS = {
+    "ARG": [("HE", "NE", ("bisect", "CD", "CZ")),
+            ("HH11", "NH1", ("dihedral", "CZ", "NE", 120.0, [0.0])),
+            ("HH12", "NH1", ("dihedral", "CZ", "NE", 120.0, [180.0])),
+            ("HH21", "NH2", ("dihedral", "CZ", "NE", 120.0, [180.0])),
+            ("HH22", "NH2", ("dihedral", "CZ", "NE", 120.0, [0.0]))],
+    "ASN": [("HD21", "ND2", ("dihedral", "CG", "OD1", 120.0, [180.0])),
+            ("HD22", "ND2", ("dihedral", "CG", "OD1", 120.0, [0.0]))],
+    "CYS": [("HG", "SG", ("dihedral", "CB", "CA", 96.0, [180.0]))],
+    "GLN": [("HE21", "NE2", ("dihedral", "CD", "OE1", 120.0, [180.0])),
+            ("HE22", "NE2", ("dihedral", "CD", "OE1", 120.0, [0.0]))],
+    "LYS": [("HZ1", "NZ", ("dihedral", "CE", "CD", 109.5, [180.0])),
+            ("HZ2", "NZ", ("dihedral", "CE", "CD", 109.5, [60.0])),
+            ("HZ3", "NZ", ("dihedral", "CE", "CD", 109.5, [-60.0]))],
+    "SER": [("HG", "OG", ("dihedral", "CB", "CA", 109.5, [180.0]))],
+    "THR": [("HG1", "OG1", ("dihedral", "CB", "CA", 109.5, [180.0]))],
+    "TRP": [("HE1", "NE1", ("bisect", "CD1", "CE2"))],
+    "TYR": [("HH", "OH", ("dihedral", "CZ", "CE1", 110.0, [180.0]))],
+}
+H_BOND_LENGTH = {"N": 1.01, "O": 0.96, "S": 1.33}
+PEPTIDE_BOND_MAX = 2.0
+# Gasteiger-Marsili electronegativity parameters (a, b, c) by (element, hybridization)
+GASTEIGER = {("H", 0): (7.17, 6.24, -0.56),
+             ("C", 3): (7.98, 9.18, 1.88), ("C", 2): (8.79, 9.32, 1.51), ("C", 1): (10.39, 9.45, 0.73),
+             ("N", 3): (11.54, 10.82, 1.36), ("N", 2): (12.87, 11.15, 0.85), ("N", 1): (15.68, 11.70, -0.27),
+             ("O", 3): (14.18, 12.92, 1.39), ("O", 2): (17.07, 13.79, 0.47),
+             ("S", 3): (10.14, 9.13, 1.38)}
+HYDROGEN_CHI_PLUS = 20.02
+GASTEIGER_ITERATIONS = 6
+
+
+def place_dihedral(a, b, c, bond, angle, torsion):
+    """
+    Position d with |cd| = bond, angle b-c-d and dihedral a-b-c-d (degrees)
+    """
+    angle, torsion = np.radians(angle), np.radians(torsion)
+    bc = (c - b) / np.linalg.norm(c - b)
+    n = np.cross(b - a, bc)
+    n /= np.linalg.norm(n)
+    m = np.cross(n, bc)
+    return c + bond * (-np.cos(angle) * bc + np.sin(angle) * np.cos(torsion) * m
+                       + np.sin(angle) * np.sin(torsion) * n)
+
+
+def place_bisect(parent, n1, n2, bond):
+    direction = (parent - n1) / np.linalg.norm(parent - n1) + (parent - n2) / np.linalg.norm(parent - n2)
+    return parent + bond * direction / np.linalg.norm(direction)
+
+
+def is_hydrogen(element, atom_name):
+    # Without an element column, read_pdb_atoms falls back to the first name character ('1' in '1HB')
+    return element == "H" or (not element.isalpha() and atom_name.lstrip("0123456789").startswith("H"))
+
+
+class Ligand:
+    """
+    Heavy atoms of a peptide plus template polar hydrogens, with the bond graph
+    """
+
+    def __init__(self):
+        self.names, self.res_names, self.chains, self.res_ids, self.icodes = [], [], [], [], []
+        self.elements, self.hybridizations, self.implicit_h, self.coords = [], [], [], []
+        self.bonds = []
+
+    def add_atom(self, name, res_name, chain, res_id, icode, element, hybridization, implicit_h, xyz):
+        self.names.append(name)
+        self.res_names.append(res_name)
+        self.chains.append(chain)
+        self.res_ids.append(res_id)
+        self.icodes.append(icode)
+        self.elements.append(element)
+        self.hybridizations.append(hybridization)
+        self.implicit_h.append(implicit_h)
+        self.coords.append(np.asarray(xyz, dtype=np.float64))
+        return len(self.names) - 1
+
+    def neighbours(self):
+        neighbours = [[] for name in self.names]
+        for i, j in self.bonds:
+            neighbours[i].append(j)
+            neighbours[j].append(i)
+        return neighbours
+
+
+def build_ligand(atoms):
+    """
+    Ligand graph of a peptide atom dict (pdb_arrays), hydrogens rebuilt from templates
+    """
+    residues = []
+    for i in range(len(atoms["coords"])):
+        key = (atoms["chain"][i], int(atoms["res_id"][i]), atoms["icode"][i])
+        if not residues or residues[-1][0] != key:
+            residues.append((key, atoms["res_name"][i].decode(), {}))
+        atom_name, element = atoms["atom_name"][i].decode(), atoms["element"][i].decode().upper()
+        if is_hydrogen(element, atom_name):
+            continue
+        residues[-1][2][atom_name] = i
+
+    ligand = Ligand()
+    previous_c = None
+    for (chain, res_id, icode), res_name, index in residues:
+        if res_name not in SIDE_CHAINS:
+            raise ValueError(f"No template for residue {res_name}{res_id}")
+        template = dict(BACKBONE, **SIDE_CHAINS[res_name])
+        local = {}
+        for atom_name, i in index.items():
+            if atom_name not in template:
+                raise ValueError(f"Unknown atom {atom_name} in {res_name}{res_id}")
+            element, hybridization, implicit_h = template[atom_name]
+            if res_name == "GLY" and atom_name == "CA":
+                implicit_h = 2
+            local[atom_name] = ligand.add_atom(atom_name, res_name, chain.decode(), res_id, icode.decode(),
+                                               element, hybridization, implicit_h, atoms["coords"][i])
+        for a, b in BACKBONE_BONDS + SIDE_CHAIN_BONDS[res_name]:
+            if a in local and b in local:
+                ligand.bonds.append((local[a], local[b]))
+
+        def add_h(h_name, parent, xyz):
+            h = ligand.add_atom(h_name, res_name, chain.decode(), res_id, icode.decode(), "H", 0, 0, xyz)
+            ligand.bonds.append((local[parent], h))
+
+        coords = {name: ligand.coords[i] for name, i in local.items()}
+        bonded = (previous_c is not None and "N" in local
+                  and np.linalg.norm(ligand.coords[previous_c] - coords["N"]) < PEPTIDE_BOND_MAX)
+        if bonded:
+            ligand.bonds.append((previous_c, local["N"]))
+            if res_name != "PRO" and "CA" in local:
+                add_h("H", "N", place_bisect(coords["N"], ligand.coords[previous_c], coords["CA"], H_BOND_LENGTH["N"]))
+        elif "N" in local:
+            # Chain start: amine N; reduce only protonates it (NH3+) on residue 1
+            ligand.hybridizations[local["N"]] = 3
+            if res_id == 1 and res_name != "PRO" and "CA" in local and "C" in local:
+                for k, torsion in enumerate((180.0, 60.0, -60.0)):
+                    add_h(f"H{k + 1}", "N", place_dihedral(coords["C"], coords["CA"], coords["N"],
+                                                          H_BOND_LENGTH["N"], 109.5, torsion))
+        for h_name, parent, rule in SIDE_CHAIN_HYDROGENS.get(res_name, []):
+            bond = H_BOND_LENGTH[template[parent][0]]
+            if rule[0] == "bisect" and all(name in coords for name in (parent, rule[1], rule[2])):
+                add_h(h_name, parent, place_bisect(coords[parent], coords[rule[1]], coords[rule[2]], bond))
+            elif rule[0] == "dihedral" and all(name in coords for name in (parent, rule[1], rule[2])):
+                for torsion in rule[4]:
+                    add_h(h_name, parent, place_dihedral(coords[rule[2]], coords[rule[1]], coords[parent],
+                                                         bond, rule[3], torsion))
+        previous_c = local.get("C")
+    if not ligand.names:
+        raise ValueError("No atoms")
+    return ligand
+
+
+def ring_bonds(ligand):
+    """
+    Bonds whose atoms stay connected when the bond is removed
+    """
+    neighbours = ligand.neighbours()
+    in_ring = set()
+    for i, j in ligand.bonds:
+        seen, todo = {i}, deque([i])
+        while todo:
+            k = todo.popleft()
+            for other in neighbours[k]:
+                if (k, other) in ((i, j), (j, i)) or other in seen:
+                    continue
+                seen.add(other)
+                todo.append(other)
+        if j in seen:
+            in_ring.add((i, j))
+    return in_ring
+
+
+def autodock_types(ligand, in_ring):
+    neighbours = ligand.neighbours()
+    ring_atoms = {atom for bond in in_ring for atom in bond}
+    types = []
+    for i, element in enumerate(ligand.elements):
+        if element == "H":
+            types.append("HD" if ligand.elements[neighbours[i][0]] in ("N", "O") else "H")
+        elif element == "C":
+            # Planar ring carbons are aromatic (Phe, Tyr, Trp, His); Pro ring is sp3
+            types.append("A" if i in ring_atoms and ligand.hybridizations[i] == 2 else "C")
+        elif element == "N":
+            has_h = any(ligand.elements[j] == "H" for j in neighbours[i])
+            amide = any(ligand.elements[j] == "C" and ligand.hybridizations[j] == 2
+                        and any(ligand.elements[k] == "O" for k in neighbours[j]) for j in neighbours[i])
+            types.append("N" if has_h or amide or len(neighbours[i]) >= 3 else "NA")
+        elif element == "O":
+            types.append("OA")
+        elif element == "S":
+            types.append("SA")
+        else:
+            types.append(element)
+    return types
+
+
+def gasteiger_charges(ligand):
+    """
+    Gasteiger-Marsili charges with implicit nonpolar hydrogens, whose charge
+    is then merged into their carbon
+    """
+    n_atoms = len(ligand.names)
+    keys = [(element, hybridization) for element, hybridization in zip(ligand.elements, ligand.hybridizations)]
+    bonds = list(ligand.bonds)
+    parents = []
+    for i, n_h in enumerate(ligand.implicit_h):
+        for _ in range(n_h):
+            bonds.append((i, len(keys)))
+            keys.append(("H", 0))
+            parents.append(i)
+    params = np.array([GASTEIGER[key] for key in keys])
+    chi_plus = params.sum(axis=1)
+    chi_plus[[key[0] == "H" for key in keys]] = HYDROGEN_CHI_PLUS
+    i, j = np.array(bonds).T
+    charges = np.zeros(len(keys))
+    damp = 0.5
+    for _ in range(GASTEIGER_ITERATIONS):
+        chi = params[:, 0] + params[:, 1] * charges + params[:, 2] * charges ** 2
+        # Electrons flow to the more electronegative atom, scaled by the donor's chi+
+        donor = np.where(chi[i] > chi[j], j, i)
+        transfer = damp * (chi[i] - chi[j]) / chi_plus[donor]
+        delta = np.zeros(len(keys))
+        np.add.at(delta, i, -transfer)
+        np.add.at(delta, j, transfer)
+        charges += delta
+        damp *= 0.5
+    merged = charges[:n_atoms].copy()
+    np.add.at(merged, np.array(parents, dtype=int), charges[n_atoms:])
+    return merged
+
+
+def torsion_tree(ligand, in_ring):
+    """
+    (root group, {group: [(atom in group, atom in child, child group)]}, groups,
+    n active torsions, TORSDOF). Groups are the rigid parts between rotatable bonds.
+    """
+    neighbours = ligand.neighbours()
+    elements = ligand.elements
+
+    def carbonyl(atom):
+        return elements[atom] == "C" and any(elements[k] == "O" and ligand.hybridizations[k] == 2
+                                             for k in neighbours[atom])
+
+    def rotatable(a, b):
+        if (a, b) in in_ring or (b, a) in in_ring:
+            return False
+        if len(neighbours[a]) < 2 or len(neighbours[b]) < 2:
+            return False
+        for x, y in ((a, b), (b, a)):
+            if elements[y] == "N" and carbonyl(x): # amide
+                return False
+            if elements[y] == "N" and elements[x] == "C" and sum(elements[k] == "N" for k in neighbours[x]) >= 3:
+                return False # guanidinium
+        return True
+
+    rotatable_bonds = [(a, b) for a, b in ligand.bonds if rotatable(a, b)]
+    group = list(range(len(elements)))
+
+    def find(x):
+        while group[x] != x:
+            group[x] = group[group[x]]
+            x = group[x]
+        return x
+    for a, b in ligand.bonds:
+        if (a, b) not in rotatable_bonds:
+            group[find(a)] = find(b)
+    groups = {}
+    for atom in range(len(elements)):
+        groups.setdefault(find(atom), []).append(atom)
+    links = {g: [] for g in groups}
+    for a, b in rotatable_bonds:
+        links[find(a)].append((a, b, find(b)))
+        links[find(b)].append((b, a, find(a)))
+
+    def subtree(g, parent):
+        return len(groups[g]) + sum(subtree(child, g) for a, b, child in links[g] if child != parent)
+
+    # Root: the group whose largest branch is smallest (as AutoDockTools picks it)
+    root = min(groups, key=lambda g: (max([subtree(child, g) for a, b, child in links[g]], default=0), g))
+    children = {}
+    hydrogen_only = 0
+
+    def descend(g, parent):
+        nonlocal hydrogen_only
+        children[g] = [(a, b, child) for a, b, child in links[g] if child != parent]
+        for a, b, child in children[g]:
+            moved = descend(child, g)
+            if all(elements[atom] == "H" for atom in moved if atom != b): # b sits on the axis
+                hydrogen_only += 1
+        return groups[g] + [atom for a, b, child in children[g] for atom in groups[child]]
+    descend(root, None)
+    n_torsions = len(rotatable_bonds)
+    return root, children, groups, n_torsions, n_torsions - hydrogen_only
+
+
+def pdbqt_lines(ligand):
+    in_ring = ring_bonds(ligand)
+    types = autodock_types(ligand, in_ring)
+    charges = gasteiger_charges(ligand)
+    root, children, groups, n_torsions, torsdof = torsion_tree(ligand, in_ring)
+    serials = {}
+    body = []
+
+    def write_group(g, first=None):
+        atoms = groups[g] if first is None else [first] + [atom for atom in groups[g] if atom != first]
+        for atom in atoms:
+            serials[atom] = len(serials) + 1
+            x, y, z = ligand.coords[atom]
+            line = format_atom_line(serials[atom], "ATOM", ligand.names[atom], ligand.res_names[atom],
+                                    ligand.chains[atom], ligand.res_ids[atom], ligand.icodes[atom],
+                                    x, y, z, ligand.elements[atom])
+            body.append(f"{line[:66]}    {charges[atom]:6.3f} {types[atom]:<2s}\n")
+        for a, b, child in children[g]:
+            body.append(("BRANCH", a, b))
+            write_group(child, b)
+            body.append(("ENDBRANCH", a, b))
+
+    body.append("ROOT\n")
+    root_atoms = len(groups[root])
+    write_group(root)
+    body.insert(root_atoms + 1, "ENDROOT\n")
+    lines = [f"REMARK  {n_torsions} active torsions:\n"]
+    lines += [line if isinstance(line, str) else f"{line[0]} {serials[line[1]]:3d} {serials[line[2]]:3d}\n"
+              for line in body]
+    return lines + [f"TORSDOF {torsdof}\n"]
+
+
+def write_ligand_pdbqt(pdb_file, pdbqt_file):
+    """
+    Native replacement of reduce + prepare_ligand for one peptide PDB
+    """
+    lines = pdbqt_lines(build_ligand(read_pdb_atoms(pdb_file)))
+    with open(pdbqt_file, "w") as f:
+        f.writelines(lines)
+    return pdbqt_file
+
+
+def default_method():
+    """
+    ADFR tools unless $FRANKPEPSTEIN_LIGAND_PREP=native: the native path
+    stays opt-in until `validate` has been run against ADFR output
+    """
+    method = os.environ.get(LIGAND_PREP_ENV, "adfr")
+    return method if method in METHODS else "adfr"
+
+
+def prepare_ligand(pdb_file, pdbqt_file, reduce_path, reduce_db_path, prepare_ligand_path, method=None, strip_end=False):
+    """
+    PDBQT of a peptide ligand: reduce + prepare_ligand (method='adfr', the
+    default), or native templates when asked for, falling back to the ADFR
+    tools when the peptide is not supported. strip_end drops the lines with
+    END from the reduce output first (sed -i '/END/d', as FrankVINA 2 did).
+    Returns the method used.
+    """
+    if (method or default_method()) == "native":
+        try:
+            write_ligand_pdbqt(pdb_file, pdbqt_file)
+            return "native"
+        except (ValueError, IndexError, OSError) as e:
+            print(f"DEBUG: Native ligand preparation of {pdb_file} failed ({e}), using ADFR tools")
+    folder = os.path.dirname(os.path.abspath(pdb_file))
+    name = os.path.basename(pdb_file)
+    reduced = subprocess.run([reduce_path, "-Quiet", "-DB", reduce_db_path, name], cwd=folder,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+    lines = reduced.splitlines(keepends=True)
+    with open(os.path.join(folder, f"H_{name}"), "w") as out:
+        out.writelines(line for line in lines if not (strip_end and "END" in line))
+    subprocess.run([prepare_ligand_path, "-l", f"H_{name}", "-o", os.path.abspath(pdbqt_file)], cwd=folder,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.remove(os.path.join(folder, f"H_{name}"))
+    return "adfr"
+
+
+def read_pdbqt(pdbqt_file):
+    """
+    Atoms {(res_id, atom name): (type, charge)}, active torsions and TORSDOF of a PDBQT
+    """
+    atoms, n_torsions, torsdof = {}, 0, None
+    with open(pdbqt_file) as f:
+        for line in f:
+            if line.startswith(("ATOM", "HETATM")):
+                atoms[(int(line[22:26]), line[12:16].strip())] = (line[77:79].strip(), float(line[70:76]))
+            elif line.startswith("BRANCH"):
+                n_torsions += 1
+            elif line.startswith("TORSDOF"):
+                torsdof = int(line.split()[1])
+    return atoms, n_torsions, torsdof
+
+
+def compare_pdbqt(native_file, reference_file):
+    """
+    Agreement of a native PDBQT with a reference (ADFR) PDBQT of the same peptide
+    """
+    native, native_torsions, native_torsdof = read_pdbqt(native_file)
+    reference, reference_torsions, reference_torsdof = read_pdbqt(reference_file)
+    heavy = [key for key, (ad_type, charge) in reference.items() if not ad_type.startswith("H")]
+    shared = [key for key in heavy if key in native]
+    return {
+        "heavy_atoms": len(heavy),
+        "missing_heavy_atoms": len(heavy) - len(shared),
+        "type_mismatches": [f"{res_id}:{name} {native[(res_id, name)][0]}!={reference[(res_id, name)][0]}"
+                            for res_id, name in shared if native[(res_id, name)][0] != reference[(res_id, name)][0]],
+        "polar_h": (sum(ad_type == "HD" for ad_type, charge in native.values()),
+                    sum(ad_type == "HD" for ad_type, charge in reference.values())),
+        "torsions": (native_torsions, reference_torsions),
+        "torsdof": (native_torsdof, reference_torsdof),
+        "charge_mae": float(np.mean([abs(native[key][1] - reference[key][1]) for key in shared])) if shared else None,
+    }
+
+
+def validate(pdb_files, reference_dir, initial_path, report_file):
+    """
+    Compares native PDBQTs with ADFR ones (from reference_dir, or computed with
+    the ADFR tools under initial_path) and writes a TSV report
+    """
+    adfr_bin = os.path.join(initial_path, "utilities/ADFRsuite_x86_64Linux_1.0/bin") if initial_path else None
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="ligand_prep_") as tmp:
+        for pdb_file in pdb_files:
+            base = os.path.basename(pdb_file).replace(".pdb", "")
+            native_file = os.path.join(tmp, f"{base}.native.pdbqt")
+            try:
+                write_ligand_pdbqt(pdb_file, native_file)
+            except ValueError as e:
+                print(f"{base}: not supported ({e})")
+                continue
+            if reference_dir:
+                reference_file = os.path.join(reference_dir, f"{base}.pdbqt")
+            else:
+                reference_file = os.path.join(tmp, f"{base}.pdbqt")
+                os.symlink(os.path.abspath(pdb_file), os.path.join(tmp, f"{base}.pdb"))
+                prepare_ligand(os.path.join(tmp, f"{base}.pdb"), reference_file, os.path.join(adfr_bin, "reduce"),
+                               f"{initial_path}/DB/reduce_wwPDB_het_dict.txt",
+                               os.path.join(adfr_bin, "prepare_ligand"), method="adfr")
+            if not os.path.exists(reference_file):
+                print(f"{base}: no reference PDBQT")
+                continue
+            rows.append((base, compare_pdbqt(native_file, reference_file)))
+
+    with open(report_file, "w") as f:
+        f.write("ligand\theavy_atoms\tmissing\ttype_mismatches\tpolar_h\ttorsions\ttorsdof\tcharge_mae\tmismatched\n")
+        for base, row in rows:
+            f.write(f"{base}\t{row['heavy_atoms']}\t{row['missing_heavy_atoms']}\t{len(row['type_mismatches'])}\t"
+                    f"{row['polar_h'][0]}/{row['polar_h'][1]}\t{row['torsions'][0]}/{row['torsions'][1]}\t"
+                    f"{row['torsdof'][0]}/{row['torsdof'][1]}\t{row['charge_mae']}\t"
+                    f"{','.join(row['type_mismatches'])}\n")
+    if not rows:
+        print("No ligand compared")
+        return
+    n_atoms = sum(row["heavy_atoms"] for base, row in rows)
+    type_agreement = 1 - sum(len(row["type_mismatches"]) for base, row in rows) / max(n_atoms, 1)
+    same_torsdof = np.mean([row["torsdof"][0] == row["torsdof"][1] for base, row in rows])
+    same_h = np.mean([row["polar_h"][0] == row["polar_h"][1] for base, row in rows])
+    charge_mae = np.mean([row["charge_mae"] for base, row in rows if row["charge_mae"] is not None])
+    print(f"{len(rows)} ligands: heavy atom type agreement {type_agreement:.3f}, same TORSDOF {same_torsdof:.2f}, "
+          f"same polar H count {same_h:.2f}, charge MAE {charge_mae:.3f} (native / ADFR per ligand in {report_file})")
+
+
+def main():
+    program_description = "AutoDock PDBQT of peptide ligands from residue templates (no reduce/prepare_ligand)"
+    parser = argparse.ArgumentParser(description=program_description)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert = subparsers.add_parser("convert", help="write the PDBQT of a peptide PDB")
+    convert.add_argument("-l", "--ligand", type=str, required=True, help="peptide PDB")
+    convert.add_argument("-o", "--output", type=str, default=None, help="PDBQT (default: <ligand>.pdbqt)")
+    check = subparsers.add_parser("validate", help="compare with reduce + prepare_ligand (ADFR) output")
+    check.add_argument("-l", "--ligands", type=str, nargs="+", required=True, help="peptide PDB files")
+    check.add_argument("-r", "--reference_dir", type=str, default=None,
+                       help="folder with ADFR PDBQTs named like the ligands (default: run the ADFR tools)")
+    check.add_argument("-i", "--initial_path", type=str, default=None,
+                       help="main directory holding utilities/ADFRsuite (needed without --reference_dir)")
+    check.add_argument("-o", "--report", type=str, default="ligand_prep_validation.tsv", help="TSV report")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        try:
+            output = write_ligand_pdbqt(args.ligand, args.output or args.ligand.replace(".pdb", ".pdbqt"))
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Wrote {output}")
+    else:
+        if args.reference_dir is None and args.initial_path is None:
+            parser.error("validate needs --reference_dir or --initial_path")
+        validate(args.ligands, args.reference_dir, args.initial_path, args.report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import shutil
+import fnmatch
+import hashlib
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+from pdb_arrays import ATOM_FIELDS, read_pdb_atoms, take_atoms, write_pdb
+from aligner import PocketCoords
+
+# Packed minipocket DB: one directory of .npy columns opened with mmap_mode="r",
+# so every superposer worker maps the same pages instead of reading small files.
+STORE_FORMAT = "frankpepstein-minipockets"
+STORE_VERSION = 1
+STORE_SUFFIX = ".store"
+META_FILE = "meta.json"
+# Per-pocket metadata encoded in minipocket_{pdb}_{receptor chain}_{peptide chain}_{patch}.pdb
+POCKET_FIELDS = ["names", "folders", "peptide_chains", "patches"]
+
+# One mapping per worker process, see open_store()
+_stores = {}
+
+
+def parse_minipocket_name(file):
+    """
+    Splits a minipocket filename into (name, DB folder, peptide chain, patch residues)
+    """
+    name = file.replace(".pdb", "")
+    folder = "_".join(file.split("_")[1:4])
+    peptide_chain = folder.split("_")[-1]
+    patch = name.split("_")[-1]
+    return name, folder, peptide_chain, patch
+
+
+def default_store_path(folder_minipockets):
+    return folder_minipockets.rstrip("/") + STORE_SUFFIX
+
+
+def is_store(path):
+    return os.path.exists(os.path.join(path, META_FILE))
+
+
+def folder_fingerprint(folder, pattern="minipocket_*.pdb", member=None):
+    """
+    Entry count, newest mtime and listing hash of the entries of folder matching
+    pattern (for DB entry folders, of their member file). Stored in the meta of
+    packed stores and indexes to notice a DB updated after they were built.
+    """
+    names, newest = [], 0.0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not fnmatch.fnmatch(entry.name, pattern):
+                continue
+            path = entry.path if member is None else os.path.join(entry.path, member)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            names.append(entry.name)
+            newest = max(newest, mtime)
+    names.sort()
+    return {"n_files": len(names), "newest_mtime": newest,
+            "listing_sha1": hashlib.sha1("\n".join(names).encode()).hexdigest()}
+
+
+def stale_reason(meta, folder, pattern="minipocket_*.pdb", member=None):
+    """
+    Why a store or index built from folder no longer matches it, None when it
+    does (or when folder is not there to compare with)
+    """
+    if not os.path.isdir(folder):
+        return None
+    recorded = meta.get("fingerprint")
+    if recorded is None:
+        return "built without a source fingerprint"
+    current = folder_fingerprint(folder, pattern, member)
+    changed = [key for key, value in current.items() if recorded.get(key) != value]
+    if changed:
+        return f"{', '.join(changed)} of {folder} changed since it was built"
+    return None
+
+
+def fresh_store(store_path, folder_minipockets):
+    """
+    store_path when it holds a store matching folder_minipockets, else None
+    (read the folder): a store left behind by a DB update is not used
+    """
+    if not is_store(store_path):
+        return None
+    reason = stale_reason(open_store(store_path).meta, folder_minipockets)
+    if reason is not None:
+        print(f"DEBUG: Ignoring minipocket store {store_path} ({reason}), reading {folder_minipockets}. "
+              f"Rebuild it with minipocket_db.py")
+        return None
+    return store_path
+
+
+def build_store(folder_minipockets, store_path=None):
+    """
+    Packs every minipocket_*.pdb of folder_minipockets into a store directory
+    """
+    store_path = store_path or default_store_path(folder_minipockets)
+    fingerprint = folder_fingerprint(folder_minipockets)
+    files = sorted(fnmatch.filter(os.listdir(folder_minipockets), "minipocket_*.pdb"))
+
+    columns = {field: [] for field in list(ATOM_FIELDS) + ["coords"]}
+    pockets = {field: [] for field in POCKET_FIELDS}
+    offsets = [0]
+    for file in tqdm(files, total=len(files), desc="packing minipockets"):
+        atoms = read_pdb_atoms(os.path.join(folder_minipockets, file))
+        for field in columns:
+            columns[field].append(atoms[field])
+        offsets.append(offsets[-1] + len(atoms["coords"]))
+        for field, value in zip(POCKET_FIELDS, parse_minipocket_name(file)):
+            pockets[field].append(value)
+
+    tmp_path = store_path + ".tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    for field, chunks in columns.items():
+        dtype = np.float32 if field == "coords" else ATOM_FIELDS[field]
+        empty = np.zeros((0, 3) if field == "coords" else 0, dtype=dtype)
+        np.save(os.path.join(tmp_path, f"{field}.npy"),
+                np.concatenate(chunks) if chunks else empty)
+    np.save(os.path.join(tmp_path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    for field, values in pockets.items():
+        np.save(os.path.join(tmp_path, f"{field}.npy"), np.array(values, dtype=bytes))
+    with open(os.path.join(tmp_path, META_FILE), "w") as f:
+        json.dump({"format": STORE_FORMAT, "version": STORE_VERSION,
+                   "source": os.path.abspath(folder_minipockets), "fingerprint": fingerprint,
+                   "n_pockets": len(files), "n_atoms": offsets[-1]}, f, indent=4)
+
+    # Swap in atomically so readers never see a half-written store
+    if os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    os.rename(tmp_path, store_path)
+    return store_path
+
+
+class MinipocketStore:
+    """
+    Read-only, memory-mapped view of a packed minipocket DB
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        with open(os.path.join(store_path, META_FILE)) as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != STORE_FORMAT or self.meta.get("version") != STORE_VERSION:
+            raise ValueError(f"{store_path} is not a v{STORE_VERSION} minipocket store")
+        self.columns = {field: self._load(field) for field in list(ATOM_FIELDS) + ["coords"]}
+        self.offsets = self._load("offsets")
+        self.pockets = {field: self._load(field) for field in POCKET_FIELDS}
+        self._index = None
+
+    def __reduce__(self):
+        # Workers re-map the files instead of receiving pickled arrays
+        return (MinipocketStore, (self.store_path,))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _load(self, field):
+        return np.load(os.path.join(self.store_path, f"{field}.npy"), mmap_mode="r")
+
+    @property
+    def files(self):
+        return [f"{name}.pdb" for name in self.pockets["names"].astype(str)]
+
+    def index_of(self, file):
+        if self._index is None:
+            self._index = {name: i for i, name in enumerate(self.pockets["names"].astype(str))}
+        return self._index[file.replace(".pdb", "")]
+
+    def atoms(self, file):
+        i = self.index_of(file)
+        return take_atoms(self.columns, slice(self.offsets[i], self.offsets[i + 1]))
+
+    def pocket_coords(self, file):
+        atoms = self.atoms(file)
+        ca = atoms["coords"][atoms["atom_name"] == b"CA"].astype(np.float64)
+        return PocketCoords(file.replace(".pdb", ""), ca, None)
+
+    def write_pdb(self, file, pdb_file):
+        """
+        Materializes one minipocket as a PDB file (for file-based aligners)
+        """
+        write_pdb(self.atoms(file), pdb_file)
+        return pdb_file
+
+
+def open_store(store_path):
+    """
+    Per-process store: joblib workers map the files once and reuse them across tasks
+    """
+    if store_path not in _stores:
+        _stores[store_path] = MinipocketStore(store_path)
+    return _stores[store_path]
+
+
+def main():
+    program_description = "Pack a minipocket folder into a memory-mapped store for superposer.py"
+    parser = argparse.ArgumentParser(description=program_description)
+    parser.add_argument("-fm", "--folder_minipockets", type=str, required=True,
+                        help="folder containing minipocket_*.pdb files")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help=f"store directory (default: <folder_minipockets>{STORE_SUFFIX})")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder_minipockets):
+        print(f"Error: {args.folder_minipockets} not found.")
+        sys.exit(1)
+    store_path = build_store(args.folder_minipockets, args.output)
+    store = MinipocketStore(store_path)
+    print(f"Packed {len(store)} minipockets ({store.meta['n_atoms']} atoms) into {store_path}")
+
+
+if __name__ == "__main__":
+    main()
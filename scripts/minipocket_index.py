@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import shutil
+import fnmatch
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+from pdb_arrays import read_pdb_atoms
+from minipocket_db import default_store_path, folder_fingerprint, fresh_store, is_store, open_store, stale_reason
+
+# Coarse descriptors used to rank minipockets before full alignment.
+# Per CA atom: histogram of distances to the other CA atoms of its pocket.
+# Per pocket: standard residue composition.
+# A minipocket that aligns with 100% overlap has, for each of its CA atoms, a
+# target CA whose histogram contains it (up to one bin of tolerance).
+INDEX_FORMAT = "frankpepstein-minipocket-index"
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index"
+META_FILE = "meta.json"
+DISTANCE_BINS = np.arange(0.0, 22.0, 2.0)
+N_BINS = len(DISTANCE_BINS) - 1
+RESIDUES = ['ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'ILE',
+            'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP', 'TYR', 'VAL']
+CHUNK_ATOMS = 8192
+
+
+def default_index_path(folder_minipockets):
+    return folder_minipockets.rstrip("/") + INDEX_SUFFIX
+
+
+def ca_histograms(ca):
+    """
+    (n_ca, N_BINS) counts of CA-CA distances per CA atom
+    """
+    ca = np.asarray(ca, dtype=np.float64)
+    n = len(ca)
+    dist = np.sqrt(((ca[:, None, :] - ca[None, :, :]) ** 2).sum(axis=-1))
+    bins = np.digitize(dist, DISTANCE_BINS) - 1
+    valid = (bins >= 0) & (bins < N_BINS) & ~np.eye(n, dtype=bool)
+    rows = np.broadcast_to(np.arange(n)[:, None], (n, n))
+    return np.bincount(rows[valid] * N_BINS + bins[valid], minlength=n * N_BINS).reshape(n, N_BINS).astype(np.float32)
+
+
+def composition(res_names):
+    """
+    Residue type counts of a pocket (non-standard residues ignored)
+    """
+    res_names = np.asarray(res_names).astype(str)
+    return np.array([(res_names == res).sum() for res in RESIDUES], dtype=np.float32)
+
+
+def pocket_descriptor(atoms):
+    ca = atoms["atom_name"] == b"CA"
+    return ca_histograms(atoms["coords"][ca]), composition(atoms["res_name"][ca])
+
+
+def build_index(folder_minipockets, index_path=None, store_path=None):
+    """
+    Computes descriptors for every minipocket (from the packed store if present)
+    """
+    index_path = index_path or default_index_path(folder_minipockets)
+    store_path = store_path or default_store_path(folder_minipockets)
+    if os.path.isdir(folder_minipockets):
+        fingerprint = folder_fingerprint(folder_minipockets)
+        store_path = fresh_store(store_path, folder_minipockets)
+    else: # Store only: the index inherits its fingerprint
+        fingerprint = open_store(store_path).meta.get("fingerprint")
+    if store_path is not None:
+        store = open_store(store_path)
+        files = store.files
+        load_atoms = store.atoms
+    else:
+        files = sorted(fnmatch.filter(os.listdir(folder_minipockets), "minipocket_*.pdb"))
+        load_atoms = lambda file: read_pdb_atoms(os.path.join(folder_minipockets, file))
+
+    histograms, compositions, offsets = [], [], [0]
+    for file in tqdm(files, total=len(files), desc="indexing minipockets"):
+        histogram, counts = pocket_descriptor(load_atoms(file))
+        histograms.append(histogram)
+        compositions.append(counts)
+        offsets.append(offsets[-1] + len(histogram))
+
+    tmp_path = index_path + ".tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    np.save(os.path.join(tmp_path, "histograms.npy"),
+            np.concatenate(histograms) if histograms else np.zeros((0, N_BINS), dtype=np.float32))
+    np.save(os.path.join(tmp_path, "compositions.npy"),
+            np.array(compositions, dtype=np.float32).reshape(-1, len(RESIDUES)))
+    np.save(os.path.join(tmp_path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(tmp_path, "names.npy"), np.array([f.replace(".pdb", "") for f in files], dtype=bytes))
+    with open(os.path.join(tmp_path, META_FILE), "w") as f:
+        json.dump({"format": INDEX_FORMAT, "version": INDEX_VERSION,
+                   "source": os.path.abspath(folder_minipockets), "fingerprint": fingerprint,
+                   "distance_bins": DISTANCE_BINS.tolist(), "n_pockets": len(files)}, f, indent=4)
+    if os.path.exists(index_path):
+        shutil.rmtree(index_path)
+    os.rename(tmp_path, index_path)
+    return index_path
+
+
+class MinipocketIndex:
+    """
+    Memory-mapped descriptor index, scored against one target pocket at a time
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(os.path.join(index_path, META_FILE)) as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != INDEX_FORMAT or self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"{index_path} is not a v{INDEX_VERSION} minipocket index")
+        load = lambda field: np.load(os.path.join(index_path, f"{field}.npy"), mmap_mode="r")
+        self.histograms = load("histograms")
+        self.compositions = load("compositions")
+        self.offsets = load("offsets")
+        self.names = load("names")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def files(self):
+        return [f"{name}.pdb" for name in self.names.astype(str)]
+
+    def scores(self, target_atoms, composition_weight=0.25):
+        """
+        Prescreen score per minipocket (0 = descriptors fully contained in the target, lower is better)
+        """
+        target_histograms, target_composition = pocket_descriptor(target_atoms)
+        # One bin of distance tolerance on the target side
+        padded = np.pad(target_histograms, ((0, 0), (1, 1)))
+        target_tolerant = padded[:, :-2] + padded[:, 1:-1] + padded[:, 2:]
+
+        atom_excess = np.empty(len(self.histograms), dtype=np.float32)
+        for start in tqdm(range(0, len(self.histograms), CHUNK_ATOMS), desc="prescreening minipockets"):
+            block = np.asarray(self.histograms[start:start + CHUNK_ATOMS])
+            excess = np.maximum(block[:, None, :] - target_tolerant[None, :, :], 0).sum(axis=-1)
+            atom_excess[start:start + CHUNK_ATOMS] = excess.min(axis=1) / np.maximum(block.sum(axis=1), 1)
+
+        offsets = np.asarray(self.offsets)
+        sizes = np.diff(offsets)
+        geometric = np.zeros(len(self), dtype=np.float32)
+        nonempty = sizes > 0
+        geometric[nonempty] = np.add.reduceat(atom_excess, offsets[:-1][nonempty]) / sizes[nonempty]
+        geometric[~nonempty] = 1.0
+
+        compositions = np.asarray(self.compositions)
+        composition_excess = (np.maximum(compositions - target_composition[None, :], 0).sum(axis=1)
+                              / np.maximum(compositions.sum(axis=1), 1))
+        return geometric + composition_weight * composition_excess
+
+    def select(self, target_atoms, fraction, composition_weight=0.25):
+        """
+        Files of the best-scoring fraction of the DB (at least one entry)
+        """
+        scores = self.scores(target_atoms, composition_weight)
+        n_selected = max(1, int(np.ceil(fraction * len(scores))))
+        order = np.argsort(scores, kind="stable")[:n_selected]
+        files = self.files
+        return [files[i] for i in order]
+
+
+def open_index(index_path, folder_minipockets):
+    """
+    Prescreen index of folder_minipockets, None when it is missing or was built
+    before the DB last changed (the scan then covers the whole DB)
+    """
+    if not os.path.exists(index_path):
+        print(f"DEBUG: Prescreen index {index_path} not found, scanning the whole DB")
+        return None
+    index = MinipocketIndex(index_path)
+    reason = stale_reason(index.meta, folder_minipockets)
+    if reason is not None:
+        print(f"DEBUG: Ignoring prescreen index {index_path} ({reason}), scanning the whole DB. "
+              f"Rebuild it with minipocket_index.py")
+        return None
+    return index
+
+
+def recall_report(selected_files, outcomes, fraction):
+    """
+    Recall of a prescreen against an exhaustive scan.
+    outcomes maps minipocket file -> run_click status for every DB entry.
+    """
+    aligned = {"missing_complex", "missing_residues", "rejected_filter", "accepted"}
+    selected = set(selected_files)
+    hits = [file for file, status in outcomes.items() if status in aligned]
+    accepted = [file for file, status in outcomes.items() if status == "accepted"]
+    return {
+        "prescreen_fraction": fraction,
+        "n_minipockets": len(outcomes),
+        "n_selected": len(selected),
+        "n_alignment_hits": len(hits),
+        "n_alignment_hits_selected": len([file for file in hits if file in selected]),
+        "alignment_hit_recall": len([file for file in hits if file in selected]) / len(hits) if hits else 1.0,
+        "n_accepted": len(accepted),
+        "accepted_recall": len([file for file in accepted if file in selected]) / len(accepted) if accepted else 1.0,
+    }
+
+
+def main():
+    program_description = "Build the minipocket prescreening index read by superposer.py"
+    parser = argparse.ArgumentParser(description=program_description)
+    parser.add_argument("-fm", "--folder_minipockets", type=str, required=True,
+                        help="folder containing minipocket_*.pdb files")
+    parser.add_argument("-ms", "--minipocket_store", type=str, default=None,
+                        help="packed minipocket store (default: <folder_minipockets>.store if present)")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help=f"index directory (default: <folder_minipockets>{INDEX_SUFFIX})")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder_minipockets) and not is_store(args.minipocket_store or ""):
+        print(f"Error: {args.folder_minipockets} not found.")
+        sys.exit(1)
+    index_path = build_index(args.folder_minipockets, args.output, args.minipocket_store)
+    print(f"Indexed {len(MinipocketIndex(index_path))} minipockets into {index_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ import itertools
 from Bio.PDB.StructureBuilder import *
 import copy
 import numpy as np
+from numpy.lib.recfunctions import repack_fields
 warnings.simplefilter('ignore')
 import argparse
 from joblib import Parallel, delayed
@@ -25,6 +26,10 @@ import math
 from operator import itemgetter
 from sklearn.linear_model import LinearRegression
 import random
+from geometry_filters import pairwise_distances
+from pdb_arrays import take_atoms
+from patch_dedup import residue_starts
+from patches import FRAGMENTS_FILE, load_patches, read_fragment_records, write_fragment_records, write_fragment_pdb
 
 # Configuration Variables
 # MAX_COMBINATIONS moved to argparse
@@ -81,6 +86,33 @@ def save_pdb(peptide_ordered):
     return peptide_file
 
 
+def atoms_to_structure(name, atoms):
+    """
+    Bio.PDB structure of a patch from its atom arrays (patches.load_patches),
+    equivalent to parsing the patch file
+    """
+    builder = StructureBuilder()
+    builder.init_structure(name)
+    builder.init_model(0)
+    builder.init_seg(" ")
+    text = {field: atoms[field].astype(str) for field in ("record", "atom_name", "res_name", "chain", "icode", "element")}
+    current_chain, current_residue = None, None
+    for i, coord in enumerate(np.asarray(atoms["coords"], dtype=np.float32)):
+        if text["chain"][i] != current_chain:
+            current_chain = text["chain"][i]
+            builder.init_chain(current_chain)
+            current_residue = None
+        residue_key = (int(atoms["res_id"][i]), text["icode"][i] or " ", text["res_name"][i])
+        if residue_key != current_residue:
+            current_residue = residue_key
+            field = "H_" + text["res_name"][i] if text["record"][i] == "HETATM" else " "
+            builder.init_residue(text["res_name"][i], field, residue_key[0], residue_key[1])
+        atom_name, element = text["atom_name"][i], text["element"][i]
+        fullname = f" {atom_name:<3s}" if len(atom_name) < 4 and len(element) == 1 else f"{atom_name:<4s}"
+        builder.init_atom(atom_name, coord, 0.0, 1.0, " ", fullname, element=element)
+    return builder.get_structure()
+
+
 def pdb_parser(peptide_file):
     pdb_file_no_extension = peptide_file.replace(".pdb", "")
     cmd_remove_END = (
@@ -231,242 +263,206 @@ def find_outliers_linear_trend(coordinates_list, threshold_multiplier=OUTLIER_TH
     return outliers
 
 
-def delete_outsider_frag():
+def delete_outsider_frag(patches):
     coordinates_3d = []
-    for file in tqdm(os.listdir("."), total=len(os.listdir(".")), desc="loading structures", position=0, leave=True):
-        warnings.simplefilter('ignore')
-        if fnmatch.fnmatch(file, 'patch_file_*.pdb'):
-            name_file = file.replace(".pdb", "")
-            parser = PDBParser()
-            structure = parser.get_structure(name_file, file)
-            for model in structure:
-                for chain in model:
-                    ca_list = []
-                    for residue in chain:
-                        ca_coord = residue["CA"].coord
-                        ca_list.append(ca_coord)
-                    array = list(np.average(np.array(ca_list), axis=0))
-                    coords_array_name = (array, file)
-                    coordinates_3d.append(coords_array_name)
+    for file, atoms in tqdm(patches, total=len(patches), desc="loading structures", position=0, leave=True):
+        ca_list = atoms["coords"][atoms["atom_name"] == b"CA"]
+        array = list(np.average(np.array(ca_list), axis=0))
+        coords_array_name = (array, file)
+        coordinates_3d.append(coords_array_name)
     return coordinates_3d
 
-if len([x for x in os.listdir(".") if "patch_file" in x]) > 2:
-    coordinates_3d = delete_outsider_frag()
+# Patch files and lazy patch records (superposer.py --lazy), loaded once
+patches = load_patches(".")
+if len(patches) > 2:
+    coordinates_3d = delete_outsider_frag(patches)
     outliers_3d = find_outliers_linear_trend(coordinates_3d)
     if len(outliers_3d) > 0:
         if not os.path.exists("outlier_folder"):
             os.makedirs("outlier_folder")
+        lazy_records = read_fragment_records(FRAGMENTS_FILE)
+        outlier_files = set()
         for outlier in outliers_3d:
             file = outlier[1]
+            outlier_files.add(file)
             # print(f"mv {file} outlier_folder")
-            os.system(f"mv {file} outlier_folder")
+            if os.path.exists(file):
+                os.system(f"mv {file} outlier_folder")
+        if any(file in lazy_records for file in outlier_files):
+            write_fragment_records(os.path.join("outlier_folder", FRAGMENTS_FILE),
+                                   [record for file, record in lazy_records.items() if file in outlier_files])
+            write_fragment_records(FRAGMENTS_FILE,
+                                   [record for file, record in lazy_records.items() if file not in outlier_files])
+        patches = [(file, atoms) for file, atoms in patches if file not in outlier_files]
+
+# Columnar residue table of the patches: one row per residue occurrence, the
+# atoms of every patch concatenated once (rows point at [start, stop) of
+# them). Residues are identified by an integer uid (same name, number and N/CA/C
+# coordinates: the same residue seen by overlapping patches), so clustering,
+# combination dedup and ordering work on array indices. Bio.PDB residues are
+# only built for the final peptides.
+RESIDUE_DTYPE = np.dtype([("res_name", "S3"), ("res_id", np.int32), ("icode", "S1"), ("patch", np.int32),
+                          ("backbone", np.float32, (3, 3)), ("start", np.int64), ("stop", np.int64)])
+
+
+class ResidueTable:
+    """
+    Residues of (name, atoms) patches; rows without a full N/CA/C backbone are dropped
+    """
+
+    def __init__(self, patches):
+        rows, atom_blocks, offset = [], [], 0
+        for patch_index, (file, atoms) in enumerate(patches):
+            if not fnmatch.fnmatch(file, 'patch_file_*.pdb') or len(atoms["res_id"]) == 0:
+                continue
+            starts = np.flatnonzero(residue_starts(atoms))
+            stops = np.append(starts[1:], len(atoms["res_id"]))
+            residue_index = np.repeat(np.arange(len(starts)), stops - starts)
+            backbone = np.full((len(starts), 3, 3), np.nan, dtype=np.float32)
+            for k, atom_name in enumerate((b"N", b"CA", b"C")):
+                mask = atoms["atom_name"] == atom_name
+                backbone[residue_index[mask], k] = atoms["coords"][mask]
+            block = np.zeros(len(starts), dtype=RESIDUE_DTYPE)
+            block["res_name"], block["res_id"] = atoms["res_name"][starts], atoms["res_id"][starts]
+            block["icode"], block["patch"], block["backbone"] = atoms["icode"][starts], patch_index, backbone
+            block["start"], block["stop"] = starts + offset, stops + offset
+            rows.append(block[~np.isnan(backbone).any(axis=(1, 2))])
+            atom_blocks.append(atoms)
+            offset += len(atoms["res_id"])
+        self.rows = np.concatenate(rows) if rows else np.zeros(0, dtype=RESIDUE_DTYPE)
+        self.atoms = {field: np.concatenate([atoms[field] for atoms in atom_blocks]) for field in atom_blocks[0]} if atom_blocks else {}
+        # uid in order of first occurrence; first_row[uid] is the row kept for it
+        # Packed copy of the identity fields: a multi-field view keeps the
+        # record layout, so patch/start/stop bytes would leak into the key
+        key = repack_fields(self.rows[["res_name", "res_id", "backbone"]]).view(np.void)
+        unique_keys, first_row, inverse = np.unique(key, return_index=True, return_inverse=True)
+        order = np.argsort(first_row, kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        self.uid = rank[inverse.ravel()]
+        self.first_row = first_row[order]
+        residues = self.rows[self.first_row]
+        self.res_name = residues["res_name"]
+        self.res_id = residues["res_id"]
+        self.icode = residues["icode"]
+        self.backbone = residues["backbone"].astype(np.float64)
+        self.centroid = self.backbone.mean(axis=1)
+        self._residues = {}
+        print(f"DEBUG: {len(self.rows)} patch residues -> {len(self.first_row)} unique residues")
+
+    def __len__(self):
+        return len(self.first_row)
+
+    def residue(self, uid):
+        """
+        Bio.PDB residue of a uid (built once)
+        """
+        if uid not in self._residues:
+            row = self.rows[self.first_row[uid]]
+            atoms = take_atoms(self.atoms, slice(row["start"], row["stop"]))
+            self._residues[uid] = next(atoms_to_structure(f"res{uid}", atoms).get_residues())
+        return self._residues[uid]
+
+
+def cluster_representatives(table, uids, threshold):
+    """
+    [[uid, ...], ...] complete-linkage clusters (backbone centroids within
+    threshold) of uids, each sorted by residue number, clusters by label
+    """
+    uids = np.asarray(uids)
+    if len(uids) == 1:
+        labels = np.ones(1, dtype=int)
+    else:
+        labels = fcluster(complete(pdist(table.centroid[uids], metric='euclidean')), threshold, criterion='distance')
+    order = np.lexsort((table.icode[uids], table.res_id[uids], labels))
+    labels, uids = labels[order], uids[order]
+    bounds = np.flatnonzero(np.diff(labels)) + 1
+    return [group.tolist() for group in np.split(uids, bounds)]
+
+
+def order_peptide(table, peptide):
+    """
+    Residue uids of a peptide in chain order, None when it is too short to order.
+    Starts at the residue farthest from the rest and walks to the nearest CA;
+    the N-C bond of the first step decides the direction.
+    """
+    peptide = np.asarray(peptide)
+    if len(peptide) < 3:
+        return None
+    dist_max = pairwise_distances(table.centroid[peptide]).max(axis=1)
+    sorted_peptide = peptide[np.argsort(dist_max, kind="stable")]
+    start_res, end_res = sorted_peptide[-1], sorted_peptide[-2]
+    mid_residues = list(sorted_peptide[:-2])
+    ca, n, c = table.backbone[:, 1], table.backbone[:, 0], table.backbone[:, 2]
+
+    def nearest(res):
+        return mid_residues.pop(int(np.argmin(np.linalg.norm(ca[mid_residues] - ca[res], axis=1))))
+
+    next_res = nearest(start_res)
+    peptide_ordered = [start_res, next_res]
+    forward = np.linalg.norm(n[next_res] - c[start_res]) < np.linalg.norm(n[start_res] - c[next_res])
+    for i in range(1, len(mid_residues)): # Leaves the last mid residue out, as the string-keyed version did
+        peptide_ordered.append(nearest(peptide_ordered[-1]))
+    peptide_ordered.append(end_res)
+    return [int(uid) for uid in (peptide_ordered if forward else peptide_ordered[::-1])]
+
 
 def combinator():
-    res_dict = {}
-    res_dict_pull = {}
     final_peptides_list = [] #ACA LISTA FINAL DE PEPTIDOS ORDENADOS
-    if len([x for x in os.listdir(".") if "patch_file" in x]) == 0:
+    if len(patches) == 0:
         print("No patches files in folder")
-    if len([x for x in os.listdir(".") if "patch_file" in x]) <= 1 and len([x for x in os.listdir(".") if "patch_file" in x]) > 0:
-        cmd_cp = (f"cp patch_file* {folder_output}")
-        os.system(cmd_cp)
-    if len([x for x in os.listdir(".") if "patch_file" in x]) > 1:
-        for file in tqdm(os.listdir("."), total=len(os.listdir(".")), desc="loading structures", position=0, leave=True):
-            try:
-                warnings.simplefilter('ignore')
-                if fnmatch.fnmatch(file, 'patch_file_*.pdb'):
-                    name_file = file.replace(".pdb", "")
-                    parser = PDBParser()
-                    structure = parser.get_structure(name_file, file)
-                    for model in structure:
-                        for chain in model:
-                            for residue in chain:
-                                resnameid_coord = residue.get_resname(
-                                ) + str(residue.get_id()[1]) + "_" + "_".join([str(tuple(residue["N"].coord)), str(tuple(residue["CA"].coord)), str(tuple(residue["C"].coord))])
-                                if res_dict.get(resnameid_coord) is None:
-                                    res_dict[resnameid_coord] = []
-                                res_dict[resnameid_coord].append(residue)
-                                if res_dict_pull.get(resnameid_coord) is None:
-                                    res_dict_pull[resnameid_coord] = residue
-            except:
-                continue
-
-        duplicate_dict = {}
-        for residue_list in res_dict.values():
-            for residue in residue_list:
-                resname = residue.get_resname()
-                if duplicate_dict.get(resname) is None:
-                    duplicate_dict[resname] = []
-                duplicate_dict[resname].append(residue)
+    if len(patches) <= 1 and len(patches) > 0:
+        if os.path.exists(patches[0][0]):
+            cmd_cp = (f"cp patch_file* {folder_output}")
+            os.system(cmd_cp)
+        else:
+            write_fragment_pdb(read_fragment_records(FRAGMENTS_FILE)[patches[0][0]], folder_output)
+    if len(patches) > 1:
+        table = ResidueTable(tqdm(patches, total=len(patches), desc="loading structures", position=0, leave=True))
+        if len(table) == 0:
+            return final_peptides_list
+
+        # Same residue type within 1 A: one representative (lowest residue number)
+        occurrences = table.uid[np.lexsort((np.arange(len(table.uid)), table.uid))]
+        res_names = table.res_name[occurrences]
         reformed_residues = []
-        for resname, residues_list in duplicate_dict.items():
-            res_cluster_dict = {}
-            if len(residues_list) > 1:
-                all_coords_array = [(np.average(np.array(
-                    [residues["N"].coord, residues["CA"].coord, residues["C"].coord]), axis=0)) for residues in residues_list]
-                dist_matrix = pdist(all_coords_array, metric='euclidean')
-                complete_dist_matrix = complete(dist_matrix)
-                clusters = fcluster(complete_dist_matrix,
-                                    1, criterion='distance')
-                clustered_orderer_res = [(y, "C" + str(x)) for x, y in sorted(
-                    zip(clusters, residues_list))]
-                for residue, order in clustered_orderer_res:
-                    if res_cluster_dict.get(order) is None:
-                        res_cluster_dict[order] = []
-                    res_cluster_dict[order].append(residue)
-                for cluster_residues in res_cluster_dict.values():
-                    cluster_residues_str = [residue.get_resname() + str(residue.get_id()[1]) + "_" + "_".join([str(tuple(
-                        residue["N"].coord)), str(tuple(residue["CA"].coord)), str(tuple(residue["C"].coord))]) for residue in cluster_residues]
-                    counter = Counter(cluster_residues_str)
-                    cluster_residues = res_dict_pull.get(
-                        list(counter.keys())[0])
-                    reformed_residues.append(cluster_residues)
-            if len(residues_list) == 1:
-                reformed_residues.append(residues_list[0])
-
-        res_cluster_dict = {}
-        all_coords_array = [(np.average(np.array([residues["N"].coord, residues["CA"].coord,residues["C"].coord]), axis=0)) for residues in reformed_residues]
-        dist_matrix = pdist(all_coords_array, metric='euclidean')
-        complete_dist_matrix = complete(dist_matrix)
-        clusters = fcluster(complete_dist_matrix,
-                            3, criterion='distance')
-        clustered_orderer_res = [(y, "C" + str(x)) for x, y in sorted(
-            zip(clusters, reformed_residues))]
-        for residue, order in clustered_orderer_res:
-            if res_cluster_dict.get(order) is None:
-                res_cluster_dict[order] = []
-            res_cluster_dict[order].append(residue)
+        for resname in dict.fromkeys(res_names.tolist()):
+            residues_list = occurrences[res_names == resname]
+            reformed_residues += [cluster[0] for cluster in cluster_representatives(table, residues_list, 1)]
 
+        # Residues within 3 A are alternatives for the same position
         equivalentRes_dup = []
         single_res = []
-        for order, equivalent_residues in res_cluster_dict.items():
+        for equivalent_residues in cluster_representatives(table, reformed_residues, 3):
             if len(equivalent_residues) > 1:
                 equivalentRes_dup.append(equivalent_residues)
-            if len(equivalent_residues) == 1:
-                residue = equivalent_residues[0]
-                single_res.append(residue)
+            else:
+                single_res.append(equivalent_residues[0])
 
-        dup_comb_list = []
-        print("initiating combinations...")
         print("initiating combinations...")
-        
-        # Calculate total possible combinations
         total_stats = 1
         for group in equivalentRes_dup:
             total_stats *= len(group)
-            
-        dup_comb_list = []
-        
+
         if total_stats <= MAX_COMBINATIONS:
-            # Small enough to generate all
-            combination_res_list = product(*equivalentRes_dup)
-            for combination in combination_res_list:
-                combination = list(set(combination))
-                dup_comb_list.append(combination)
+            dup_comb_list = [list(combination) for combination in product(*equivalentRes_dup)]
         else:
-            # Too many, use random sampling
             print(f"Total combinations ({total_stats}) exceeds limit ({MAX_COMBINATIONS}). Random sampling...")
-            for _ in range(MAX_COMBINATIONS):
-                 # Pick random one from each group
-                 combination = [random.choice(group) for group in equivalentRes_dup]
-                 combination = list(set(combination))
-                 dup_comb_list.append(combination)
-
-        # Skip the original product line as we built dup_comb_list manually
-        combination_res_list = list(product([single_res], dup_comb_list))
+            dup_comb_list = [[random.choice(group) for group in equivalentRes_dup] for _ in range(MAX_COMBINATIONS)]
         print("combinations finished...")
+        if len(dup_comb_list) >= MAX_COMBINATIONS:
+            dup_comb_list = random.sample(dup_comb_list, MAX_COMBINATIONS)
+
         final_names_list = []
-        len_comb = len(combination_res_list)
-        # Random sample again if strictly needed technically (though we just curbed it), 
-        # but logic dictates we might have up to MAX_COMBINATIONS now.
-        if len_comb >= MAX_COMBINATIONS:
-            combination_res_list = random.sample(combination_res_list, MAX_COMBINATIONS)
-        for final_comb in tqdm(combination_res_list, total=len(combination_res_list), desc="Working on each combination...", position=0, leave=True):
-            res_dist_dict = {}
-            res_dist_list = []
-            final_peptide = list(itertools.chain.from_iterable(
-                [final_comb[0], final_comb[1]]))
-            nameresid_list = list(
-                set([res.get_resname(
-                ) + str(res.get_id()[1]) + "_" + "_".join([str(tuple(res["N"].coord)), str(tuple(res["CA"].coord)), str(tuple(res["C"].coord))]) for res in final_peptide]))
-            final_peptide = [res_dict_pull.get(nameresid)
-                                for nameresid in nameresid_list]
-            combination_NC_list = list(itertools.permutations(
-                final_peptide, 2))
-            for CA_prox in combination_NC_list:
-                residue1 = CA_prox[0]
-                residue2 = CA_prox[1]
-                residue1_CA_coord = (np.average(np.array([residue1["N"].coord, residue1["CA"].coord,
-                                                            residue1["C"].coord]), axis=0))
-                residue2_CA_coord = (np.average(np.array([residue2["N"].coord, residue2["CA"].coord,
-                                                            residue2["C"].coord]), axis=0))
-                dist_CA = np.linalg.norm(
-                    residue1_CA_coord - residue2_CA_coord)
-                if res_dist_dict.get(residue1) is None:
-                    res_dist_dict[residue1] = []
-                res_dist_dict[residue1].append(dist_CA)
-
-            for res, dist_list in res_dist_dict.items():
-                dist_max = max(dist_list)
-                # dist_min = min(dist_list)
-                # st_dist = np.std([dist_max,dist_min])
-                tuple_res = res, dist_max
-                res_dist_list.append(tuple_res)
-
-            sorted_list = sorted(res_dist_list,key=itemgetter(1))
-            start_res = [sorted_list[-1][0]]
-            end_res = sorted_list[-2][0]
-            mid_residues = [x[0] for x in sorted_list[:-2]]
-            prod_res = product(start_res, mid_residues)
-            peptide_ordered = []
-            dist_bond_pass = 0
-            prod_rest_list = []
-            for res_pair in prod_res:
-                start_res = res_pair[0]
-                next_res = res_pair[1]
-                dist_res = next_res["CA"] - start_res["CA"]
-                triple_data = start_res, next_res, dist_res
-                prod_rest_list.append(triple_data)
-            sorted_list = sorted(prod_rest_list,key=itemgetter(2))
-            start_res = sorted_list[0][0]
-            next_res = sorted_list[0][1]
-            peptide_ordered.append(start_res)
-            peptide_ordered.append(next_res)
-            mid_residues.remove(next_res)
-            dist_bond1 = next_res["N"] - start_res["C"]
-            dist_bond2 = start_res["N"] - next_res["C"]
-            if dist_bond1 < dist_bond2:
-                dist_bond_pass += 1
-
-                    
-            for i in range(1, len(mid_residues)):
-                prod_rest_list2 = []  
-                prev_res = [peptide_ordered[-1]]
-                prod_res = product(prev_res, mid_residues)
-                for res_pair in prod_res:
-                    start_res = res_pair[0]
-                    next_res = res_pair[1]
-                    dist_res = next_res["CA"] - start_res["CA"]
-                    triple_data = start_res, next_res, dist_res
-                    prod_rest_list2.append(triple_data)
-                sorted_list = sorted(prod_rest_list2,key=itemgetter(2))
-                next_res = sorted_list[0][1]
-                peptide_ordered.append(next_res)
-                mid_residues.remove(next_res)
-            peptide_ordered.append(end_res)
-
-            # if len(peptide_ordered) >= 5:
-            if dist_bond_pass == 1:
-                peptide_name = "".join([d3to1.get(res.get_resname()) for res in peptide_ordered])
-                if peptide_name not in final_names_list:
-                    final_names_list.append(peptide_name)
-                    final_peptides_list.append(peptide_ordered)
-            if dist_bond_pass == 0:
-                peptide_ordered = peptide_ordered[::-1]
-                peptide_name = "".join([d3to1.get(res.get_resname()) for res in peptide_ordered])
-                if peptide_name not in final_names_list:
-                    final_names_list.append(peptide_name)
-                    final_peptides_list.append(peptide_ordered)
+        peptide_letters = np.array([d3to1.get(resname.decode()) for resname in table.res_name], dtype=object)
+        for combination in tqdm(dup_comb_list, total=len(dup_comb_list), desc="Working on each combination...", position=0, leave=True):
+            peptide_ordered = order_peptide(table, np.unique(single_res + combination))
+            if peptide_ordered is None:
+                continue
+            peptide_name = "".join(peptide_letters[peptide_ordered])
+            if peptide_name not in final_names_list:
+                final_names_list.append(peptide_name)
+                final_peptides_list.append([table.residue(uid) for uid in peptide_ordered])
 
     return final_peptides_list
     
@@ -0,0 +1,148 @@
+import os
+import sys
+import argparse
+from collections import OrderedDict
+import numpy as np
+from scipy.cluster.hierarchy import linkage, fcluster
+from scipy.spatial.distance import squareform
+
+from patches import load_patches
+
+# Redundant DB entries often put the same peptide residues at the same place of
+# the pocket. Patches with the same sequence whose backbones (N, CA, C, O, in
+# the target frame, no superposition) stay within DEFAULT_RMSD of each other are
+# scored once by FrankVINA 1: the representative is Vina-scored and its score
+# is propagated to the members.
+BACKBONE = (b"N", b"CA", b"C", b"O")
+DEFAULT_RMSD = 0.5
+
+
+def residue_starts(atoms):
+    """
+    Boolean mask of the first atom of each residue (file order)
+    """
+    start = np.ones(len(atoms["res_id"]), dtype=bool)
+    start[1:] = ((atoms["res_id"][1:] != atoms["res_id"][:-1]) | (atoms["icode"][1:] != atoms["icode"][:-1])
+                 | (atoms["res_name"][1:] != atoms["res_name"][:-1]))
+    return start
+
+
+def patch_sequence(atoms):
+    return tuple(atoms["res_name"][residue_starts(atoms)].astype(str))
+
+
+def backbone_pose(atoms):
+    """
+    (residues, 4, 3) backbone coordinates of a patch, None when an atom is missing
+    """
+    start = residue_starts(atoms)
+    residue_index = np.cumsum(start) - 1
+    pose = np.full((int(start.sum()), len(BACKBONE), 3), np.nan)
+    for k, atom_name in enumerate(BACKBONE):
+        mask = atoms["atom_name"] == atom_name
+        pose[residue_index[mask], k] = atoms["coords"][mask]
+    if np.isnan(pose).any():
+        return None
+    return pose
+
+
+def pairwise_rmsd(poses):
+    """
+    In-place RMSD matrix of a stack of poses with shape (m, residues, 4, 3)
+    """
+    flat = poses.reshape(len(poses), -1)
+    n_atoms = flat.shape[1] // 3
+    squared = (flat ** 2).sum(axis=1)
+    msd = (squared[:, None] + squared[None, :] - 2 * flat @ flat.T) / n_atoms
+    np.fill_diagonal(msd, 0)
+    return np.sqrt(np.clip(msd, 0, None))
+
+
+def cluster_patches(patches, max_rmsd=DEFAULT_RMSD):
+    """
+    {representative: [(member, rmsd to the representative), ...]} over
+    (name, atoms) patches. Clusters are complete-linkage (every pair within
+    max_rmsd) per sequence; the representative is the cluster medoid.
+    """
+    groups = OrderedDict()
+    clusters = OrderedDict()
+    for name, atoms in patches:
+        pose = backbone_pose(atoms)
+        if pose is None or max_rmsd <= 0:
+            clusters[name] = []
+            continue
+        groups.setdefault((patch_sequence(atoms), pose.shape), []).append((name, pose))
+    for group in groups.values():
+        names = [name for name, pose in group]
+        if len(group) == 1:
+            clusters[names[0]] = []
+            continue
+        rmsd = pairwise_rmsd(np.stack([pose for name, pose in group]))
+        labels = fcluster(linkage(squareform(rmsd, checks=False), method="complete"), max_rmsd, criterion="distance")
+        for label in np.unique(labels):
+            index = np.flatnonzero(labels == label)
+            representative = index[np.argmin(rmsd[np.ix_(index, index)].sum(axis=1))]
+            clusters[names[representative]] = [(names[i], float(rmsd[representative, i]))
+                                               for i in index if i != representative]
+    return clusters
+
+
+class PatchDeduper:
+    """
+    Online variant for patches announced one by one (frankVINA_1.py --stream):
+    a patch within max_rmsd of an earlier representative of its sequence joins it.
+    """
+
+    def __init__(self, max_rmsd=DEFAULT_RMSD):
+        self.max_rmsd = max_rmsd
+        self.representatives = {} # (sequence, shape) -> (names, stacked poses)
+        self.members = OrderedDict()
+
+    def add(self, name, atoms):
+        """
+        Representative the patch joins, None when it has to be scored itself
+        """
+        pose = backbone_pose(atoms) if self.max_rmsd > 0 else None
+        if pose is None:
+            return None
+        key = (patch_sequence(atoms), pose.shape)
+        if key in self.representatives:
+            names, poses = self.representatives[key]
+            rmsd = np.sqrt(((poses - pose) ** 2).sum(axis=-1).mean(axis=(1, 2)))
+            closest = int(np.argmin(rmsd))
+            if rmsd[closest] <= self.max_rmsd:
+                self.members.setdefault(names[closest], []).append((name, float(rmsd[closest])))
+                return names[closest]
+            self.representatives[key] = (names + [name], np.concatenate([poses, pose[None]]))
+        else:
+            self.representatives[key] = ([name], pose[None])
+        return None
+
+
+def main():
+    program_description = "Group the patches of a superposer output folder by sequence and backbone RMSD"
+    parser = argparse.ArgumentParser(description=program_description)
+    parser.add_argument("-f", "--folder", type=str, default=".",
+                        help="superposer output folder (patch_file_*.pdb and/or fragments.jsonl)")
+    parser.add_argument("-r", "--rmsd", type=float, default=DEFAULT_RMSD,
+                        help="maximum backbone RMSD between patches of a cluster (Angstrom)")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="write 'representative<tab>member<tab>rmsd' lines to this file")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder):
+        print(f"Error: {args.folder} not found.")
+        sys.exit(1)
+    patches = load_patches(args.folder)
+    clusters = cluster_patches(patches, args.rmsd)
+    print(f"{len(patches)} patches -> {len(clusters)} representatives (RMSD <= {args.rmsd})")
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write("representative\tmember\trmsd\n")
+            for representative, members in clusters.items():
+                for member, rmsd in members:
+                    f.write(f"{representative}\t{member}\t{rmsd:.3f}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import fnmatch
+import argparse
+from collections import OrderedDict
+import numpy as np
+
+from pdb_arrays import read_pdb_atoms, residue_keys, write_pdb
+from geometry_filters import CLASH_DISTANCE, clash_free_residues, in_box
+from complex_cache import get_complex_cache
+from minipocket_db import parse_minipocket_name
+
+# Acceptance of a DB peptide patch moved onto a target pocket, shared by the
+# superposer scan and the hit table re-filter.
+PATCH_CHAIN = "x"
+
+
+def patch_name(fragment):
+    """
+    Patch label used in file names, e.g. 'ALA12-GLY13-SER14'
+    """
+    return "-".join(dict.fromkeys(residue_keys(fragment)))
+
+
+def move_fragment(fragment, rotation, translation):
+    """
+    Fragment coordinates after the alignment transform (coords @ rotation + translation)
+    """
+    return (np.asarray(fragment["coords"], dtype=np.float32) @ np.asarray(rotation, dtype=np.float32)
+            + np.asarray(translation, dtype=np.float32))
+
+
+def patch_passes(fragment, coords, tree, box_center, box_size, min_distance=CLASH_DISTANCE):
+    """
+    True when every patch residue stays >= min_distance from the pocket and
+    keeps its CA strictly inside the gridbox
+    """
+    residue_names, residue_index = np.unique(residue_keys(fragment), return_inverse=True)
+    clash_free = clash_free_residues(coords, residue_index, tree, min_distance)
+    is_ca = fragment["atom_name"] == b"CA"
+    inside_box = np.zeros(len(residue_names), dtype=bool)
+    inside_box[residue_index[is_ca]] = in_box(coords[is_ca], box_center, box_size)
+    return bool(clash_free.all() and inside_box.all())
+
+
+def patch_file_name(fragment, output_folder):
+    return f"{output_folder}/patch_file_{patch_name(fragment)}.pdb"
+
+
+def write_patch(fragment, coords, output_folder):
+    """
+    Writes {output_folder}/patch_file_{patch}.pdb under a temporary name first,
+    so consumers never see a partial patch. Returns the patch file.
+    """
+    patch_file = patch_file_name(fragment, output_folder)
+    tmp_file = f"{patch_file}.{os.getpid()}.tmp"
+    write_pdb(dict(fragment, coords=coords), tmp_file, chain=PATCH_CHAIN)
+    os.replace(tmp_file, patch_file)
+    return patch_file
+
+
+# Lazy patches (superposer.py --lazy): accepted hits are kept as records of
+# {output_folder}/fragments.jsonl and only turned into coordinates when needed.
+#   {"patch": "patch_file_ALA12-GLY13.pdb", "minipocket": ..., "pepbdb_folder": ...,
+#    "complex": "1abc_A_B", "chain": "B", "residues": ["ALA12", "GLY13"],
+#    "rotation": [[...], [...], [...]], "translation": [...]}
+FRAGMENTS_FILE = "fragments.jsonl"
+
+
+def fragment_record(minipocket_file, patch_file, pepbdb_folder, alignment):
+    """
+    Lazy record of an accepted patch (file names as returned by the superposer)
+    """
+    file_noExtension, folder, peptide_chain, patch = parse_minipocket_name(minipocket_file)
+    return {"patch": os.path.basename(patch_file), "minipocket": minipocket_file,
+            "pepbdb_folder": pepbdb_folder, "complex": folder, "chain": peptide_chain,
+            "residues": patch.split("-"),
+            "rotation": np.asarray(alignment.rotation, dtype=np.float64).tolist(),
+            "translation": np.asarray(alignment.translation, dtype=np.float64).tolist()}
+
+
+def append_fragment_records(records_file, records):
+    if not records:
+        return
+    with open(records_file, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_fragment_records(records_file):
+    """
+    {patch file name: record}; the last record of a patch wins, like an
+    overwritten patch file. A truncated last line is ignored.
+    """
+    records = OrderedDict()
+    if not os.path.exists(records_file):
+        return records
+    with open(records_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record["patch"]] = record
+    return records
+
+
+def write_fragment_records(records_file, records):
+    """
+    Rewrites a records file with the given records only
+    """
+    tmp_file = records_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    os.replace(tmp_file, records_file)
+
+
+def materialize(record):
+    """
+    Atom arrays of a lazy patch, moved onto the target pocket. Coordinates are
+    rounded like PDB text so lazy and written patches compare equal.
+    """
+    fragment = get_complex_cache(record["pepbdb_folder"]).fragment(
+        record["complex"], record["chain"], record["residues"])
+    if fragment is None:
+        return None
+    coords = move_fragment(fragment, record["rotation"], record["translation"])
+    fragment["coords"] = np.round(coords.astype(np.float64), 3).astype(np.float32)
+    return fragment
+
+
+def write_fragment_pdb(record, output_folder):
+    """
+    Materializes one lazy patch as {output_folder}/{patch} (PDB on request)
+    """
+    fragment = materialize(record)
+    if fragment is None:
+        return None
+    patch_file = os.path.join(output_folder, record["patch"])
+    write_pdb(fragment, patch_file, chain=PATCH_CHAIN)
+    return patch_file
+
+
+def load_patches(folder="."):
+    """
+    (patch file name, atoms) of every patch of a superposer output folder:
+    patch_file_*.pdb files plus lazy records without a written file
+    """
+    patches = []
+    files = sorted(fnmatch.filter(os.listdir(folder), "patch_file_*.pdb"))
+    for file in files:
+        patches.append((file, read_pdb_atoms(os.path.join(folder, file))))
+    for patch, record in read_fragment_records(os.path.join(folder, FRAGMENTS_FILE)).items():
+        if patch in files:
+            continue
+        fragment = materialize(record)
+        if fragment is not None:
+            patches.append((patch, fragment))
+    return patches
+
+
+def main():
+    program_description = "Write the PDB files of lazy patches recorded by superposer.py --lazy"
+    parser = argparse.ArgumentParser(description=program_description)
+    parser.add_argument("-f", "--fragments", type=str, required=True,
+                        help=f"{FRAGMENTS_FILE} of a superposer output folder")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="folder for the patch files (default: the folder of the records)")
+    parser.add_argument("-p", "--patches", type=str, nargs="*", default=None,
+                        help="only these patches (e.g. patch_file_ALA12-GLY13-SER14.pdb)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.fragments):
+        print(f"Error: {args.fragments} not found.")
+        sys.exit(1)
+    output_folder = args.output or os.path.dirname(os.path.abspath(args.fragments))
+    os.makedirs(output_folder, exist_ok=True)
+    records = read_fragment_records(args.fragments)
+    selected = [record for patch, record in records.items() if args.patches is None or patch in args.patches]
+    written = [write_fragment_pdb(record, output_folder) for record in selected]
+    print(f"Wrote {len([file for file in written if file])}/{len(selected)} patches to {output_folder}")
+
+
+if __name__ == "__main__":
+    main()
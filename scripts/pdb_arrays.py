@@ -0,0 +1,89 @@
+import numpy as np
+
+# Column-oriented view of the ATOM/HETATM records of a PDB file.
+# Strings are kept as fixed-width bytes so the arrays can be saved/memory-mapped.
+ATOM_FIELDS = {
+    "record": "S6",
+    "atom_name": "S4",
+    "res_name": "S3",
+    "chain": "S1",
+    "res_id": np.int32,
+    "icode": "S1",
+    "element": "S2",
+}
+
+
+def read_pdb_atoms(pdb_file, chains=None):
+    """
+    Parses ATOM/HETATM records into a dict of arrays (see ATOM_FIELDS) plus
+    float32 'coords'. Only the first model is read.
+    """
+    columns = {field: [] for field in ATOM_FIELDS}
+    coords = []
+    with open(pdb_file) as f:
+        for line in f:
+            if line.startswith("ENDMDL"):
+                break
+            if not line.startswith(("ATOM", "HETATM")):
+                continue
+            chain = line[21:22]
+            if chains is not None and chain not in chains:
+                continue
+            atom_name = line[12:16].strip()
+            element = line[76:78].strip() or atom_name[:1]
+            columns["record"].append(line[0:6].strip())
+            columns["atom_name"].append(atom_name)
+            columns["res_name"].append(line[17:20].strip())
+            columns["chain"].append(chain)
+            columns["res_id"].append(int(line[22:26]))
+            columns["icode"].append(line[26:27].strip())
+            columns["element"].append(element)
+            coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    atoms = {field: np.array(values, dtype=ATOM_FIELDS[field])
+             for field, values in columns.items()}
+    atoms["coords"] = np.array(coords, dtype=np.float32).reshape(-1, 3)
+    return atoms
+
+
+def take_atoms(atoms, index):
+    """
+    Subset of an atom dict by boolean mask, slice or index array
+    """
+    return {field: values[index] for field, values in atoms.items()}
+
+
+def residue_keys(atoms):
+    """
+    Residue labels as used in patch names, e.g. 'ALA12'
+    """
+    return np.char.add(atoms["res_name"].astype(str), atoms["res_id"].astype(str))
+
+
+def format_atom_line(serial, record, atom_name, res_name, chain, res_id, icode, x, y, z, element):
+    # Atom names shorter than 4 characters start at column 14 (PDB convention)
+    if len(atom_name) < 4 and len(element) == 1:
+        atom_name = f" {atom_name}"
+    return (f"{record:<6s}{serial % 100000:5d} {atom_name:<4s} {res_name:>3s} {chain:1s}"
+            f"{res_id:4d}{icode:1s}   {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00"
+            f"          {element:>2s}\n")
+
+
+def pdb_lines(atoms, chain=None):
+    """
+    Formats an atom dict as PDB ATOM/HETATM lines (no END record).
+    If chain is given, every atom is written with that chain id.
+    """
+    lines = []
+    text = {field: atoms[field].astype(str) for field in ATOM_FIELDS if field != "res_id"}
+    for i, (x, y, z) in enumerate(atoms["coords"].tolist()):
+        lines.append(format_atom_line(
+            i + 1, text["record"][i], text["atom_name"][i], text["res_name"][i],
+            chain if chain is not None else text["chain"][i], int(atoms["res_id"][i]),
+            text["icode"][i], x, y, z, text["element"][i]))
+    return lines
+
+
+def write_pdb(atoms, pdb_file, chain=None):
+    with open(pdb_file, "w") as f:
+        f.writelines(pdb_lines(atoms, chain=chain))
+        f.write("END\n")
@@ -0,0 +1,133 @@
+import os
+import sys
+import argparse
+import numpy as np
+
+from pdb_arrays import ATOM_FIELDS, write_pdb
+
+# Vina output PDBQT -> PDB in-process, replacing one obabel call per pose.
+# Every model of a multi-model _out.pdbqt is read (MODEL/ENDMDL, or a single
+# pose without them, as --local_only writes); the best model (lowest REMARK
+# VINA RESULT energy, else the first) is written with its heavy atoms only.
+AD_ELEMENTS = {"A": "C", "C": "C", "N": "N", "NA": "N", "NS": "N", "OA": "O", "OS": "O", "S": "S", "SA": "S",
+               "H": "H", "HD": "H", "HS": "H", "P": "P", "F": "F", "Cl": "Cl", "CL": "Cl", "Br": "Br", "BR": "Br",
+               "I": "I", "Mg": "Mg", "MG": "Mg", "Ca": "Ca", "CA": "Ca", "Mn": "Mn", "MN": "Mn", "Fe": "Fe",
+               "FE": "Fe", "Zn": "Zn", "ZN": "Zn"}
+
+
+def _model_atoms(lines):
+    columns = {field: [] for field in ATOM_FIELDS}
+    coords = []
+    for line in lines:
+        ad_type = line[77:79].strip()
+        columns["record"].append(line[0:6].strip())
+        columns["atom_name"].append(line[12:16].strip())
+        columns["res_name"].append(line[17:20].strip())
+        columns["chain"].append(line[21:22])
+        columns["res_id"].append(int(line[22:26]))
+        columns["icode"].append(line[26:27].strip())
+        columns["element"].append(AD_ELEMENTS.get(ad_type, ad_type[:1]))
+        coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    atoms = {field: np.array(values, dtype=ATOM_FIELDS[field]) for field, values in columns.items()}
+    atoms["coords"] = np.array(coords, dtype=np.float32).reshape(-1, 3)
+    return atoms
+
+
+def read_pdbqt_models(pdbqt_file):
+    """
+    [(energy or None, atoms), ...] of every model of a PDBQT, atoms as pdb_arrays dicts
+    """
+    models = []
+    energy, lines = None, []
+    with open(pdbqt_file) as f:
+        for line in f:
+            if line.startswith("MODEL"):
+                energy, lines = None, []
+            elif line.startswith("REMARK VINA RESULT:"):
+                energy = float(line.split(":")[1].split()[0])
+            elif line.startswith(("ATOM", "HETATM")):
+                lines.append(line)
+            elif line.startswith("ENDMDL"):
+                models.append((energy, _model_atoms(lines)))
+                lines = []
+    if lines: # Single pose without MODEL records
+        models.append((energy, _model_atoms(lines)))
+    return models
+
+
+def best_model(models):
+    """
+    Atoms of the lowest-energy model (the first one when energies are missing)
+    """
+    scored = [index for index, (energy, atoms) in enumerate(models) if energy is not None]
+    index = min(scored, key=lambda i: models[i][0]) if scored else 0
+    return models[index][1]
+
+
+def heavy_atoms(atoms):
+    """
+    Heavy atoms in residue order (PDBQT files follow the torsion tree): chains
+    in order of appearance, then residue number and insertion code
+    """
+    keep = np.flatnonzero(atoms["element"] != b"H")
+    chains, first = np.unique(atoms["chain"][keep], return_index=True)
+    chain_rank = np.argsort(np.argsort(first))[np.searchsorted(chains, atoms["chain"][keep])]
+    keep = keep[np.lexsort((atoms["icode"][keep], atoms["res_id"][keep], chain_rank))]
+    return {field: values[keep] for field, values in atoms.items()}
+
+
+def pdbqt_to_pdb(pdbqt_file, pdb_file):
+    """
+    Writes the heavy atoms of the best model of pdbqt_file to pdb_file and
+    returns every model, None when the PDBQT holds no atoms
+    """
+    models = read_pdbqt_models(pdbqt_file)
+    if not models:
+        return None
+    write_pdb(heavy_atoms(best_model(models)), pdb_file)
+    return models
+
+
+def convert_all(pdbqt_files, output_folder=None, suffix="", remove=False):
+    """
+    Converts many PDBQTs in one process: {pdbqt_file: (pdb_file, models)}.
+    {name}{suffix}.pdbqt becomes {name}.pdb, next to it or in output_folder.
+    """
+    converted = {}
+    for pdbqt_file in pdbqt_files:
+        name = os.path.basename(pdbqt_file)[:-len(f"{suffix}.pdbqt")]
+        pdb_file = os.path.join(output_folder or os.path.dirname(pdbqt_file), f"{name}.pdb")
+        try:
+            models = pdbqt_to_pdb(pdbqt_file, pdb_file)
+        except (OSError, ValueError) as e:
+            print(f"DEBUG: Could not convert {pdbqt_file}: {e}")
+            continue
+        if models is None:
+            continue
+        converted[pdbqt_file] = (pdb_file, models)
+        if remove:
+            os.remove(pdbqt_file)
+    return converted
+
+
+def main():
+    program_description = "Convert Vina output PDBQTs to PDB (best model, heavy atoms)"
+    parser = argparse.ArgumentParser(description=program_description)
+    parser.add_argument("pdbqt_files", type=str, nargs="+", help="PDBQT files (e.g. top_10_patches/*_out.pdbqt)")
+    parser.add_argument("-o", "--output", type=str, default=None, help="folder for the PDB files (default: next to each PDBQT)")
+    parser.add_argument("-s", "--suffix", type=str, default="", help="suffix dropped from the names, e.g. _out")
+    parser.add_argument("--remove", action="store_true", help="remove each PDBQT once converted")
+    args = parser.parse_args()
+
+    missing = [file for file in args.pdbqt_files if not os.path.exists(file)]
+    if missing:
+        print(f"Error: {', '.join(missing)} not found.")
+        sys.exit(1)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    converted = convert_all(args.pdbqt_files, args.output, args.suffix, args.remove)
+    print(f"Converted {len(converted)}/{len(args.pdbqt_files)} PDBQT files")
+
+
+if __name__ == "__main__":
+    main()
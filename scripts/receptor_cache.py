@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import subprocess
+import tempfile
+
+# Protonated receptor (reduce) and its PDBQT (prepare_receptor), cached under
+# {initial_path}/cache/receptors/{key}/ where key hashes the input PDB and the
+# reduce binary, its het dictionary and prepare_receptor. Shared by FrankVINA 1
+# (receptor.pdb) and FrankVINA 2 (pocket.pdb) and across runs.
+CACHE_ENV = "FRANKPEPSTEIN_RECEPTOR_CACHE"
+CACHE_SUBDIR = os.path.join("cache", "receptors")
+H_FILE = "H_receptor.pdb"
+PDBQT_FILE = "receptor.pdbqt"
+META_FILE = "meta.json"
+
+_tool_hashes = {}
+
+
+def receptor_cache_dir(initial_path):
+    return os.environ.get(CACHE_ENV) or os.path.join(initial_path, CACHE_SUBDIR)
+
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def tool_fingerprint(*tools):
+    """
+    Content hashes of the preparation tools (missing tools hash as their path)
+    """
+    fingerprint = []
+    for tool in tools:
+        if tool not in _tool_hashes:
+            _tool_hashes[tool] = file_sha1(tool) if os.path.isfile(tool) else f"missing:{tool}"
+        fingerprint.append(_tool_hashes[tool])
+    return fingerprint
+
+
+def receptor_key(receptor_pdb, reduce_path, reduce_db_path, prepare_receptor_path):
+    sha1 = hashlib.sha1()
+    sha1.update(file_sha1(receptor_pdb).encode())
+    for tool_hash in tool_fingerprint(reduce_path, reduce_db_path, prepare_receptor_path):
+        sha1.update(tool_hash.encode())
+    return sha1.hexdigest()
+
+
+def _prepare(receptor_pdb, folder, reduce_path, reduce_db_path, prepare_receptor_path):
+    """
+    reduce + prepare_receptor into folder, as the FrankVINA scripts did inline
+    """
+    with open(os.path.join(folder, H_FILE), "w") as out:
+        subprocess.run([reduce_path, "-Quiet", "-DB", reduce_db_path, os.path.abspath(receptor_pdb)],
+                       stdout=out, stderr=subprocess.DEVNULL)
+    with open(os.path.join(folder, H_FILE)) as f:
+        lines = [line for line in f if "END" not in line]
+    with open(os.path.join(folder, H_FILE), "w") as f:
+        f.writelines(lines)
+    subprocess.run([prepare_receptor_path, "-r", H_FILE, "-o", PDBQT_FILE], cwd=folder,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _complete(folder):
+    return all(os.path.exists(os.path.join(folder, name)) and os.path.getsize(os.path.join(folder, name)) > 0
+               for name in (H_FILE, PDBQT_FILE))
+
+
+def prepare_receptor(receptor_pdb, h_out, pdbqt_out, initial_path, reduce_path, reduce_db_path, prepare_receptor_path):
+    """
+    Writes the protonated receptor to h_out and its PDBQT to pdbqt_out, from the
+    cache when this receptor was already prepared with the same tools. Returns True on a cache hit.
+    """
+    cache_dir = receptor_cache_dir(initial_path)
+    key = receptor_key(receptor_pdb, reduce_path, reduce_db_path, prepare_receptor_path)
+    entry = os.path.join(cache_dir, key)
+    hit = _complete(entry)
+    tmp_entry = None
+    if hit:
+        print(f"DEBUG: Receptor {receptor_pdb} prepared from cache {entry}")
+    else:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_entry = tempfile.mkdtemp(prefix=f"{key}.", suffix=".tmp", dir=cache_dir)
+        _prepare(receptor_pdb, tmp_entry, reduce_path, reduce_db_path, prepare_receptor_path)
+        if _complete(tmp_entry):
+            with open(os.path.join(tmp_entry, META_FILE), "w") as f:
+                json.dump({"receptor": os.path.abspath(receptor_pdb), "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                           "tools": dict(zip(["reduce", "reduce_db", "prepare_receptor"],
+                                             tool_fingerprint(reduce_path, reduce_db_path, prepare_receptor_path)))},
+                          f, indent=4)
+            try:
+                os.rename(tmp_entry, entry)
+            except OSError: # Published meanwhile by a concurrent run
+                pass
+        if not _complete(entry): # Preparation failed: hand over whatever was produced, cache nothing
+            entry = tmp_entry
+    for name, out in ((H_FILE, h_out), (PDBQT_FILE, pdbqt_out)):
+        if os.path.exists(os.path.join(entry, name)):
+            shutil.copyfile(os.path.join(entry, name), out)
+    if tmp_entry is not None:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+    return hit
+
+
+def main():
+    program_description = "List or clear the prepared receptor cache used by FrankVINA 1 and 2"
+    parser = argparse.ArgumentParser(description=program_description)
+    parser.add_argument("-i", "--initial_path", type=str, required=True,
+                        help="Absolute path to the main directory (containing DB, utilities, etc.)")
+    parser.add_argument("--clear", action="store_true", help="remove every cached receptor")
+    args = parser.parse_args()
+
+    cache_dir = receptor_cache_dir(args.initial_path)
+    if not os.path.exists(cache_dir):
+        print(f"No receptor cache in {cache_dir}")
+        sys.exit(0)
+    entries = sorted(name for name in os.listdir(cache_dir) if os.path.isdir(os.path.join(cache_dir, name)))
+    if args.clear:
+        shutil.rmtree(cache_dir)
+        print(f"Removed {len(entries)} cached receptors from {cache_dir}")
+        return
+    for name in entries:
+        meta_file = os.path.join(cache_dir, name, META_FILE)
+        meta = json.load(open(meta_file)) if os.path.exists(meta_file) else {}
+        print(f"{name}\t{meta.get('created', '?')}\t{meta.get('receptor', '?')}")
+    print(f"{len(entries)} cached receptors in {cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
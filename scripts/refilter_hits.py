@@ -0,0 +1,77 @@
+import os
+import sys
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+from hit_table import HIT_TABLE_DIR, read_hit_table
+from complex_cache import PeptideComplexCache
+from minipocket_db import parse_minipocket_name
+from pdb_arrays import residue_keys
+from patches import move_fragment, patch_passes, write_patch
+from target_pocket import featurize_target
+
+
+def main():
+    program_description = "Regenerate superposer patches for new thresholds or gridbox from a saved alignment hit table (no re-alignment)"
+    parser = argparse.ArgumentParser(description=program_description)
+    parser.add_argument("-H", "--hit_table", type=str, required=True,
+                        help=f"hit table written by superposer.py (its output folder or the {HIT_TABLE_DIR} folder inside it)")
+    parser.add_argument("-T", "--target_receptor", type=str, default=None,
+                        help="target pocket used for the clash check (default: the scanned pocket)")
+    parser.add_argument("-d", "--pepbdb_folder", type=str, default=None,
+                        help="DB folder (default: the scanned one)")
+    parser.add_argument("-rmsd", "--rmsd_allowed", type=float, default=None,
+                        help="RMSD cutoff (default: the scan cutoff)")
+    parser.add_argument("--min_overlap", type=float, default=100.0, help="minimum alignment overlap (%%)")
+    parser.add_argument("--min_matched", type=int, default=3, help="minimum number of matched atoms")
+    for axis in "xyz":
+        parser.add_argument(f"-{axis}_center", f"--{axis}_center", type=float, default=None,
+                            help=f"{axis} coordinate of center for gridbox (default: the scan gridbox)")
+    for axis in "xyz":
+        parser.add_argument(f"-{axis}_size", f"--{axis}_size", type=float, default=None,
+                            help=f"{axis} size for gridbox (default: the scan gridbox)")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="output folder (default: superpockets_residuesAligned{min_matched}_RMSD{rmsd})")
+    args = parser.parse_args()
+
+    table_path = args.hit_table
+    if not os.path.exists(os.path.join(table_path, "meta.json")):
+        table_path = os.path.join(table_path, HIT_TABLE_DIR)
+    if not os.path.exists(os.path.join(table_path, "meta.json")):
+        print(f"Error: no hit table found in {args.hit_table}")
+        sys.exit(1)
+    meta, hits = read_hit_table(table_path)
+
+    rmsd_allowed = args.rmsd_allowed if args.rmsd_allowed is not None else meta["rmsd_allowed"]
+    gridbox = [args.x_center, args.y_center, args.z_center, args.x_size, args.y_size, args.z_size]
+    gridbox = [value if value is not None else default for value, default in zip(gridbox, meta["gridbox"])]
+    target = featurize_target(args.target_receptor or meta["target"])
+    cache = PeptideComplexCache(args.pepbdb_folder or meta["pepbdb_folder"])
+
+    output_folder = args.output or f"superpockets_residuesAligned{args.min_matched}_RMSD{rmsd_allowed}"
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    # Alignment criteria on the whole table at once, geometric filters on the survivors
+    passing = np.nonzero((np.asarray(hits["overlap"]) >= args.min_overlap)
+                         & (np.asarray(hits["rmsd"]) <= rmsd_allowed)
+                         & (np.asarray(hits["matched"]) >= args.min_matched))[0]
+    n_written = 0
+    for i in tqdm(passing, total=len(passing), desc="re-filtering alignment hits"):
+        file_noExtension, folder, peptide_chain, patch = parse_minipocket_name(hits["minipockets"][i].decode())
+        patch = patch.split("-")
+        fragment = cache.fragment(folder, peptide_chain, patch)
+        if fragment is None or len(set(residue_keys(fragment))) != len(patch):
+            continue
+        coords = move_fragment(fragment, hits["rotation"][i], hits["translation"][i])
+        if patch_passes(fragment, coords, target.tree, gridbox[:3], gridbox[3:]):
+            write_patch(fragment, coords, output_folder)
+            n_written += 1
+
+    print(f"{len(passing)}/{len(hits['rmsd'])} alignments pass RMSD <= {rmsd_allowed}, overlap >= {args.min_overlap}, "
+          f"matched >= {args.min_matched}; {n_written} patches written to {output_folder}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+# Run-level store of every Vina score, written by the FrankVINA workers as each
+# ligand is scored. One row per ligand and stage run; the top N of a stage run
+# is an indexed query instead of a scan of the Vina logs, and the notebook
+# steps read the final candidates from here.
+RESULTS_ENV = "FRANKPEPSTEIN_RESULTS_DB"
+RESULTS_FILE = "results.sqlite"
+RUN_FOLDER = "FrankPEPstein_run"
+STAGES = ["vina1", "vina2"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stage TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    params TEXT,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS scores (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run INTEGER NOT NULL REFERENCES runs(id),
+    stage TEXT NOT NULL,
+    ligand TEXT NOT NULL,
+    score REAL,
+    prep_seconds REAL,
+    score_seconds REAL,
+    source TEXT,
+    pose TEXT,
+    representative TEXT,
+    worker INTEGER,
+    created REAL NOT NULL,
+    UNIQUE (run, ligand)
+);
+CREATE INDEX IF NOT EXISTS scores_rank ON scores (run, score);
+CREATE INDEX IF NOT EXISTS runs_stage ON runs (stage, id);
+"""
+
+
+def results_path(initial_path):
+    return os.environ.get(RESULTS_ENV) or os.path.join(initial_path, RUN_FOLDER, RESULTS_FILE)
+
+
+# Per-thread registry: sqlite3 connections stay in the thread (and joblib worker
+# process) that opened them
+_local = threading.local()
+
+
+def connect(db_path):
+    """
+    Connection of this thread to db_path, opened (and the schema created) on first use
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+    db_path = os.path.abspath(db_path)
+    if db_path not in connections:
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL") # Workers insert while others read
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        connections[db_path] = conn
+    return connections[db_path]
+
+
+def start_run(db_path, stage, folder=".", **params):
+    """
+    New stage run (FrankVINA 1 or 2 in folder), returns its id for record_score()
+    """
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage '{stage}' (choose from {', '.join(STAGES)})")
+    conn = connect(db_path)
+    with conn:
+        cursor = conn.execute("INSERT INTO runs (stage, folder, params, started) VALUES (?, ?, ?, ?)",
+                              (stage, os.path.abspath(folder), json.dumps(params), time.time()))
+    return cursor.lastrowid
+
+
+def finish_run(db_path, run_id):
+    conn = connect(db_path)
+    with conn:
+        conn.execute("UPDATE runs SET finished = ? WHERE id = ?", (time.time(), run_id))
+
+
+def record_score(db_path, run_id, stage, ligand, score, pose=None, prep_seconds=None, score_seconds=None, source=None):
+    """
+    Stores one scored ligand as soon as Vina returns. score is None when Vina
+    gave no energy; source is the provenance (patch record, fragment file, ...)
+    """
+    conn = connect(db_path)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO scores (run, stage, ligand, score, prep_seconds, score_seconds, source, "
+                     "pose, worker, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (run_id, stage, ligand, score, prep_seconds, score_seconds,
+                      None if source is None else json.dumps(source), pose and os.path.abspath(pose),
+                      os.getpid(), time.time()))
+
+
+def propagate_score(db_path, run_id, stage, representative, members):
+    """
+    Gives members [(ligand, rmsd), ...] of a dedup cluster the score of their
+    representative (patch_dedup.py) without scoring them
+    """
+    conn = connect(db_path)
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO scores (run, stage, ligand, score, source, representative, worker, created) "
+                         "SELECT run, stage, ?, score, ?, ligand, ?, ? FROM scores WHERE run = ? AND ligand = ?",
+                         [(member, json.dumps({"representative": representative, "rmsd": rmsd}), os.getpid(), time.time(),
+                           run_id, representative) for member, rmsd in members])
+
+
+def set_pose(db_path, run_id, ligand, pose):
+    """
+    Points a ligand row at its pose once it has been moved or converted (None: no published pose)
+    """
+    conn = connect(db_path)
+    with conn:
+        conn.execute("UPDATE scores SET pose = ? WHERE run = ? AND ligand = ?", (pose and os.path.abspath(pose), run_id, ligand))
+
+
+def top_scores(db_path, run_id, n, max_score=None, representatives_only=False):
+    """
+    [(score, ligand, pose), ...] of the n best scored ligands of a run
+    (representatives_only: without the dedup members that share their score)
+    """
+    query = "SELECT score, ligand, pose FROM scores WHERE run = ? AND score IS NOT NULL"
+    values = [run_id]
+    if representatives_only:
+        query += " AND representative IS NULL"
+    if max_score is not None:
+        query += " AND score < ?"
+        values.append(max_score)
+    query += " ORDER BY score LIMIT ?"
+    values.append(n)
+    return connect(db_path).execute(query, values).fetchall()
+
+
+def run_scores(db_path, run_id):
+    """
+    {ligand: score} of every ligand of a run (None when Vina gave no energy)
+    """
+    return dict(connect(db_path).execute("SELECT ligand, score FROM scores WHERE run = ?", (run_id,)).fetchall())
+
+
+def latest_run(db_path, stage, with_poses=True):
+    """
+    Id of the last run of a stage (with published poses by default), None when there is none
+    """
+    if not os.path.exists(db_path):
+        return None
+    query = "SELECT id FROM runs WHERE stage = ?"
+    if with_poses:
+        query += " AND EXISTS (SELECT 1 FROM scores WHERE scores.run = runs.id AND pose IS NOT NULL)"
+    row = connect(db_path).execute(query + " ORDER BY id DESC LIMIT 1", (stage,)).fetchone()
+    return None if row is None else row[0]
+
+
+def final_candidates(db_path, stage="vina2"):
+    """
+    [(score, ligand, pose), ...] of the last run of a stage, existing poses only, best first
+    """
+    run_id = latest_run(db_path, stage)
+    if run_id is None:
+        return []
+    rows = connect(db_path).execute("SELECT score, ligand, pose FROM scores WHERE run = ? AND pose IS NOT NULL "
+                                    "ORDER BY score", (run_id,)).fetchall()
+    return [row for row in rows if os.path.exists(row[2])]
+
+
+def main():
+    program_description = "Show the scores stored by FrankVINA 1 and 2"
+    parser = argparse.ArgumentParser(description=program_description)
+    parser.add_argument("-i", "--initial_path", type=str, default=os.getcwd(),
+                        help="Absolute path to the main directory (containing FrankPEPstein_run)")
+    parser.add_argument("-s", "--stage", type=str, default="vina2", choices=STAGES, help="stage to rank")
+    parser.add_argument("-r", "--run", type=int, default=None, help="stage run id (default: the last one)")
+    parser.add_argument("-n", "--top", type=int, default=10, help="number of ligands to show")
+    args = parser.parse_args()
+
+    db_path = results_path(args.initial_path)
+    if not os.path.exists(db_path):
+        print(f"No results store in {db_path}")
+        sys.exit(1)
+    run_id = args.run or latest_run(db_path, args.stage, with_poses=False)
+    if run_id is None:
+        print(f"No {args.stage} runs in {db_path}")
+        sys.exit(1)
+    conn = connect(db_path)
+    folder, finished = conn.execute("SELECT folder, finished FROM runs WHERE id = ?", (run_id,)).fetchone()
+    scored, failed = conn.execute("SELECT COUNT(score), COUNT(*) - COUNT(score) FROM scores WHERE run = ?", (run_id,)).fetchone()
+    state = "finished" if finished else "running"
+    print(f"Run {run_id} ({args.stage}, {state}) in {folder}: {scored} scored, {failed} without energy")
+    print("AffinityBindingPred\tPEP\tpose")
+    for score, ligand, pose in top_scores(db_path, run_id, args.top):
+        print(f"{score}\t{ligand}\t{pose or ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import sys
 import argparse
 import subprocess
 import shutil
+from patches import FRAGMENTS_FILE, read_fragment_records
 
 def main():
     parser = argparse.ArgumentParser(description="Run FrankPEPstein Pipeline")
@@ -13,6 +14,12 @@ def main():
     parser.add_argument("-c", "--candidates", type=int, default=10, help="Number of candidates for Step 2")
     parser.add_argument("-s", "--sampling", type=int, default=500, help="Subsampling limit for Vina screening")
     parser.add_argument("-rmsd", "--rmsd_allowed", type=float, default=0.5, help="RMSD cutoff for superposer")
+    parser.add_argument("-ps", "--prescreen", type=float, default=1.0, help="Fraction of the minipocket DB aligned after prescreening (1.0 = exhaustive)")
+    parser.add_argument("-a", "--aligner", type=str, default="click", choices=["numpy", "click"], help="Superposer alignment backend (numpy: opt-in until it reaches parity with CLICK)")
+    parser.add_argument("--lazy", action="store_true", help="Keep superposer patches as lazy records, PDB files are written only when needed")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted superposer scan from its manifest")
+    parser.add_argument("--stream", action="store_true", help="Score patches with FrankVINA 1 while superposer is still scanning the DB")
+    parser.add_argument("--vina_share", type=float, default=0.25, help="Fraction of threads given to FrankVINA 1 in --stream mode")
     
     # Gridbox Parameters (Required for superposer)
     parser.add_argument("-xc", "--x_center", type=float, required=True, help="Resulting box center X")
@@ -54,6 +61,13 @@ def main():
     
     output_superposer_path = os.path.join(run_folder, f"superpockets_residuesAligned3_RMSD{args.rmsd_allowed}")
     
+    # Threads budget: both stages run at once in --stream mode
+    superposer_threads = threads
+    vina_threads = threads
+    if args.stream:
+        vina_threads = max(1, min(threads - 1, round(threads * args.vina_share)))
+        superposer_threads = max(1, threads - vina_threads)
+    
     # 1. Superposer
     print(f"--- Running Superposer ---")
     
@@ -64,7 +78,7 @@ def main():
         "-i", initial_path,
         "-T", "pocket.pdb", # Simply filename, we are in the dir
         "-d", db_folder,
-        "-t", str(threads),
+        "-t", str(superposer_threads),
         "-fm", minipockets_folder,
         "-x_center", str(args.x_center),
         "-y_center", str(args.y_center),
@@ -72,23 +86,53 @@ def main():
         "-x_size", str(args.x_size),
         "-y_size", str(args.y_size),
         "-z_size", str(args.z_size),
-        "-rmsd", str(args.rmsd_allowed)
+        "-rmsd", str(args.rmsd_allowed),
+        "-a", args.aligner,
+        "-ps", str(args.prescreen)
     ]
     
+    if args.resume:
+        superposer_cmd_list.append("--resume")
+    if args.lazy:
+        superposer_cmd_list.append("--lazy")
+    
     superposer_cmd_str = " ".join(superposer_cmd_list)
     print(f"CMD: {superposer_cmd_str}")
     
-    subprocess.run(superposer_cmd_list, check=True)
+    # FrankVINA 1 computes the receptor maps once over the superposer gridbox
+    vina1_gridbox = ["--center", str(args.x_center), str(args.y_center), str(args.z_center),
+                     "--size", str(args.x_size), str(args.y_size), str(args.z_size)]
+
+    if args.stream:
+        # Pipelined: superposer announces accepted patches on stdout, FrankVINA 1 scores them as they arrive
+        superposer_cmd_list.append("--stream")
+        os.makedirs(output_superposer_path, exist_ok=True)
+        shutil.copy(os.path.join(initial_path, "receptor.pdb"), output_superposer_path)
+        print(f"--- Streaming patches to FrankVINA 1 ({superposer_threads} superposer / {vina_threads} Vina threads) ---")
+        cmd_vina1 = [sys.executable, f'{repo_folder}/scripts/frankVINA_1.py', initial_path, str(vina_threads), "--stream"] + vina1_gridbox
+        print(f"CMD: {' '.join(superposer_cmd_list)} | {' '.join(cmd_vina1)}")
+        superposer_proc = subprocess.Popen(superposer_cmd_list, stdout=subprocess.PIPE)
+        vina1_proc = subprocess.Popen(cmd_vina1, stdin=superposer_proc.stdout, cwd=output_superposer_path)
+        superposer_proc.stdout.close() # FrankVINA 1 owns the read end of the pipe
+        vina1_code = vina1_proc.wait()
+        superposer_code = superposer_proc.wait()
+        if superposer_code != 0:
+            raise subprocess.CalledProcessError(superposer_code, superposer_cmd_list)
+        if vina1_code != 0:
+            raise subprocess.CalledProcessError(vina1_code, cmd_vina1)
+    else:
+        subprocess.run(superposer_cmd_list, check=True)
 
     # 2. FrankVINA 1
     if os.path.exists(output_superposer_path):
         os.chdir(output_superposer_path)
-        shutil.copy(os.path.join(initial_path, "receptor.pdb"), ".") # Replaced os.system('cp ...') with shutil.copy
-        
-        print(f"--- Running FrankVINA 1 ---")
-        cmd_vina1 = [sys.executable, f'{repo_folder}/scripts/frankVINA_1.py', initial_path, str(threads)]
-        print(f"CMD: {' '.join(cmd_vina1)}")
-        subprocess.run(cmd_vina1, check=True)
+        if not args.stream:
+            shutil.copy(os.path.join(initial_path, "receptor.pdb"), ".") # Replaced os.system('cp ...') with shutil.copy
+            
+            print(f"--- Running FrankVINA 1 ---")
+            cmd_vina1 = [sys.executable, f'{repo_folder}/scripts/frankVINA_1.py', initial_path, str(threads)] + vina1_gridbox
+            print(f"CMD: {' '.join(cmd_vina1)}")
+            subprocess.run(cmd_vina1, check=True)
         
         # os.system("rm * 2> /dev/null") # Cleanup (careful, this might delete logs/pdbs if script failed, but following original logic)
         # Replaced with subprocess.run
@@ -97,6 +141,7 @@ def main():
         # 3. Patch Clustering & FrankVINA 2
         print(f"--- Checking for patches ---")
         patch_files = [x for x in os.listdir(".") if "patch_file" in x]
+        patch_files += [x for x in read_fragment_records(FRAGMENTS_FILE) if x not in patch_files] # Lazy patches
         
         if len(patch_files) == 0:
             print("No patch files in folder")
@@ -133,6 +178,8 @@ def main():
            
            print("Moving patch files to 'all_patches_found'...")
            os.system(f"mv patch_file_*.pdb {all_patches_dir} 2> /dev/null")
+           if os.path.exists(FRAGMENTS_FILE):
+               shutil.copy(FRAGMENTS_FILE, all_patches_dir) # Lazy patches: patches.py -f writes their PDB files
 
     else:
         print(f"Error: {output_superposer_path} not found.")
@@ -0,0 +1,93 @@
+import os
+import json
+import glob
+
+# Append-only record of a superposer scan, one JSON object per line:
+#   {"type": "header", "format": ..., "params": {...}}
+#   {"minipocket": "minipocket_....pdb", "status": "rejected_alignment", "output": null}
+#   {"minipocket": "minipocket_....pdb", "status": "accepted", "output": ".../patch_file_....pdb"}
+# Only the parent process writes it, one flushed batch per finished chunk.
+MANIFEST_FORMAT = "frankpepstein-scan-manifest"
+MANIFEST_VERSION = 1
+MANIFEST_FILE = "scan_manifest.jsonl"
+
+
+def read_manifest(manifest_file):
+    """
+    Header params and {minipocket: (status, output)}. A truncated last line
+    (crash while appending) is ignored.
+    """
+    params, entries = None, {}
+    with open(manifest_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("type") == "header":
+                if record.get("format") == MANIFEST_FORMAT and record.get("version") == MANIFEST_VERSION:
+                    params = record.get("params")
+            elif "minipocket" in record:
+                entries[record["minipocket"]] = (record["status"], record.get("output"))
+    return params, entries
+
+
+class ScanManifest:
+    """
+    Checkpoint of a scan. With resume=True, entries of a previous run with the
+    same params are loaded into self.completed and are not scanned again;
+    self.resumed tells whether the outputs of that run can be kept.
+    """
+
+    def __init__(self, manifest_file, params, resume=False):
+        self.manifest_file = manifest_file
+        self.params = params
+        self.completed = {}
+        self.resumed = False
+        if resume and os.path.exists(manifest_file):
+            old_params, entries = read_manifest(manifest_file)
+            if old_params == params:
+                self.completed = entries
+                self.resumed = True
+            else:
+                print(f"DEBUG: {manifest_file} was written with other parameters, starting a new scan")
+        if self.completed:
+            self._file = open(manifest_file, "a")
+            self._file.write("\n") # Terminates a possibly truncated last line
+        else:
+            self._file = open(manifest_file, "w")
+            self._append([{"type": "header", "format": MANIFEST_FORMAT,
+                           "version": MANIFEST_VERSION, "params": params}])
+
+    def reconcile(self, output_folder, lazy_patches=()):
+        """
+        Drops errors and accepted entries whose patch file is missing (and not
+        kept as a lazy record), and removes partially written outputs (*.tmp),
+        so that those minipockets are scanned again
+        """
+        for tmp_file in glob.glob(os.path.join(output_folder, "*.tmp")):
+            os.remove(tmp_file)
+        def has_output(output):
+            return bool(output) and (os.path.exists(output) or os.path.basename(output) in lazy_patches)
+
+        missing = [file for file, (status, output) in self.completed.items()
+                   if status == "error" or (status == "accepted" and not has_output(output))]
+        for file in missing:
+            del self.completed[file]
+        return len(missing)
+
+    def _append(self, records):
+        for record in records:
+            self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, results):
+        """
+        Appends finished (minipocket, status, output) results
+        """
+        self._append([{"minipocket": file, "status": status, "output": output}
+                      for file, status, output in results])
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import fnmatch
+from collections import namedtuple
+from contextlib import contextmanager
+import numpy as np
+
+from minipocket_db import parse_minipocket_name
+
+# Cost model of one minipocket task (arbitrary units): alignment grows with the
+# pocket size, fragment extraction and clash checks with the patch length.
+ATOM_COST = 1.0
+PATCH_RESIDUE_COST = 20.0
+PDB_LINE_BYTES = 81
+# Chunk sizing: guided self-scheduling, chunks shrink as the remaining work
+# does, never below total / (workers * CHUNKS_PER_WORKER)
+GUIDED_FACTOR = 4
+CHUNKS_PER_WORKER = 16
+
+Chunk = namedtuple("Chunk", ["chunk_id", "files", "cost"])
+
+REPORT_COLUMNS = ["chunk", "worker", "n_minipockets", "est_cost", "seconds",
+                  "minipockets_per_s", "cost_per_s"]
+# Phases of a minipocket task timed with --timings_out: minipocket loading
+# (copy), alignment, DB fragment parsing, clash/gridbox filters, patch writing
+PHASES = ["copy", "align", "parse", "clash", "save"]
+TIMINGS_FORMAT = "frankpepstein-scan-timings"
+TIMINGS_VERSION = 1
+
+
+def scan_entries(files):
+    """
+    Minipocket files only: other directory entries never become tasks
+    """
+    return [file for file in files if fnmatch.fnmatch(file, "minipocket_*.pdb")]
+
+
+def estimate_costs(files, store=None, folder_minipockets=None):
+    """
+    Estimated cost of each minipocket, from store atom counts or PDB file sizes
+    """
+    if store is not None:
+        sizes = np.diff(np.asarray(store.offsets))
+        n_atoms = np.array([sizes[store.index_of(file)] for file in files], dtype=np.float64)
+    else:
+        n_atoms = np.array([os.path.getsize(os.path.join(folder_minipockets, file)) / PDB_LINE_BYTES
+                            for file in files], dtype=np.float64)
+    patch_length = np.array([len(parse_minipocket_name(file)[3].split("-")) for file in files],
+                            dtype=np.float64)
+    return ATOM_COST * n_atoms + PATCH_RESIDUE_COST * patch_length
+
+
+def make_chunks(files, costs, n_workers, chunk_cost=None):
+    """
+    Packs minipockets into chunks, most expensive first, so that big tasks start
+    early and the small ones fill the tail. With chunk_cost every chunk targets
+    that cost, otherwise chunk sizes follow guided self-scheduling.
+    """
+    costs = np.asarray(costs, dtype=np.float64)
+    n_workers = max(1, n_workers)
+    remaining = float(costs.sum())
+    floor = chunk_cost or max(remaining / (n_workers * CHUNKS_PER_WORKER), 1.0)
+
+    def next_target():
+        if chunk_cost:
+            return chunk_cost
+        return max(floor, remaining / (GUIDED_FACTOR * n_workers))
+
+    chunks, current, current_cost = [], [], 0.0
+    target = next_target()
+    for i in np.argsort(-costs, kind="stable"):
+        current.append(files[i])
+        current_cost += costs[i]
+        if current_cost >= target:
+            chunks.append(Chunk(len(chunks), current, current_cost))
+            remaining -= current_cost
+            current, current_cost = [], 0.0
+            target = next_target()
+    if current:
+        chunks.append(Chunk(len(chunks), current, current_cost))
+    return chunks
+
+
+def chunk_row(chunk, seconds, worker):
+    """
+    Throughput of one finished chunk, as written to the chunk report
+    """
+    seconds = max(seconds, 1e-9)
+    return {
+        "chunk": chunk.chunk_id,
+        "worker": worker,
+        "n_minipockets": len(chunk.files),
+        "est_cost": round(chunk.cost, 1),
+        "seconds": round(seconds, 4),
+        "minipockets_per_s": round(len(chunk.files) / seconds, 2),
+        "cost_per_s": round(chunk.cost / seconds, 1),
+    }
+
+
+def write_chunk_report(report_file, rows):
+    with open(report_file, "w") as f:
+        f.write("\t".join(REPORT_COLUMNS) + "\n")
+        for row in sorted(rows, key=lambda row: row["chunk"]):
+            f.write("\t".join(str(row[column]) for column in REPORT_COLUMNS) + "\n")
+
+
+def summarize(rows, wall_seconds):
+    """
+    One-line summary: overall throughput and spread between chunks
+    """
+    if not rows:
+        return "no chunks"
+    n_minipockets = sum(row["n_minipockets"] for row in rows)
+    rates = np.array([row["cost_per_s"] for row in rows])
+    busy = sum(row["seconds"] for row in rows)
+    return (f"{len(rows)} chunks, {n_minipockets / max(wall_seconds, 1e-9):.1f} minipockets/s, "
+            f"cost/s per chunk p10={np.percentile(rates, 10):.0f} p50={np.percentile(rates, 50):.0f} "
+            f"p90={np.percentile(rates, 90):.0f}, worker busy time {busy:.1f}s over {wall_seconds:.1f}s wall")
+
+
+class PhaseTimer:
+    """
+    Worker-side seconds per phase. Disabled timers cost one attribute check.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+    def pop(self):
+        """
+        Seconds since the last pop (one chunk), then starts over
+        """
+        seconds, self.seconds = self.seconds, dict.fromkeys(PHASES, 0.0)
+        return seconds
+
+
+def write_timings(timings_file, rows, phase_seconds, wall_seconds, peak_rss_kb, extra=None):
+    """
+    JSON summary of a timed scan: throughput, summed worker seconds per phase
+    and peak resident memory (kB, parent and largest worker)
+    """
+    n_minipockets = sum(row["n_minipockets"] for row in rows)
+    busy = sum(row["seconds"] for row in rows)
+    phases = {phase: round(sum(seconds[phase] for seconds in phase_seconds), 4) for phase in PHASES}
+    timings = {"format": TIMINGS_FORMAT, "version": TIMINGS_VERSION,
+               "n_minipockets": n_minipockets, "n_chunks": len(rows),
+               "wall_seconds": round(wall_seconds, 4), "worker_seconds": round(busy, 4),
+               "minipockets_per_s": round(n_minipockets / max(wall_seconds, 1e-9), 2),
+               "phase_seconds": phases,
+               "phase_fraction": {phase: round(seconds / max(busy, 1e-9), 4) for phase, seconds in phases.items()},
+               "peak_rss_kb": peak_rss_kb, **(extra or {})}
+    with open(timings_file, "w") as f:
+        json.dump(timings, f, indent=4)
+    return timings
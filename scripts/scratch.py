@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+# Scratch space for per-task sandboxes: RAM-backed /dev/shm when usable,
+# overridable with FRANKPEPSTEIN_SCRATCH or an explicit root.
+SCRATCH_ENV = "FRANKPEPSTEIN_SCRATCH"
+SHM_DIR = "/dev/shm"
+
+
+def default_scratch_root():
+    root = os.environ.get(SCRATCH_ENV)
+    if root:
+        return root
+    if os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK):
+        return SHM_DIR
+    return tempfile.gettempdir()
+
+
+@contextmanager
+def scratch_dir(prefix="frankpepstein_", root=None):
+    """
+    Private directory for one task, removed on exit (also on errors)
+    """
+    root = root or default_scratch_root()
+    os.makedirs(root, exist_ok=True)
+    path = tempfile.mkdtemp(prefix=prefix, dir=root)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def link_into(src, sandbox, name=None):
+    """
+    Exposes src inside a sandbox without copying it (falls back to a copy
+    when symlinks are not supported by the filesystem)
+    """
+    dst = os.path.join(sandbox, name or os.path.basename(src))
+    try:
+        os.symlink(os.path.abspath(src), dst)
+    except OSError:
+        shutil.copy(src, dst)
+    return dst
@@ -172,6 +172,34 @@ def main():
         else:
             log("⚠️ Modeller configuration threw an error (maybe env not ready?). Check manually.", YELLOW)
 
+    # 6. Pack minipocket DB into a memory-mapped store (one-time, read by superposer.py)
+    minipockets_dir = os.path.join(repo_root, "DB", "minipockets_surface80_winsize3_size3")
+    if os.path.exists(minipockets_dir) and not os.path.exists(minipockets_dir + ".store"):
+        log("Packing minipocket DB...", GREEN)
+        pack_script = os.path.join(repo_root, "scripts", "minipocket_db.py")
+        ret = subprocess.run(f"{conda_cmd} run -n {env_name} python {pack_script} -fm {minipockets_dir}", shell=True)
+        if ret.returncode == 0:
+            log("✅ Minipocket store created.", GREEN)
+        else:
+            log("⚠️ Could not pack minipocket DB; superposer will read the PDB folder instead.", YELLOW)
+    if os.path.exists(minipockets_dir) and not os.path.exists(minipockets_dir + ".index"):
+        log("Indexing minipocket DB for prescreening...", GREEN)
+        index_script = os.path.join(repo_root, "scripts", "minipocket_index.py")
+        ret = subprocess.run(f"{conda_cmd} run -n {env_name} python {index_script} -fm {minipockets_dir}", shell=True)
+        if ret.returncode != 0:
+            log("⚠️ Could not index minipocket DB; --prescreen will be ignored.", YELLOW)
+
+    # 7. Pre-extract DB peptide chains (one parse per complex, ever)
+    pepbdb_dir = os.path.join(repo_root, "DB", "filtered_DB_P5-15_R30_id10")
+    if os.path.exists(pepbdb_dir) and not os.path.exists(pepbdb_dir + ".peptides"):
+        log("Extracting DB peptide chains...", GREEN)
+        index_script = os.path.join(repo_root, "scripts", "complex_cache.py")
+        ret = subprocess.run(f"{conda_cmd} run -n {env_name} python {index_script} -d {pepbdb_dir}", shell=True)
+        if ret.returncode == 0:
+            log("✅ Peptide index created.", GREEN)
+        else:
+            log("⚠️ Could not build peptide index; superposer will parse peptide_complex.pdb files instead.", YELLOW)
+
     log(f"\n{'='*30}", GREEN)
     log("✅ Setup Finished!, please ignore crash warnings", GREEN)
     log(f"To run the pipeline:", GREEN)
@@ -9,12 +9,28 @@ import Bio.PDB
 pdbio = Bio.PDB.PDBIO()
 parser = Bio.PDB.MMCIFParser()
 import glob
+import json
 import warnings
 from joblib import Parallel, delayed
 import numpy as np
 import argparse
-import numpy as np
-import argparse
+import atexit
+import hashlib
+import resource
+import time
+from aligner import ALIGNERS, accepts, get_aligner, load_pocket_coords
+from minipocket_db import default_store_path, fresh_store, open_store, parse_minipocket_name
+from complex_cache import get_complex_cache
+from pdb_arrays import residue_keys
+from patches import (FRAGMENTS_FILE, append_fragment_records, fragment_record, move_fragment,
+                     patch_file_name, patch_passes, read_fragment_records, write_patch)
+from hit_table import HIT_TABLE_DIR, HitTableWriter
+from target_pocket import ScanTarget, attach_target, publish_target, read_targets
+from scan_manifest import MANIFEST_FILE, ScanManifest
+from scan_scheduler import (PhaseTimer, chunk_row, estimate_costs, make_chunks, scan_entries, summarize,
+                            write_chunk_report, write_timings)
+from scratch import default_scratch_root, scratch_dir
+from minipocket_index import default_index_path, open_index, recall_report
 
 program_description = "Select and generate fragment of peptides that could eventually bind to target receptor based on minipocket alignments"
 parser = argparse.ArgumentParser(description=program_description)
@@ -24,31 +40,71 @@ parser.add_argument("-i", "--initial_path", type=str,
                     help="Absolute path to the main directory (containing DB, utilities, etc.)", required=True)
 
 parser.add_argument("-T", "--target_receptor", type=str,
-                    help="target receptor to be scanned for posibles fragments of peptides to bind, MUST be on the same folder", required=True)
+                    help="target receptor to be scanned for posibles fragments of peptides to bind, MUST be on the same folder")
 parser.add_argument("-d", "--pepbdb_folder", type=str,
                     help="absolute path to database folder", required=True)
 parser.add_argument("-x_center", "--x_center", type=float,
-                    help="x coordinate of center for gridbox", required=True)
+                    help="x coordinate of center for gridbox")
 parser.add_argument("-y_center", "--y_center", type=float,
-                    help="y coordinate of center for gridbox", required=True)
+                    help="y coordinate of center for gridbox")
 parser.add_argument("-z_center", "--z_center", type=float,
-                    help="z coordinate of center for gridbox", required=True)
+                    help="z coordinate of center for gridbox")
 
 parser.add_argument("-x_size", "--x_size", type=float,
-                    help="x size for gridbox", required=True)
+                    help="x size for gridbox")
 parser.add_argument("-y_size", "--y_size", type=float,
-                    help="y size for gridbox", required=True)
+                    help="y size for gridbox")
 parser.add_argument("-z_size", "--z_size", type=float,
-                    help="z size for gridbox", required=True)
+                    help="z size for gridbox")
+
+parser.add_argument("--targets", type=str, default=None,
+                    help="JSON list of pockets scanned in a single pass over the DB, each with its gridbox "
+                         "({'name', 'pocket', 'center': [x, y, z], 'size': [x, y, z]}); replaces -T and the gridbox arguments")
 
 parser.add_argument("-t", "--threads", type=int,
                     help="Number of threads", required=True)
 parser.add_argument("-fm", "--folder_minipockets", type=str,
                     help="folder containing minipockets", required=True)
+parser.add_argument("-ms", "--minipocket_store", type=str, default=None,
+                    help="packed minipocket store built with minipocket_db.py (default: <folder_minipockets>.store if present)")
 parser.add_argument("-rmsd", "--rmsd_allowed", type=float, default=0.5,
                     help="RMSD cutoff for superposition")
+parser.add_argument("-a", "--aligner", type=str, default="click", choices=sorted(ALIGNERS),
+                    help="alignment backend: the 'click' binary, or the in-process 'numpy' engine "
+                         "(opt-in until aligner.py reports parity with CLICK)")
+
+parser.add_argument("--scratch_dir", type=str, default=None,
+                    help="root for per-task scratch sandboxes (default: $FRANKPEPSTEIN_SCRATCH, /dev/shm or the system temp dir)")
+parser.add_argument("-ps", "--prescreen", type=float, default=1.0,
+                    help="fraction of the minipocket DB to align, ranked by the prescreening index (1.0 = exhaustive)")
+parser.add_argument("--prescreen_index", type=str, default=None,
+                    help="index built with minipocket_index.py (default: <folder_minipockets>.index)")
+parser.add_argument("--prescreen_report", action="store_true",
+                    help="scan the whole DB anyway and report the prescreen recall in prescreen_report.json")
+parser.add_argument("--chunk_cost", type=float, default=None,
+                    help="estimated cost per scheduled chunk of minipockets (default: guided chunk sizes from the DB and thread count)")
+parser.add_argument("--chunk_report", type=str, default=None,
+                    help="write per-chunk throughput (TSV) to this file")
+parser.add_argument("--timings_out", type=str, default=None,
+                    help="write throughput, per-phase seconds and peak memory (JSON) to this file")
+parser.add_argument("--resume", action="store_true",
+                    help="continue an interrupted scan from its manifest (scan_manifest.jsonl in the output folder)")
+parser.add_argument("--entries_file", type=str, default=None,
+                    help="scan only the minipockets listed in this file (one file name per line), e.g. a shard of distributed_superposer.py")
+parser.add_argument("--exclude_from", type=str, default=None,
+                    help="path whose PDB ids are excluded from the scan (default: the current directory)")
+parser.add_argument("--stream", action="store_true",
+                    help="announce every accepted patch on stdout ('PATCH<tab><path>') as soon as it is written, for frankVINA_1.py --stream")
+parser.add_argument("--lazy", action="store_true",
+                    help=f"keep accepted patches as (complex, residues, transform) records in {FRAGMENTS_FILE} instead of writing PDB files "
+                         "(announced as 'FRAGMENT<tab><json>' with --stream)")
 
 args = parser.parse_args()
+gridbox_args = [args.x_center, args.y_center, args.z_center, args.x_size, args.y_size, args.z_size]
+if args.targets is None and (args.target_receptor is None or None in gridbox_args):
+    parser.error("-T and the six gridbox arguments are required unless --targets is given")
+if args.targets is not None and args.stream:
+    parser.error("--stream hands patches of a single pocket to frankVINA_1.py, it cannot be combined with --targets")
 
 # --- [ADDED] Path Configuration ---
 initial_path = args.initial_path
@@ -63,260 +119,281 @@ print(f"DEBUG: Using CLICK_PATH={CLICK_PATH}")
 print(f"DEBUG: Using PARAMETERS_INP_PATH={PARAMETERS_INP_PATH}")
 # ----------------------------------
 
-fau_file = args.target_receptor
 pepbdb_folder = args.pepbdb_folder
 cutoff = 3
 threads = args.threads
 folder_minipockets = args.folder_minipockets
 RMSD_allowed = args.rmsd_allowed
-x_center = args.x_center
-y_center = args.y_center
-z_center = args.z_center
-x_size = args.x_size
-y_size = args.y_size
-z_size = args.z_size
 
-folder_temp = (f"temp_folder_residuesAligned{cutoff}_RMSD{RMSD_allowed}")
-if not os.path.exists(folder_temp):
-    os.makedirs(folder_temp)
+# Per-task sandboxes (only needed by file-based aligners) live under the scratch root
+scratch_root = args.scratch_dir or default_scratch_root()
 
 folder_output = (f"superpockets_residuesAligned{cutoff}_RMSD{RMSD_allowed}")
-if not os.path.exists(folder_output):
-    os.makedirs(folder_output)
 
 working_directory = os.getcwd()
+# DB entries of the target's own PDB (found in the run path) are not used
+exclude_path = args.exclude_from or working_directory
+
+# Target pockets: -T with its gridbox, or every pocket of --targets routed to {name}/{folder_output}
+if args.targets is None:
+    target_specs = [(None, args.target_receptor, (args.x_center, args.y_center, args.z_center),
+                     (args.x_size, args.y_size, args.z_size))]
+else:
+    target_specs = read_targets(args.targets)
+    print(f"DEBUG: Scanning {len(target_specs)} target pockets in a single pass")
+
+# Each pocket is parsed and featurized once, then shared with the workers (zero-copy)
+targets = []
+target_files = []
+for name, fau_file, box_center, box_size in target_specs:
+    shared_target = publish_target(os.path.abspath(fau_file))
+    atexit.register(shared_target.close)
+    output_folder = os.path.join(working_directory, folder_output if name is None else os.path.join(name, folder_output))
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    targets.append(ScanTarget(name or shared_target.handle.name, shared_target.handle,
+                              box_center, box_size, output_folder))
+    target_files.append(fau_file)
 
-# Copy Target to Temp
-os.system(f'cp {fau_file} {folder_temp}')
-# Copy Parameters (using configured path)
-os.system(f"cp {PARAMETERS_INP_PATH} {folder_temp}")
+# Packed minipocket DB (memory-mapped, shared page cache across workers) when available and up to date
+minipocket_store_path = fresh_store(args.minipocket_store or default_store_path(folder_minipockets), folder_minipockets)
+if minipocket_store_path is not None:
+    print(f"DEBUG: Using minipocket store {minipocket_store_path} ({len(open_store(minipocket_store_path))} minipockets)")
+
+def load_minipocket(file):
+    """
+    Minipocket CA coordinates from the store, or from its PDB file
+    """
+    if minipocket_store_path is None:
+        return load_pocket_coords(folder_minipockets + "/" + file)
+    return open_store(minipocket_store_path).pocket_coords(file)
+
+def align_minipocket(file, minipocket):
+    """
+    Alignments of one minipocket onto every target pocket
+    """
+    target_pockets = [attach_target(target.handle) for target in targets]
+    if minipocket.path is not None or aligner.name != "click":
+        return aligner.align_many(minipocket, target_pockets)
+    # File-based backend: materialize the stored minipocket in a private sandbox
+    with scratch_dir(prefix="minipocket_", root=scratch_root) as sandbox:
+        minipocket_file = open_store(minipocket_store_path).write_pdb(file, os.path.join(sandbox, file))
+        return aligner.align_many(minipocket._replace(path=minipocket_file), target_pockets)
+
+aligner = get_aligner(args.aligner, click_path=CLICK_PATH,
+                      parameters_path=PARAMETERS_INP_PATH,
+                      scratch_root=scratch_root)
+print(f"DEBUG: Using aligner={aligner.name}")
+if aligner.name == "click":
+    print(f"DEBUG: Using scratch_root={scratch_root}")
+# Per-phase worker timings, only collected with --timings_out
+phase_timer = PhaseTimer(enabled=args.timings_out is not None)
+
+def place_patch(file, target, alignment, fragment):
+    """
+    Moves the patch onto one target pocket and writes it if it passes the filters
+    """
+    # Every patch residue must stay >= 1.8 A from the pocket and keep its CA inside the gridbox
+    with phase_timer.phase("clash"):
+        coords = move_fragment(fragment, alignment.rotation, alignment.translation)
+        passes = patch_passes(fragment, coords, attach_target(target.handle).tree, target.box_center, target.box_size)
+    if passes:
+        if args.lazy: # Recorded by the parent, PDB text is written on demand downstream
+            return file, "accepted", patch_file_name(fragment, target.output_folder), alignment
+        with phase_timer.phase("save"):
+            return file, "accepted", write_patch(fragment, coords, target.output_folder), alignment
+    return file, "rejected_filter", None, alignment
 
 def run_click(file):
+    """
+    Aligns one minipocket against every target pocket and writes the patches
+    that pass all filters. Returns one (file, status, patch file or None,
+    alignment or None) per target.
+    """
     try:
         warnings.simplefilter('ignore')
 
-        class SelectFragOnly(Select):
-            """
-            Select pocket residues only
-            """
-
-            def accept_residue(self, residue):
-                if (residue in fragment):
-                    return True  # Accept residue
-                else:
-                    return False  # Discard residue
-
-        class SelectFragOnly2(Select):
-            """
-            Select pocket residues only
-            """
-
-            def accept_residue(self, residue):
-                if (residue in new_peptide):
-                    return True  # Accept residue
-                else:
-                    return False  # Discard residue
-
-        if fnmatch.fnmatch(file, 'minipocket_*.pdb'):
-            folder_file = folder_minipockets + "/" + file
-            folder = "_".join(file.split("_")[1:4])
-            # print(folder.split("_")[0], working_directory)
-            if folder.split("_")[0] not in working_directory:
-                peptide_chain = folder.split("_")[-1]
-                Faufile_noExtension = fau_file.replace(".pdb", "")
-                file_noExtension = file.replace(".pdb", "")
-                patch = file_noExtension.split("_")[-1].split("-")
-                patch_length = len(patch)
-                log_file1 = (f"{file_noExtension}-{Faufile_noExtension}.pdb.1.clique")
-                out_file1 = (f"{file_noExtension}-{Faufile_noExtension}.1.pdb")
-                sup_needed1 = (f"{Faufile_noExtension}-{file_noExtension}.1.pdb")
-                # print("-------", folder, peptide_chain, patch, patch_length, "-------")
-                os.system(f"cp {folder_file} .")
-                
-                # [MODIFIED] Use explicit CLICK_PATH
-                cmd = (f"{CLICK_PATH} {file} {Faufile_noExtension}.pdb 1> /dev/null 2> /dev/null")
-                os.system(cmd)
-                
-                pass_criteria = 0
-                if os.path.exists(log_file1):
-                    with open(log_file1) as f:
-                        for line in f.readlines():
-                            try:
-                                line = line.strip()
-                                if "Overlap" in line:
-                                    overlap = float(
-                                        line.split("=")[1].split(" ")[-1])
-                                    if overlap < 100:
-                                            os.system(f'rm {log_file1} {out_file1} {sup_needed1} {file} 2> /dev/null')
-                                            break
-                                    if overlap >= 100:
-                                        pass_criteria += 1
-                                if "RMSD" in line:
-                                    RMSD_score = float(line.split("=")[1].split(" ")[-1])
-                                    if RMSD_score > RMSD_allowed:
-                                        os.system(f'rm {log_file1} {out_file1} {sup_needed1} {file} 2> /dev/null')
-                                        break
-                                    if RMSD_score <= RMSD_allowed:
-                                        pass_criteria += 1
-                                if "The number of matched atoms" in line:
-                                    matched_Ca = float(line.split("=")[1].split(" ")[-1])
-                                    if matched_Ca < cutoff:
-                                        os.system(f'rm {log_file1} {out_file1} {sup_needed1} {file} 2> /dev/null')
-                                        break
-                                    if matched_Ca >= cutoff:
-                                        pass_criteria += 1
-                            except:
-                                pass
-
-            if pass_criteria >= 3:
-                try:
-                    name_outfile1_supneeded1 = f'merge_{sup_needed1.replace(".1.pdb", "")}'
-                    os.system(f"sed -i '/END/d' {out_file1}")
-                    os.system(f'cat {out_file1} {sup_needed1} > {name_outfile1_supneeded1}.pdb')
-                    
-                    # [MODIFIED] Use explicit CLICK_PATH
-                    cmd = (f"{CLICK_PATH} {name_outfile1_supneeded1}.pdb {file} 1> /dev/null 2> /dev/null")
-                    os.system(cmd)
-                    
-                    log_file_tmp = (f"{name_outfile1_supneeded1}-{file_noExtension}.pdb.1.clique")
-                    out_file1_tmp = (f"{file_noExtension}-{name_outfile1_supneeded1}.1.pdb")
-                    sup_needed1_tmp = (f"{name_outfile1_supneeded1}-{file_noExtension}.1.pdb")
-                    os.system(f"cat {sup_needed1_tmp} | grep ' p' > {sup_needed1}")
-                    os.system(f'rm {log_file1} {out_file1_tmp} {log_file_tmp} {out_file1} {sup_needed1_tmp} {name_outfile1_supneeded1}.pdb 2> /dev/null')
-                except:
-                    pass
-
-                complex_file = (f"{pepbdb_folder}/{folder}/peptide_complex.pdb")
-                # print("complex_file", complex_file)
-                if not os.path.exists(complex_file):
-                    return # Skip this minipocket if DB entry is missing
-                
-                fragment = []
-                allowed_coord_X_s = x_center - (x_size/2)
-                allowed_coord_X_e = x_center + (x_size/2)
-                allowed_coord_Y_s = y_center - (y_size/2)
-                allowed_coord_Y_e = y_center + (y_size/2)
-                allowed_coord_Z_s = z_center - (z_size/2)
-                allowed_coord_Z_e = z_center + (z_size/2)
-
-                for res in patch:
-                    res_id = res[3:]
-                    res_name = res[:3]
-                    try:
-                        parser = PDBParser() # Re-instantiate to avoid concurrency issues?
-                        structure = parser.get_structure(file, complex_file)
-                        io = PDBIO()
-                        io.set_structure(structure)
-                        for model in structure:
-                            for chain in model:
-                                if chain.get_id() == peptide_chain:
-                                    chain.id = "x"
-                                    for residue in chain:
-                                        if str(residue.get_id()[1]) == res_id:
-                                            if str(residue.get_resname()) == res_name:
-                                                fragment.append(residue)
-                    except Exception as e:
-                        print(f"DEBUG: Error parsing complex file {complex_file}: {e}")
-                
-                if len(fragment) == patch_length:
-                    try:
-                        patch_file = (f'patch_file_{folder}_{"-".join(patch)}.pdb')
-                        io.save(patch_file, select=SelectFragOnly())
-                        minipocket_file_noExtension = file_noExtension
-                        os.system(f"sed -i '/END/d' {sup_needed1}")
-                        super_file = (f"super_{minipocket_file_noExtension}.pdb")
-                        cmd_merge_peptide_pocket = f"cat {sup_needed1} {patch_file} >> {super_file}"
-                        os.system(cmd_merge_peptide_pocket)
-                        
-                        # [MODIFIED] Use explicit CLICK_PATH
-                        cmd_super = (f'{CLICK_PATH} {super_file} {Faufile_noExtension}.pdb 1> /dev/null')
-                        os.system(cmd_super)
-                        
-                        out_file2 = (f'{Faufile_noExtension}-{super_file.replace(".pdb", "")}.1.pdb')
-                        sup_needed2 = (f'{super_file.replace(".pdb", "")}-{Faufile_noExtension}.1.pdb')
-                        log_file2 = (f'{super_file.replace(".pdb", "")}-{Faufile_noExtension}.pdb.1.clique')
-                        os.system(f"sed -i '/END/d' {sup_needed2}")
-                        os.system(f"rm {out_file2} {log_file2} {sup_needed1} {super_file} {patch_file} {file}")
-                    except:
-                        pass
-                    
-                    fragment = []
-                    pocket = []
-                    fragment_output_lumen = []
-                    try:
-                        parser = PDBParser()
-                        structure = parser.get_structure(
-                            sup_needed2.replace(".pdb", ""), sup_needed2)
-                        io = PDBIO()
-                        io.set_structure(structure)
-                        for model in structure:
-                            for chain in model:
-                                if chain.get_id() == "x":
-                                    for residue in chain:
-                                        fragment.append(residue)
-                                if chain.get_id() == "p":
-                                    for residue in chain:
-                                        pocket.append(residue)
-                    except Exception as e:
-                        print(f"DEBUG: Error loading final superposed file {sup_needed2}: {e}")
-
-                    try:
-                        os.system(f"rm {sup_needed2}")
-                    except:
-                        pass
-                    new_peptide = []
-                    for residue_pep in fragment:
-                        dist_pocket_list = []
-                        for residue_poc in pocket:
-                            for atoms_poc in residue_poc:
-                                for atoms_pep in residue_pep:
-                                    coord_res_pep = atoms_pep.get_coord()
-                                    coord_res_poc = atoms_poc.get_coord()
-                                    dist_pocket_pep = np.linalg.norm(
-                                        coord_res_pep - coord_res_poc)
-                                    dist_pocket_list.append(
-                                        dist_pocket_pep)
-                        dist_pocket_pass = [
-                            dist_pocket for dist_pocket in dist_pocket_list if dist_pocket >= 1.8]
-                        if len(dist_pocket_pass) == len(dist_pocket_list):  # DISTANCIA
-                            new_peptide.append(residue_pep)
-
-                    # Debug Distance Filter
-                    # if len(new_peptide) == 0:
-                         # print(f"DEBUG: {file} failed distance filter (Clash check).")
-
-                    for residue_pep2 in new_peptide:
-                        try:
-                            coord_res_pep = residue_pep2["CA"].get_coord()
-                            x_coord_res_pep = coord_res_pep[0]
-                            y_coord_res_pep = coord_res_pep[1]
-                            z_coord_res_pep = coord_res_pep[2]
-                            if x_coord_res_pep > allowed_coord_X_s and x_coord_res_pep < allowed_coord_X_e:
-                                if y_coord_res_pep > allowed_coord_Y_s and y_coord_res_pep < allowed_coord_Y_e:
-                                    if z_coord_res_pep > allowed_coord_Z_s and z_coord_res_pep < allowed_coord_Z_e:
-                                        res_nameid = residue_pep2.get_resname() + str(residue_pep2.get_id()[1])
-                                        fragment_output_lumen.append(res_nameid)
-                                    # else: print(f"DEBUG: Z out of bounds {z_coord_res_pep}")
-                                # else: print(f"DEBUG: Y out of bounds {y_coord_res_pep}")
-                            # else: print(f"DEBUG: X out of bounds {x_coord_res_pep}")
-                        except:
-                            pass
-                    fragment_output_lumen = set(fragment_output_lumen)
-                    error_lumen = len(fragment) - len(fragment_output_lumen)
-                    
-                    if error_lumen <= 0 and len(new_peptide) > 0:
-                        patch = [res.get_resname() + str(res.get_id()[1])
-                                for res in new_peptide]
-                        patch_file2 = ("../{out_folder}/patch_file_{patch}.pdb").format(
-                            out_folder=folder_output, patch="-".join(patch))
-                        
-                        io.save(patch_file2, select=SelectFragOnly2())
-
-    except:
-        pass
-
-os.chdir(folder_temp)
-Parallel(n_jobs=threads)(delayed(run_click)(file) for file in tqdm(os.listdir(folder_minipockets), total=len(
-    os.listdir(folder_minipockets)), desc="aligning minipockets to target_pocket and defining patches"))
-os.chdir("../")
-os.system("rm -r " + folder_temp)
+        if not fnmatch.fnmatch(file, 'minipocket_*.pdb'):
+            return [(file, "skipped", None, None)] * len(targets)
+        file_noExtension, folder, peptide_chain, patch = parse_minipocket_name(file)
+        if folder.split("_")[0] in exclude_path:
+            return [(file, "skipped", None, None)] * len(targets)
+        patch = patch.split("-")
+        patch_length = len(patch)
+
+        # Minipocket -> target pockets alignment (overlap, RMSD and matched atoms criteria)
+        with phase_timer.phase("copy"):
+            minipocket = load_minipocket(file)
+        with phase_timer.phase("align"):
+            alignments = align_minipocket(file, minipocket)
+        results = []
+        fragment = None
+        for target, alignment in zip(targets, alignments):
+            if alignment is None:
+                results.append((file, "no_alignment", None, None))
+                continue
+            if not accepts(alignment, RMSD_allowed, cutoff):
+                results.append((file, "rejected_alignment", None, alignment))
+                continue
+
+            # Patch residues of the DB peptide (cached per worker), read once for all targets
+            if fragment is None:
+                with phase_timer.phase("parse"):
+                    fragment = get_complex_cache(pepbdb_folder).fragment(folder, peptide_chain, patch)
+            if fragment is None:
+                results.append((file, "missing_complex", None, alignment)) # Skip this minipocket if DB entry is missing
+                continue
+            if len(set(residue_keys(fragment))) != patch_length:
+                results.append((file, "missing_residues", None, alignment))
+                continue
+            try:
+                results.append(place_patch(file, target, alignment, fragment))
+            except Exception as e:
+                print(f"DEBUG: Could not place patch of {file} on {target.output_folder}: {e!r}")
+                results.append((file, "error", None, alignment))
+        return results
+
+    except Exception as e:
+        print(f"DEBUG: Could not align {file}: {e!r}")
+        return [(file, "error", None, None)] * len(targets)
+
+def run_chunk(chunk):
+    """
+    Runs a chunk of minipockets in one task, timed for the throughput report
+    """
+    start = time.perf_counter()
+    results = [run_click(file) for file in chunk.files]
+    seconds = time.perf_counter() - start
+    return chunk, results, seconds, os.getpid(), phase_timer.pop(), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+if args.entries_file is not None:
+    with open(args.entries_file) as f:
+        minipocket_files = scan_entries([line.strip() for line in f if line.strip()])
+elif minipocket_store_path is not None:
+    minipocket_files = open_store(minipocket_store_path).files
+else:
+    minipocket_files = scan_entries(os.listdir(folder_minipockets))
+
+# Coarse-to-fine: only the best-ranked fraction of the DB goes through full alignment
+# (with several targets, the union of their selections)
+prescreened_files = None
+if args.prescreen < 1.0 or args.prescreen_report:
+    prescreen_index = open_index(args.prescreen_index or default_index_path(folder_minipockets), folder_minipockets)
+    if prescreen_index is not None:
+        prescreened_files = [prescreen_index.select(attach_target(target.handle).atoms, args.prescreen)
+                             for target in targets]
+        selected = set().union(*prescreened_files)
+        print(f"DEBUG: Prescreen kept {len(selected)}/{len(prescreen_index)} minipockets")
+        if not args.prescreen_report:
+            minipocket_files = [file for file in minipocket_files if file in selected]
+
+# Checkpoint manifests (one per target): a restarted scan (--resume) skips everything already recorded.
+# Hit tables keep every alignment (metrics and transform) for refilter_hits.py.
+manifests = []
+hit_tables = []
+for target, fau_file in zip(targets, target_files):
+    with open(fau_file, "rb") as f:
+        target_sha1 = hashlib.sha1(f.read()).hexdigest()
+    scan_params = {"target_sha1": target_sha1, "pepbdb_folder": os.path.abspath(pepbdb_folder),
+                   "folder_minipockets": os.path.abspath(folder_minipockets), "rmsd_allowed": RMSD_allowed,
+                   "aligner": args.aligner, "gridbox": [*target.box_center, *target.box_size],
+                   "prescreen": args.prescreen, "prescreen_report": args.prescreen_report}
+    manifest = ScanManifest(os.path.join(target.output_folder, MANIFEST_FILE), scan_params, resume=args.resume)
+    manifests.append(manifest)
+    # Hits and lazy records of a scan with other parameters are dropped with its manifest
+    hit_tables.append(HitTableWriter(os.path.join(target.output_folder, HIT_TABLE_DIR), {
+        "target": os.path.abspath(fau_file), "gridbox": scan_params["gridbox"], "rmsd_allowed": RMSD_allowed,
+        "pepbdb_folder": scan_params["pepbdb_folder"], "aligner": args.aligner}, resume=manifest.resumed))
+outcomes = [{} for target in targets]
+fragment_files = [os.path.join(target.output_folder, FRAGMENTS_FILE) for target in targets]
+for manifest, fragments_file in zip(manifests, fragment_files):
+    if not manifest.resumed and os.path.exists(fragments_file):
+        os.remove(fragments_file)
+
+def announce(patch_file, record=None):
+    """
+    Hands an accepted patch (or its lazy record) to frankVINA_1.py --stream
+    """
+    if record is not None:
+        print(f"FRAGMENT\t{json.dumps(record)}", flush=True)
+    else:
+        print(f"PATCH\t{patch_file}", flush=True)
+
+if args.resume:
+    lazy_records = [read_fragment_records(fragments_file) for fragments_file in fragment_files]
+    n_redo = sum(manifest.reconcile(target.output_folder, records)
+                 for manifest, target, records in zip(manifests, targets, lazy_records))
+    done = [file for file in minipocket_files if all(file in manifest.completed for manifest in manifests)]
+    print(f"DEBUG: Resuming scan: {len(done)}/{len(minipocket_files)} minipockets already done, {n_redo} to redo")
+    for file in done:
+        for manifest, target_outcomes, records in zip(manifests, outcomes, lazy_records):
+            status, patch_file = manifest.completed[file]
+            target_outcomes[file] = status
+            if args.stream and patch_file is not None:
+                announce(patch_file, records.get(os.path.basename(patch_file)))
+    done = set(done)
+    minipocket_files = [file for file in minipocket_files if file not in done]
+
+# Cost-balanced chunks, largest first; idle workers pull the next chunk as soon as they finish
+chunks = make_chunks(minipocket_files, estimate_costs(
+    minipocket_files, open_store(minipocket_store_path) if minipocket_store_path else None,
+    folder_minipockets), threads, args.chunk_cost)
+print(f"DEBUG: Scheduled {len(minipocket_files)} minipockets in {len(chunks)} chunks")
+
+# Results come back as chunks finish, so accepted patches can be handed off immediately
+chunk_rows = []
+chunk_phases = []
+worker_rss = {}
+scan_start = time.perf_counter()
+results = Parallel(n_jobs=threads, batch_size=1, return_as="generator_unordered")(
+    delayed(run_chunk)(chunk) for chunk in chunks)
+with tqdm(total=len(minipocket_files), desc="aligning minipockets to target_pocket and defining patches") as progress:
+    for chunk, chunk_results, seconds, worker, phases, max_rss in results:
+        # chunk_results holds one list per minipocket with one result per target
+        for manifest, hit_table, fragments_file, target_outcomes, target_results in zip(
+                manifests, hit_tables, fragment_files, outcomes, zip(*chunk_results)):
+            # Hits and lazy records before the manifest: a recorded entry always has them
+            hit_table.add(target_results)
+            records = {}
+            if args.lazy:
+                records = {file: fragment_record(file, patch_file, os.path.abspath(pepbdb_folder), alignment)
+                           for file, status, patch_file, alignment in target_results if status == "accepted"}
+                append_fragment_records(fragments_file, list(records.values()))
+            manifest.record([result[:3] for result in target_results])
+            for file, status, patch_file, alignment in target_results:
+                target_outcomes[file] = status
+                if args.stream and patch_file is not None:
+                    announce(patch_file, records.get(file))
+        chunk_rows.append(chunk_row(chunk, seconds, worker))
+        chunk_phases.append(phases)
+        worker_rss[worker] = max(max_rss, worker_rss.get(worker, 0))
+        progress.update(len(chunk.files))
+for manifest, hit_table in zip(manifests, hit_tables):
+    manifest.close()
+    hit_table.close()
+scan_wall = time.perf_counter() - scan_start
+print(f"DEBUG: Scan: {summarize(chunk_rows, scan_wall)}")
+if args.timings_out:
+    peak_rss_kb = {"parent": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   "worker_max": max(worker_rss.values(), default=0),
+                   "workers_total": sum(worker_rss.values())}
+    statuses = {}
+    for target_outcomes in outcomes:
+        for status in target_outcomes.values():
+            statuses[status] = statuses.get(status, 0) + 1
+    write_timings(args.timings_out, chunk_rows, chunk_phases, scan_wall, peak_rss_kb,
+                  {"threads": threads, "aligner": aligner.name, "n_targets": len(targets), "statuses": statuses})
+if args.chunk_report:
+    write_chunk_report(args.chunk_report, chunk_rows)
+if len(targets) > 1:
+    for target, target_outcomes in zip(targets, outcomes):
+        n_accepted = len([status for status in target_outcomes.values() if status == "accepted"])
+        print(f"DEBUG: {target.name}: {n_accepted} patches in {target.output_folder}")
+
+if args.prescreen_report and prescreened_files is not None:
+    for target, target_selection, target_outcomes in zip(targets, prescreened_files, outcomes):
+        report = recall_report(target_selection, target_outcomes, args.prescreen)
+        with open(os.path.join(target.output_folder, "prescreen_report.json"), "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"Prescreen recall of {target.name} at {args.prescreen:.0%} of the DB: "
+              f"{report['alignment_hit_recall']:.3f} of alignment hits, {report['accepted_recall']:.3f} of accepted patches")
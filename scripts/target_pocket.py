@@ -0,0 +1,171 @@
+import os
+import json
+from collections import namedtuple
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+
+from pdb_arrays import read_pdb_atoms
+from geometry_filters import pocket_tree, pairwise_distances
+
+# The target pocket is parsed and featurized once by the parent process and its
+# arrays are packed into one shared memory block. Workers receive a TargetHandle
+# (a few hundred bytes) and map the arrays without copying them.
+# KD-trees cannot live in shared memory: each process builds its own, once.
+TARGET_FIELDS = ["coords", "atom_name", "res_name", "ca", "ca_distances"]
+ALIGNMENT = 64
+
+# Layout of one array inside the block: (field, dtype, shape, offset)
+TargetHandle = namedtuple("TargetHandle", ["shm_name", "name", "path", "fields"])
+
+# One pocket of a scan: published arrays, gridbox and the folder its patches go to
+ScanTarget = namedtuple("ScanTarget", ["name", "handle", "box_center", "box_size", "output_folder"])
+
+# Targets attached by this process, see attach_target()
+_attached = {}
+
+
+class TargetPocket:
+    """
+    Featurized target pocket. Duck-types aligner.PocketCoords (name, ca, path)
+    and adds all-atom arrays, CA distance matrix and a lazily built KD-tree.
+    """
+
+    def __init__(self, name, path, arrays, shm=None):
+        self.name = name
+        self.path = path
+        self.arrays = arrays
+        self.coords = arrays["coords"]
+        self.ca = arrays["ca"]
+        self.ca_distances = arrays["ca_distances"]
+        self._shm = shm # Keeps the mapping alive while the views are in use
+        self._tree = None
+
+    @property
+    def atoms(self):
+        """
+        Atom dict in the pdb_arrays layout (coords, atom_name, res_name)
+        """
+        return {field: self.arrays[field] for field in ("coords", "atom_name", "res_name")}
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            self._tree = pocket_tree(self.arrays["coords"])
+        return self._tree
+
+
+def featurize_target(pdb_file, name=None):
+    """
+    Parses a target pocket PDB into the arrays published to workers
+    """
+    atoms = read_pdb_atoms(pdb_file)
+    ca = atoms["coords"][atoms["atom_name"] == b"CA"].astype(np.float64)
+    arrays = {
+        "coords": atoms["coords"],
+        "atom_name": atoms["atom_name"],
+        "res_name": atoms["res_name"],
+        "ca": ca,
+        "ca_distances": pairwise_distances(ca),
+    }
+    if name is None:
+        name = os.path.basename(pdb_file).replace(".pdb", "")
+    return TargetPocket(name, pdb_file, arrays)
+
+
+class SharedTarget:
+    """
+    Owner of the shared memory block holding a featurized target (parent side).
+    The block is removed by close(), or when leaving a with statement.
+    """
+
+    def __init__(self, target):
+        fields, offset = [], 0
+        for field in TARGET_FIELDS:
+            array = np.ascontiguousarray(target.arrays[field])
+            fields.append((field, array.dtype.str, array.shape, offset))
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        arrays = {}
+        for field, dtype, shape, start in fields:
+            arrays[field] = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=start)
+            arrays[field][...] = target.arrays[field]
+        self.handle = TargetHandle(self.shm.name, target.name, target.path, tuple(fields))
+        # Tasks run in the parent itself (n_jobs=1) reuse these views
+        _attached[self.shm.name] = TargetPocket(target.name, target.path, arrays)
+
+    def close(self):
+        if self.shm is not None:
+            _attached.pop(self.shm.name, None)
+            try:
+                self.shm.close()
+            except BufferError: # Views still referenced, the mapping goes away with the process
+                pass
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def publish_target(pdb_file, name=None):
+    """
+    Featurizes a target pocket and copies it into shared memory
+    """
+    return SharedTarget(featurize_target(pdb_file, name))
+
+
+def _open_untracked(shm_name):
+    """
+    Attaches to an existing block without registering it with the resource
+    tracker: only the publisher owns (and unlinks) it
+    """
+    try:
+        return shared_memory.SharedMemory(name=shm_name, track=False) # Python >= 3.13
+    except TypeError:
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=shm_name)
+    finally:
+        resource_tracker.register = register
+
+
+def attach_target(handle):
+    """
+    Per-process view of a published target (zero-copy, attached once per worker)
+    """
+    if handle.shm_name not in _attached:
+        shm = _open_untracked(handle.shm_name)
+        arrays = {}
+        for field, dtype, shape, offset in handle.fields:
+            view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            view.flags.writeable = False
+            arrays[field] = view
+        _attached[handle.shm_name] = TargetPocket(handle.name, handle.path, arrays, shm)
+    return _attached[handle.shm_name]
+
+
+def read_targets(targets_file):
+    """
+    Pockets of a multi-pocket scan, from a JSON list of
+    {"name": ..., "pocket": "pocket.pdb", "center": [x, y, z], "size": [x, y, z]}.
+    Relative pocket paths are resolved from the JSON file's folder.
+    """
+    with open(targets_file) as f:
+        entries = json.load(f)
+    base = os.path.dirname(os.path.abspath(targets_file))
+    targets, names = [], set()
+    for entry in entries:
+        name = str(entry["name"])
+        if name in names:
+            raise ValueError(f"Duplicate target name '{name}' in {targets_file}")
+        names.add(name)
+        center, size = [float(v) for v in entry["center"]], [float(v) for v in entry["size"]]
+        if len(center) != 3 or len(size) != 3:
+            raise ValueError(f"Target '{name}' needs a 3D gridbox center and size")
+        targets.append((name, os.path.join(base, entry["pocket"]), tuple(center), tuple(size)))
+    return targets
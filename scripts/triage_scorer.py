@@ -0,0 +1,218 @@
+import os
+import sys
+import math
+import argparse
+import numpy as np
+from scipy.ndimage import map_coordinates
+from scipy.spatial import cKDTree
+from scipy.stats import spearmanr
+
+from pdb_arrays import read_pdb_atoms
+from geometry_filters import close_pairs
+from patches import load_patches
+from vina_service import padded
+
+# Vina-like empirical score used to rank superposer patches before the real
+# Vina run of FrankVINA 1. Heavy atoms get X-Score types from residue
+# templates; gauss, repulsion, hydrophobic and H-bond terms use the Vina 1.2
+# weights and surface distances (d = r - R_i - R_j, cutoff 8 A). With a gridbox
+# the receptor term of every ligand type is precomputed on a grid and patches
+# are scored by trilinear interpolation, otherwise over KD-tree neighbor lists.
+# No intramolecular terms: patches are rigid poses.
+CUTOFF = 8.0
+GRID_SPACING = 0.375
+W_GAUSS1 = -0.035579
+W_GAUSS2 = -0.005156
+W_REPULSION = 0.840245
+W_HYDROPHOBIC = -0.035069
+W_HBOND = -0.587439
+W_ROT = 0.05846
+
+# X-Score type -> (vdW radius, hydrophobic, donor, acceptor)
+XS_TYPES = {
+    "C_H": (1.9, True, False, False), "C_P": (1.9, False, False, False),
+    "N_P": (1.8, False, False, False), "N_D": (1.8, False, True, False), "N_DA": (1.8, False, True, True),
+    "O_A": (1.7, False, False, True), "O_DA": (1.7, False, True, True),
+    "S_P": (2.0, False, False, False),
+}
+# Polar atoms of the standard residues (everything else: N_P, O_A, S_P)
+POLAR_XS = {
+    "N": "N_D", "OXT": "O_A",
+    ("ARG", "NE"): "N_D", ("ARG", "NH1"): "N_D", ("ARG", "NH2"): "N_D", ("ASN", "ND2"): "N_D",
+    ("GLN", "NE2"): "N_D", ("HIS", "ND1"): "N_DA", ("HIS", "NE2"): "N_DA", ("LYS", "NZ"): "N_D",
+    ("TRP", "NE1"): "N_D", ("SER", "OG"): "O_DA", ("THR", "OG1"): "O_DA", ("TYR", "OH"): "O_DA",
+    ("HOH", "O"): "O_DA", ("PRO", "N"): "N_P",
+}
+# Heavy-atom torsions per residue side chain (Vina counts them in the rotor penalty)
+SIDE_CHAIN_ROTORS = {"ALA": 0, "ARG": 4, "ASN": 2, "ASP": 2, "CYS": 1, "GLN": 3, "GLU": 3, "GLY": 0, "HIS": 2, "ILE": 2,
+                     "LEU": 2, "LYS": 4, "MET": 3, "PHE": 2, "PRO": 0, "SER": 1, "THR": 1, "TRP": 2, "TYR": 2, "VAL": 1}
+# Carbon bonded to N/O is polar (C_P)
+POLAR_BOND = 1.75
+
+
+def xs_types(atoms):
+    """
+    (heavy atom index, X-Score type names) of an atom dict; unknown elements are skipped
+    """
+    elements = np.char.upper(np.char.strip(atoms["element"].astype(str)))
+    atom_names = np.char.strip(atoms["atom_name"].astype(str))
+    res_names = atoms["res_name"].astype(str)
+    heavy = np.flatnonzero(np.isin(elements, ["C", "N", "O", "S"]))
+    elements, atom_names, res_names = elements[heavy], atom_names[heavy], res_names[heavy]
+    types = np.array([{"C": "C_H", "N": "N_P", "O": "O_A", "S": "S_P"}[element] for element in elements], dtype="U4")
+    for i, (element, atom_name, res_name) in enumerate(zip(elements, atom_names, res_names)):
+        if element in "NO":
+            types[i] = POLAR_XS.get((res_name, atom_name), POLAR_XS.get(atom_name, types[i]))
+    heteroatom = (elements == "N") | (elements == "O")
+    for i, j in close_pairs(atoms["coords"][heavy], POLAR_BOND):
+        if elements[i] == "C" and heteroatom[j]:
+            types[i] = "C_P"
+        elif elements[j] == "C" and heteroatom[i]:
+            types[j] = "C_P"
+    return heavy, types
+
+
+def type_properties(types):
+    radius, hydrophobic, donor, acceptor = (np.array(values) for values in zip(*[XS_TYPES[name] for name in types]))
+    return radius.astype(np.float64), hydrophobic.astype(bool), donor.astype(bool), acceptor.astype(bool)
+
+
+def pair_energy(distance, radius_sum, hydrophobic, hbond):
+    """
+    Weighted Vina terms of atom pairs at the given distances
+    """
+    d = distance - radius_sum
+    energy = W_GAUSS1 * np.exp(-(d / 0.5) ** 2) + W_GAUSS2 * np.exp(-((d - 3.0) / 2.0) ** 2)
+    energy += W_REPULSION * np.where(d < 0, d * d, 0.0)
+    energy += W_HYDROPHOBIC * hydrophobic * np.clip(1.5 - d, 0.0, 1.0)
+    energy += W_HBOND * hbond * np.clip(-d / 0.7, 0.0, 1.0)
+    return energy
+
+
+def rotors(atoms):
+    """
+    Approximate Vina rotor count of a peptide patch (backbone phi/psi plus side chains)
+    """
+    residues = atoms["res_name"][np.char.strip(atoms["atom_name"].astype(str)) == "CA"].astype(str)
+    if len(residues) == 0:
+        return 0
+    return 2 * (len(residues) - 1) + sum(SIDE_CHAIN_ROTORS.get(res_name, 0) for res_name in residues)
+
+
+class TriageScorer:
+    """
+    Scores ligand atom dicts against one receptor. Grid maps are built once per
+    scorer when a gridbox is given (padded like the Vina service box).
+    """
+
+    def __init__(self, receptor_atoms, center=None, size=None, spacing=GRID_SPACING):
+        heavy, types = xs_types(receptor_atoms)
+        self.coords = receptor_atoms["coords"][heavy].astype(np.float64)
+        self.radius, self.hydrophobic, self.donor, self.acceptor = type_properties(types)
+        self.tree = cKDTree(self.coords)
+        self.maps = None
+        if center is not None:
+            self.build_grid(np.asarray(center, dtype=np.float64), np.asarray(padded(size)), spacing)
+
+    def build_grid(self, center, size, spacing, chunk_size=32768):
+        self.origin = center - size / 2
+        self.spacing = spacing
+        shape = tuple(int(math.ceil(value / spacing)) + 1 for value in size)
+        axes = [self.origin[k] + spacing * np.arange(shape[k]) for k in range(3)]
+        points = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+        maps = {name: np.zeros(len(points)) for name in XS_TYPES}
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start + chunk_size]
+            pairs = cKDTree(chunk).sparse_distance_matrix(self.tree, CUTOFF, output_type="ndarray")
+            i, j, distance = pairs["i"], pairs["j"], pairs["v"]
+            for name, (radius, hydrophobic, donor, acceptor) in XS_TYPES.items():
+                hbond = (donor & self.acceptor[j]) | (acceptor & self.donor[j])
+                energy = pair_energy(distance, radius + self.radius[j], hydrophobic & self.hydrophobic[j], hbond)
+                maps[name][start:start + len(chunk)] = np.bincount(i, weights=energy, minlength=len(chunk))
+        self.maps = {name: values.reshape(shape) for name, values in maps.items()}
+
+    def intermolecular(self, atoms):
+        heavy, types = xs_types(atoms)
+        coords = atoms["coords"][heavy].astype(np.float64)
+        if len(coords) == 0:
+            return 0.0
+        if self.maps is not None:
+            index = ((coords - self.origin) / self.spacing).T
+            return float(sum(map_coordinates(self.maps[name], index[:, types == name], order=1, mode="nearest").sum()
+                             for name in np.unique(types)))
+        radius, hydrophobic, donor, acceptor = type_properties(types)
+        pairs = cKDTree(coords).sparse_distance_matrix(self.tree, CUTOFF, output_type="ndarray")
+        i, j, distance = pairs["i"], pairs["j"], pairs["v"]
+        hbond = (donor[i] & self.acceptor[j]) | (acceptor[i] & self.donor[j])
+        return float(pair_energy(distance, radius[i] + self.radius[j], hydrophobic[i] & self.hydrophobic[j], hbond).sum())
+
+    def score(self, atoms):
+        """
+        Vina-like binding score (kcal/mol, lower is better) of a posed ligand
+        """
+        return self.intermolecular(atoms) / (1 + W_ROT * rotors(atoms))
+
+
+def triage_patches(patches, scorer):
+    """
+    {patch: triage score} of (name, atoms) patches
+    """
+    return {name: scorer.score(atoms) for name, atoms in patches}
+
+
+def select_top(scores, fraction, minimum=10):
+    """
+    Best-scored fraction of the patches (at least minimum of them), best first
+    """
+    ranked = sorted(scores, key=scores.get)
+    return ranked[:max(minimum, int(math.ceil(fraction * len(ranked))))]
+
+
+def correlation_report(triage, vina, fraction, selected, top=10):
+    """
+    Spearman correlation between triage and Vina scores of the patches scored by
+    both, plus the share of the Vina top patches the triage selection kept
+    """
+    common = [name for name in triage if vina.get(name) is not None]
+    report = {"patches": len(triage), "selected": len(selected), "fraction": fraction, "vina_scored": len(common),
+              "spearman": None, "spearman_p": None}
+    if len(common) >= 3:
+        rho, p_value = spearmanr([triage[name] for name in common], [vina[name] for name in common])
+        report["spearman"], report["spearman_p"] = float(rho), float(p_value)
+    if len(common) == len(triage): # Every patch went to Vina (--triage_report)
+        vina_top = sorted(common, key=vina.get)[:top]
+        report[f"top{top}_recall"] = len(set(vina_top) & set(selected)) / max(1, len(vina_top))
+    return report
+
+
+def main():
+    program_description = "Rank the patches of a superposer output folder with the NumPy triage score"
+    parser = argparse.ArgumentParser(description=program_description)
+    parser.add_argument("-r", "--receptor", type=str, required=True, help="receptor PDB")
+    parser.add_argument("-f", "--folder", type=str, default=".",
+                        help="superposer output folder (patch_file_*.pdb and/or fragments.jsonl)")
+    parser.add_argument("--center", type=float, nargs=3, default=None, metavar=("X", "Y", "Z"),
+                        help="gridbox center: receptor maps on a grid (default: neighbor lists)")
+    parser.add_argument("--size", type=float, nargs=3, default=None, metavar=("X", "Y", "Z"), help="gridbox size")
+    parser.add_argument("-o", "--output", type=str, default=None, help="write 'patch<tab>triage' lines, best first")
+    args = parser.parse_args()
+
+    if (args.center is None) != (args.size is None):
+        parser.error("--center and --size go together")
+    if not os.path.exists(args.receptor):
+        print(f"Error: {args.receptor} not found.")
+        sys.exit(1)
+    scorer = TriageScorer(read_pdb_atoms(args.receptor), args.center, args.size)
+    scores = triage_patches(load_patches(args.folder), scorer)
+    ranked = sorted(scores, key=scores.get)
+    for name in ranked[:10]:
+        print(f"{scores[name]:.3f}\t{name}")
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write("patch\ttriage\n")
+            for name in ranked:
+                f.write(f"{name}\t{scores[name]:.3f}\n")
+
+
+if __name__ == "__main__":
+    main()
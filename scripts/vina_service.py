@@ -0,0 +1,201 @@
+import os
+import math
+import shutil
+import subprocess
+import tempfile
+import threading
+
+try:
+    from vina import Vina
+except ImportError: # Bindings missing: every ligand goes through the Vina binary
+    Vina = None
+
+# Vina scoring of FrankVINA ligands with one long-lived scorer per worker. With
+# the Python bindings the receptor is read and the affinity maps are computed
+# once over the superposer gridbox; each ligand is then a local optimization in
+# memory. Logs keep the line scoring_filter() reads from the Vina binary output.
+ENERGY_LINE = "Estimated Free Energy of Binding   : {:.3f} (kcal/mol) [=(1)+(2)+(3)+(4)]\n"
+# Gridbox padding per side: the superposer keeps patch CAs inside the gridbox,
+# side chains and hydrogens may stick out
+BOX_PADDING = 4.0
+BACKENDS = ["auto", "bindings", "cli"]
+# Ligands per Vina invocation (CLI --batch); 1 runs Vina once per ligand
+BATCH_ENV = "FRANKPEPSTEIN_VINA_BATCH"
+DEFAULT_BATCH = 16
+
+
+def read_energy(log_file):
+    """
+    Estimated free energy of binding from a Vina log, None when missing
+    """
+    if not os.path.exists(log_file):
+        return None
+    with open(log_file) as f:
+        for line in f:
+            if "Estimated" in line:
+                return float(line.split(":")[1].split()[0])
+    return None
+
+
+def read_energies(log_file):
+    """
+    Every estimated free energy of a Vina log, in output order (one per --batch ligand)
+    """
+    with open(log_file) as f:
+        return [float(line.split(":")[1].split()[0]) for line in f if "Estimated" in line]
+
+
+def padded(size):
+    return [float(value) + 2 * BOX_PADDING for value in size]
+
+
+def ligand_box(ligand_pdbqts):
+    """
+    (center, size) of the box around all ligands, as --autobox does for one
+    """
+    coords = []
+    for ligand_pdbqt in ligand_pdbqts:
+        with open(ligand_pdbqt) as f:
+            coords += [(float(line[30:38]), float(line[38:46]), float(line[46:54]))
+                       for line in f if line.startswith(("ATOM", "HETATM"))]
+    low = [min(values) for values in zip(*coords)]
+    high = [max(values) for values in zip(*coords)]
+    return [(a + b) / 2 for a, b in zip(low, high)], [b - a for a, b in zip(low, high)]
+
+
+def default_batch_size():
+    return int(os.environ.get(BATCH_ENV, DEFAULT_BATCH))
+
+
+def batches(items, n_workers, batch_size):
+    """
+    Splits items into batches of at most batch_size, small enough to keep n_workers busy
+    """
+    size = max(1, min(batch_size, math.ceil(len(items) / max(1, n_workers))))
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+class CLIScorer:
+    """
+    One Vina binary call per ligand (--autobox around the ligand without a gridbox)
+    """
+
+    name = "cli"
+
+    def __init__(self, vina_path, receptor_pdbqt, center=None, size=None):
+        self.vina_path = vina_path
+        self.receptor_pdbqt = receptor_pdbqt
+        if center is None:
+            self.box = ["--autobox"]
+        else:
+            self.box = [f"--{option}_{axis}={value}" for option, values in (("center", center), ("size", padded(size)))
+                        for axis, value in zip("xyz", values)]
+
+    def score(self, ligand_pdbqt, out_pdbqt, log_file):
+        with open(log_file, "w") as log:
+            subprocess.run([self.vina_path, "--verbosity", "0", *self.box, "--local_only",
+                            "--receptor", self.receptor_pdbqt, "--ligand", ligand_pdbqt, "--out", out_pdbqt],
+                           stdout=log, stderr=subprocess.DEVNULL)
+        return read_energy(log_file)
+
+    def score_batch(self, ligands):
+        """
+        Scores [(ligand_pdbqt, out_pdbqt, log_file), ...] in one Vina run (--batch)
+        and returns their energies in the same order. Without a gridbox the box
+        spans all ligands. When the run fails or its output does not map back to
+        the ligands, every ligand is scored on its own.
+        """
+        if len(ligands) < 2:
+            return [self.score(*ligand) for ligand in ligands]
+        if self.box == ["--autobox"]:
+            center, size = ligand_box([ligand_pdbqt for ligand_pdbqt, out_pdbqt, log_file in ligands])
+            box = [f"--{option}_{axis}={value}" for option, values in (("center", center), ("size", padded(size)))
+                   for axis, value in zip("xyz", values)]
+        else:
+            box = self.box
+        out_dir = tempfile.mkdtemp(prefix="vina_batch.", dir=os.path.dirname(os.path.abspath(ligands[0][1])))
+        batch_log = os.path.join(out_dir, "batch.log")
+        try:
+            with open(batch_log, "w") as log:
+                result = subprocess.run([self.vina_path, "--verbosity", "0", *box, "--local_only",
+                                         "--receptor", self.receptor_pdbqt,
+                                         "--batch", *[ligand_pdbqt for ligand_pdbqt, out_pdbqt, log_file in ligands],
+                                         "--dir", out_dir], stdout=log, stderr=subprocess.DEVNULL)
+            energies = read_energies(batch_log)
+            # Vina names batch outputs {dir}/{ligand stem}_out.pdbqt
+            outputs = [os.path.join(out_dir, os.path.splitext(os.path.basename(ligand_pdbqt))[0] + "_out.pdbqt")
+                       for ligand_pdbqt, out_pdbqt, log_file in ligands]
+            if result.returncode != 0 or len(energies) != len(ligands) or not all(map(os.path.exists, outputs)):
+                print(f"DEBUG: Vina batch of {len(ligands)} ligands failed, scoring them one by one")
+                return [self.score(*ligand) for ligand in ligands]
+            for (ligand_pdbqt, out_pdbqt, log_file), output, energy in zip(ligands, outputs, energies):
+                os.replace(output, out_pdbqt)
+                with open(log_file, "w") as f:
+                    f.write(ENERGY_LINE.format(energy))
+            return energies
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+
+class BindingsScorer:
+    """
+    Receptor and affinity maps loaded once; ligands scored in memory. Ligands
+    outside the maps fall back to the binary.
+    """
+
+    name = "bindings"
+
+    def __init__(self, vina_path, receptor_pdbqt, center, size):
+        self.vina = Vina(sf_name="vina", cpu=1, verbosity=0)
+        self.vina.set_receptor(rigid_pdbqt_filename=receptor_pdbqt)
+        self.vina.compute_vina_maps(center=list(center), box_size=padded(size))
+        self.fallback = CLIScorer(vina_path, receptor_pdbqt)
+
+    def score(self, ligand_pdbqt, out_pdbqt, log_file):
+        try:
+            self.vina.set_ligand_from_file(ligand_pdbqt)
+            energy = float(self.vina.optimize()[0])
+        except RuntimeError: # e.g. ligand outside the grid box
+            return self.fallback.score(ligand_pdbqt, out_pdbqt, log_file)
+        self.vina.write_pose(out_pdbqt, overwrite=True)
+        with open(log_file, "w") as f:
+            f.write(ENERGY_LINE.format(energy))
+        return energy
+
+    def score_batch(self, ligands):
+        """
+        Receptor and maps are already shared: the batch is scored ligand by ligand in memory
+        """
+        return [self.score(*ligand) for ligand in ligands]
+
+
+def make_scorer(vina_path, receptor_pdbqt, center=None, size=None, backend="auto"):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown Vina backend '{backend}' (choose from {', '.join(BACKENDS)})")
+    use_bindings = backend == "bindings" or (backend == "auto" and Vina is not None and center is not None)
+    if not use_bindings:
+        return CLIScorer(vina_path, receptor_pdbqt, center, size)
+    if Vina is None:
+        raise ImportError("Vina Python bindings are not installed (conda install -c conda-forge vina)")
+    if center is None or size is None:
+        raise ValueError("The bindings backend needs the gridbox (center and size)")
+    return BindingsScorer(vina_path, receptor_pdbqt, center, size)
+
+
+# Per-thread registry: Vina objects are not thread-safe, and each joblib worker
+# process (or --stream scoring thread) keeps its scorer across ligands
+_local = threading.local()
+
+
+def get_scorer(vina_path, receptor_pdbqt, center=None, size=None, backend="auto"):
+    """
+    Scorer of this thread, built on first use
+    """
+    key = (vina_path, os.path.abspath(receptor_pdbqt), os.path.getmtime(receptor_pdbqt),
+           None if center is None else tuple(center), None if size is None else tuple(size), backend)
+    scorers = getattr(_local, "scorers", None)
+    if scorers is None:
+        scorers = _local.scorers = {}
+    if key not in scorers:
+        scorers[key] = make_scorer(vina_path, receptor_pdbqt, center, size, backend)
+    return scorers[key]